@@ -12,11 +12,43 @@ config = Config(
 class Settings(BaseSettings):
     mm_node_checker: Annotated[str, setting_field("", "mm node checker url")]
     proxies_url: Annotated[str, setting_field("http://localhost:8000", "proxies url, each proxy on new line")]
+    proxy_max_concurrency: Annotated[int, setting_field(20, "Max parallel requests through one proxy")]
+    proxy_rate_limit: Annotated[int, setting_field(0, "Max requests per second through one proxy, 0 - unlimited")]
+    proxy_affinity: Annotated[bool, setting_field(False, "Keep using the same proxy for an rpc url while it is healthy")]
     round_ndigits: Annotated[int, setting_field(5, "round ndigits")]
-    limit_network_workers: Annotated[int, setting_field(20, "How many requests to one network in parallel")]
+    limit_network_workers: Annotated[int, setting_field(20, "Initial number of parallel requests to one rpc url")]
+    max_rpc_concurrency: Annotated[int, setting_field(100, "Max number of parallel requests to one rpc url")]
+    rpc_latency_target_ms: Annotated[int, setting_field(2000, "Raise rpc url concurrency only while responses are faster")]
+    hedge_percentile: Annotated[
+        int, setting_field(0, "Duplicate a balance request to another node after this latency percentile, 0 - disabled")
+    ]
+    hedge_max_percent: Annotated[int, setting_field(10, "Max extra balance requests sent by hedging, percent")]
+    evm_batch_size: Annotated[int, setting_field(0, "How many EVM balance calls to pack in one JSON-RPC batch, 0 - disabled")]
+    solana_batch_size: Annotated[int, setting_field(100, "How many Solana balances to read with getMultipleAccounts in one task")]
+    starknet_batch_size: Annotated[int, setting_field(50, "How many Starknet balances to read with one JSON-RPC batch")]
+    aptos_batch_size: Annotated[int, setting_field(20, "How many Aptos balances to read in one task")]
+    multicall_batch_size: Annotated[int, setting_field(500, "How many EVM balances to read with one multicall request")]
+    bulk_write_size: Annotated[int, setting_field(500, "How many balance results to buffer before a bulk write")]
+    http_pool_limit_per_key: Annotated[int, setting_field(20, "Max connections per (rpc node, proxy) http client")]
+    http_pool_idle_seconds: Annotated[int, setting_field(300, "Close http clients idle for this many seconds")]
     limit_naming_workers: Annotated[int, setting_field(20, "How many requests to one naming in parallel")]
     check_balance_interval: Annotated[int, setting_field(15, "Check balance interval in minutes")]
-    check_name_interval: Annotated[int, setting_field(15, "Check name interval in minutes")]
+    max_check_balance_interval: Annotated[
+        int, setting_field(1440, "Check interval in minutes for accounts which balance doesn't change for long")
+    ]
+    check_name_interval: Annotated[int, setting_field(15, "Check name interval in minutes, also how long a name is cached")]
+    check_empty_name_interval: Annotated[
+        int, setting_field(360, "Check interval in minutes for accounts without a name, also how long it is cached")
+    ]
+    ens_reverse_records: Annotated[
+        str, setting_field("", "ENS ReverseRecords contract for bulk reverse resolution, empty - one request per account")
+    ]
+    ens_batch_size: Annotated[int, setting_field(200, "How many accounts to reverse resolve with one ReverseRecords call")]
+    name_cache_size: Annotated[int, setting_field(100_000, "How many resolved names to keep in memory")]
+    transfer_scan_sweep_interval: Annotated[
+        int, setting_field(1440, "Check token balance interval in minutes for networks with transfer scan")
+    ]
+    transfer_scan_max_blocks: Annotated[int, setting_field(1000, "How many blocks to scan with one eth_getLogs request")]
 
 
 class State(BaseState):
@@ -0,0 +1,75 @@
+import asyncio
+import contextlib
+import time
+from collections.abc import AsyncIterator
+
+from mm_result import Result
+
+from app.core.health import ewma, is_overload_error
+
+DECREASE_FACTOR = 0.5
+MAX_ERROR_RATE = 0.05  # don't increase concurrency if the error rate is higher
+EWMA_ALPHA = 0.1
+
+
+class AimdLimiter:
+    """Concurrency limit of one RPC url: additive increase while the node is healthy, multiplicative decrease on overload."""
+
+    def __init__(self, limit: int, max_limit: int) -> None:
+        self.limit = float(limit)
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self.latency: float | None = None  # ewma of response time, seconds
+        self.error_rate = 0.0  # ewma
+        self.decreased_at = 0.0  # perf_counter time of the last decrease
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def on_result(self, started_at: float, response_time: float, success: bool, overloaded: bool, latency_target: float) -> None:
+        self.latency = ewma(self.latency, response_time, EWMA_ALPHA)
+        self.error_rate = ewma(self.error_rate, 0.0 if success else 1.0, EWMA_ALPHA)
+        if overloaded:
+            # requests started before the last decrease were sent with the old limit, don't punish twice for them
+            if started_at > self.decreased_at:
+                self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+                self.decreased_at = time.perf_counter()
+        elif success and response_time <= latency_target and self.error_rate < MAX_ERROR_RATE:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)  # +1 per limit of successful requests
+
+
+class AimdController:
+    def __init__(self) -> None:
+        self.limiters: dict[str, AimdLimiter] = {}  # rpc_url -> limiter
+        self.initial_limit = 20
+        self.max_limit = 100
+        self.latency_target = 2.0
+
+    def configure(self, initial_limit: int, max_limit: int, latency_target: float) -> None:
+        self.initial_limit = initial_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        for limiter in self.limiters.values():
+            limiter.max_limit = max_limit
+            limiter.limit = min(limiter.limit, float(max_limit))
+
+    def get(self, rpc_url: str) -> AimdLimiter:
+        if rpc_url not in self.limiters:
+            self.limiters[rpc_url] = AimdLimiter(min(self.initial_limit, self.max_limit), self.max_limit)
+        return self.limiters[rpc_url]
+
+    def total_limit(self, rpc_urls: list[str]) -> int:
+        return sum(int(self.get(url).limit) for url in rpc_urls)
+
+    def on_result(self, rpc_url: str, started_at: float, response_time: float, res: Result[object]) -> None:
+        self.get(rpc_url).on_result(started_at, response_time, res.is_ok(), is_overload_error(res), self.latency_target)
@@ -0,0 +1,32 @@
+import time
+from collections.abc import Awaitable, Callable
+
+REFRESH_SECONDS = 30  # how often services schedule refresh_if_read, the max age of a value being read
+IDLE_SECONDS = 10 * 60  # stop refreshing if nobody has read the value for this long
+
+
+class BackgroundCache[T]:
+    """A value computed by a loader. A scheduled task refreshes it while somebody reads it,
+    so readers get the last value without waiting for the loader. Only the first read waits."""
+
+    def __init__(self, loader: Callable[[], Awaitable[T]]) -> None:
+        self.loader = loader
+        self.value: T | None = None
+        self.refreshed_at: float | None = None  # unix time
+        self.read_at = 0.0
+
+    async def get(self) -> T:
+        self.read_at = time.time()
+        if self.value is None:
+            return await self.refresh()
+        return self.value
+
+    async def refresh(self) -> T:
+        self.value = await self.loader()
+        self.refreshed_at = time.time()
+        return self.value
+
+    async def refresh_if_read(self) -> None:
+        """For the scheduler, a value nobody reads is not refreshed."""
+        if self.value is not None and time.time() - self.read_at < IDLE_SECONDS:
+            await self.refresh()
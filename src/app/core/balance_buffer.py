@@ -0,0 +1,120 @@
+from collections.abc import Callable
+from datetime import datetime
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Self
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.asynchronous.collection import AsyncCollection
+from pymongo.errors import BulkWriteError
+
+if TYPE_CHECKING:
+    from app.core.db import RpcMonitoring
+
+DUPLICATE_KEY_ERROR = 11000
+SUMMARY_COUNTERS = ("total", "non_zero", "checked")  # GroupCoinSummary fields changed by $inc, the others by $max
+
+
+class BalanceBuffer:
+    """Pending writes of balance results. Updates of the same document are merged, the newest value wins,
+    group summary deltas are summed. A flush takes the buffer and gives back what it failed to write,
+    so the next flush retries it."""
+
+    def __init__(self) -> None:
+        self.group_balances: dict[tuple[ObjectId, str], dict[str, Any]] = {}  # (group, coin) -> $set
+        self.account_balances: dict[ObjectId, dict[str, Any]] = {}  # account_balance.id -> $set
+        self.group_summaries: dict[ObjectId, dict[str, dict[str, Any]]] = {}  # group -> {"$inc": .., "$max": ..}
+        self.rpc_monitoring: list[RpcMonitoring] = []
+
+    def pending_count(self) -> int:
+        return len(self.account_balances) + len(self.rpc_monitoring)
+
+    def take(self) -> Self:
+        taken = type(self)()
+        taken.group_balances, self.group_balances = self.group_balances, {}
+        taken.account_balances, self.account_balances = self.account_balances, {}
+        taken.group_summaries, self.group_summaries = self.group_summaries, {}
+        taken.rpc_monitoring, self.rpc_monitoring = self.rpc_monitoring, []
+        return taken
+
+    def restore(self, taken: Self) -> None:
+        """Merge back what a flush failed to write. Updates added while it was writing are newer, they win."""
+        self.group_balances = merge_sets(taken.group_balances, self.group_balances)
+        self.account_balances = merge_sets(taken.account_balances, self.account_balances)
+        for group, update in taken.group_summaries.items():
+            self._merge_summary(group, update)
+        self.rpc_monitoring = taken.rpc_monitoring + self.rpc_monitoring
+
+    def add_summary_delta(
+        self, group: ObjectId, coin: str, balance: Decimal, previous: Decimal | None, checked_at: datetime
+    ) -> None:
+        """The change of the group summary by one check, previous is the balance before it, None - never checked."""
+        prefix = f"coins.{coin}."
+        deltas = {
+            prefix + "total": balance - (previous or Decimal(0)),
+            prefix + "non_zero": int(balance != 0) - int(bool(previous)),
+            prefix + "checked": int(previous is None),
+            "version": 1,  # guards rebuilds against concurrent deltas
+        }
+        maxima = {prefix + "checked_at": checked_at}
+        if previous is not None and balance != previous:
+            maxima[prefix + "changed_at"] = checked_at
+        self._merge_summary(group, {"$inc": {k: v for k, v in deltas.items() if v}, "$max": maxima})
+
+    def _merge_summary(self, group: ObjectId, update: dict[str, dict[str, Any]]) -> None:
+        merged = self.group_summaries.setdefault(group, {"$inc": {}, "$max": {}})
+        for field, delta in update["$inc"].items():
+            merged["$inc"][field] = merged["$inc"].get(field, 0) + delta
+        for field, value in update["$max"].items():
+            merged["$max"][field] = max(merged["$max"].get(field, value), value)
+
+
+def summary_correction(summary: dict[str, dict[str, Any]], calculated: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    """The update which makes a group summary equal to the calculated one, both are coin -> dumped GroupCoinSummary.
+    Counters are corrected by $inc, so deltas written concurrently are kept. Empty if they are equal."""
+    correction: dict[str, dict[str, Any]] = {"$inc": {}, "$set": {}, "$unset": {}}
+    for coin in summary.keys() - calculated.keys():
+        correction["$unset"][f"coins.{coin}"] = ""
+    for coin, fields in calculated.items():
+        current = summary.get(coin, {})
+        for field, value in fields.items():
+            if field in SUMMARY_COUNTERS:
+                if delta := value - current.get(field, 0):
+                    correction["$inc"][f"coins.{coin}.{field}"] = delta
+            elif current.get(field) != value:
+                correction["$set"][f"coins.{coin}.{field}"] = value
+    return {op: f for op, f in correction.items() if f}
+
+
+def merge_sets[K](older: dict[K, dict[str, Any]], newer: dict[K, dict[str, Any]]) -> dict[K, dict[str, Any]]:
+    for key, update in newer.items():
+        older.setdefault(key, {}).update(update)
+    return older
+
+
+def unwritten(error: BulkWriteError, count: int, *, ordered: bool) -> set[int]:
+    """Indexes of the operations a failed bulk write didn't apply. A duplicate key was written by an earlier attempt.
+    An ordered write stops at the first error, the operations after it were not tried."""
+    errors: list[dict[str, Any]] = error.details.get("writeErrors", [])
+    failed = {e["index"] for e in errors if e.get("code") != DUPLICATE_KEY_ERROR}
+    if ordered and errors:
+        failed |= set(range(errors[0]["index"] + 1, count))
+    return failed
+
+
+async def bulk_update[K](
+    collection: AsyncCollection[Any], updates: dict[K, dict[str, Any]], request: Callable[[K, dict[str, Any]], UpdateOne]
+) -> None:
+    """Write the updates and remove the written ones from the dict, after a failure it keeps only the unwritten ones."""
+    if not updates:
+        return
+    keys = list(updates)
+    try:
+        await collection.bulk_write([request(key, updates[key]) for key in keys], ordered=False)
+    except BulkWriteError as e:
+        failed = unwritten(e, len(keys), ordered=False)
+        for i, key in enumerate(keys):
+            if i not in failed:
+                del updates[key]
+        raise
+    updates.clear()
@@ -1,13 +1,22 @@
-from mm_apt import ans, balance
+from mm_apt import ans
 from mm_result import Result
-from mm_web3 import Proxies, retry
+
+from app.core.http_pool import http_pool
+
+APTOS_COIN = "0x1::aptos_coin::AptosCoin"
 
 
 async def get_balance(rpc_url: str, account: str, token: str | None = None, proxy: str | None = None) -> Result[int]:
-    if token is None:
-        token = "0x1::aptos_coin::AptosCoin"  # nosec  # noqa: S105
-    return await balance.get_balance(rpc_url, account, coin_type=token, proxy=proxy, timeout=7.0)
+    payload = {"function": "0x1::coin::balance", "type_arguments": [token or APTOS_COIN], "arguments": [account]}
+    res = await http_pool.request_json(f"{rpc_url.rstrip('/')}/view", method="POST", json_data=payload, proxy=proxy, timeout=7.0)
+    if res.is_err():
+        return res
+    value = res.unwrap()
+    try:
+        return Result.ok(int(value[0]))
+    except IndexError, KeyError, TypeError, ValueError:
+        return Result.err("invalid_balance", context={"value": value})
 
 
-async def get_ans_name(account: str, proxies: Proxies = None) -> Result[str | None]:
-    return await retry.retry_with_proxy(5, proxies, lambda proxy: ans.address_to_primary_name(account, proxy=proxy, timeout=5.0))
+async def get_ans_name(account: str, proxy: str | None = None) -> Result[str | None]:
+    return await ans.address_to_primary_name(account, proxy=proxy, timeout=5.0)
@@ -1,15 +1,94 @@
-from mm_eth import retry, rpc
+from eth_abi import decode, encode
+from eth_utils import function_signature_to_4byte_selector
+from mm_eth import retry
 from mm_result import Result
 from mm_web3 import Proxies
 
+from app.core.blockchains import jsonrpc
+
+BALANCE_OF_SELECTOR = "0x70a08231"
+GET_NAMES_SELECTOR = function_signature_to_4byte_selector("getNames(address[])")
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"  # Transfer(address,address,uint256)
+
 
 async def get_balance(
     node: str, account: str, token: str | None = None, proxy: str | None = None, timeout: float = 7
 ) -> Result[int]:
-    if token:
-        return await rpc.erc20_balance(node, token=token, wallet=account, proxy=proxy, timeout=timeout)
-    return await rpc.eth_get_balance(node, account, timeout=timeout, proxy=proxy)
+    method, params = _balance_call(account, token)
+    return _parse_hex_int(await jsonrpc.request(node, method, params, proxy=proxy, timeout=timeout))
+
+
+async def get_balances(
+    node: str, items: list[tuple[str, str | None]], proxy: str | None = None, timeout: float = 7
+) -> list[Result[int]]:
+    """Get balances for (account, token) pairs in one JSON-RPC batch request. token=None means a native coin."""
+    calls = [_balance_call(account, token) for account, token in items]
+    return [_parse_hex_int(res) for res in await jsonrpc.batch_request(node, calls, proxy=proxy, timeout=timeout)]
+
+
+async def get_block_number(node: str, proxy: str | None = None, timeout: float = 7) -> Result[int]:
+    return _parse_hex_int(await jsonrpc.request(node, "eth_blockNumber", [], proxy=proxy, timeout=timeout))
+
+
+async def get_transfer_accounts(
+    node: str, tokens: list[str], from_block: int, to_block: int, proxy: str | None = None, timeout: float = 20
+) -> Result[set[tuple[str, str]]]:
+    """Lowercased (token, account) pairs of senders and receivers of the tokens in the block range, inclusive."""
+    params = [{"fromBlock": hex(from_block), "toBlock": hex(to_block), "address": tokens, "topics": [TRANSFER_TOPIC]}]
+    res = await jsonrpc.request(node, "eth_getLogs", params, proxy=proxy, timeout=timeout)
+    if res.is_err():
+        return res  # type:ignore[return-value]
+    logs = res.unwrap()
+    if not isinstance(logs, list):
+        return Result.err("invalid_response", context={"response": logs})
+    result: set[tuple[str, str]] = set()
+    for log in logs:
+        topics = log.get("topics") or []
+        if len(topics) < 3:  # not an ERC-20 Transfer, e.g. a non-indexed variant
+            continue
+        token = log["address"].lower()
+        result.add((token, "0x" + topics[1][-40:].lower()))
+        result.add((token, "0x" + topics[2][-40:].lower()))
+    return Result.ok(result)
 
 
 async def get_ens_name(rpc_urls: list[str], account: str, proxies: Proxies = None) -> Result[str | None]:
     return await retry.ens_name(5, rpc_urls, proxies, address=account, timeout=5.0)
+
+
+async def get_ens_names(
+    node: str, accounts: list[str], contract: str, proxy: str | None = None, timeout: float = 10
+) -> Result[list[str]]:
+    """Reverse resolve many accounts with one eth_call to an ENS ReverseRecords contract.
+    The contract does the forward verification: a name which doesn't resolve back to the account comes as an empty string."""
+    data = "0x" + (GET_NAMES_SELECTOR + encode(["address[]"], [[a.lower() for a in accounts]])).hex()
+    res = await jsonrpc.request(node, "eth_call", [{"to": contract, "data": data}, "latest"], proxy=proxy, timeout=timeout)
+    if res.is_err():
+        return res  # type:ignore[return-value]
+    value = res.unwrap()
+    try:
+        (names,) = decode(["string[]"], bytes.fromhex(value.removeprefix("0x")))
+    except Exception as e:
+        return Result.err(("invalid_response", e), context={"value": value})
+    if len(names) != len(accounts):
+        return Result.err("invalid_response", context={"value": value})
+    return Result.ok(list(names))
+
+
+def _balance_call(account: str, token: str | None) -> jsonrpc.RpcCall:
+    if token:
+        data = BALANCE_OF_SELECTOR + account.lower().removeprefix("0x").rjust(64, "0")
+        return "eth_call", [{"to": token, "data": data}, "latest"]
+    return "eth_getBalance", [account, "latest"]
+
+
+def _parse_hex_int(res: Result[object]) -> Result[int]:
+    if res.is_err():
+        return res  # type:ignore[return-value]
+    value = res.unwrap()
+    if not isinstance(value, str) or value in ("", "0x"):  # "0x" is returned for calls to a non-contract address
+        return Result.err("invalid_hex_value", context={"value": value})
+    try:
+        return Result.ok(int(value, 16))
+    except ValueError:
+        return Result.err("invalid_hex_value", context={"value": value})
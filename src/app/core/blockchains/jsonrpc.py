@@ -0,0 +1,50 @@
+from collections.abc import Sequence
+from typing import Any
+
+from mm_result import Result
+
+from app.core.http_pool import http_pool
+
+RpcCall = tuple[str, Sequence[object]]  # (method, params)
+
+
+async def batch_request(node: str, calls: Sequence[RpcCall], proxy: str | None = None, timeout: float = 7) -> list[Result[Any]]:
+    """Send several JSON-RPC calls in one HTTP request.
+
+    Returns one result per call, in the same order. If the whole request fails, every call gets the same error.
+    """
+    if not calls:
+        return []
+    payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": list(params)} for i, (method, params) in enumerate(calls)]
+    res = await http_pool.request_json(node, method="POST", json_data=payload, proxy=proxy, timeout=timeout)
+    if res.is_err():
+        return [res for _ in calls]
+
+    json_body = res.unwrap()
+    if not isinstance(json_body, list):
+        # some nodes answer a batch with a single error object, e.g. when batches are disabled
+        error = json_body.get("error") if isinstance(json_body, dict) else None
+        if error:
+            return [Result.err("batch_not_supported", context={"error": error}) for _ in calls]
+        return [Result.err("invalid_batch_response") for _ in calls]
+
+    responses = {item.get("id"): item for item in json_body if isinstance(item, dict)}
+    return [_parse_response(responses.get(i)) for i in range(len(calls))]
+
+
+async def request(node: str, method: str, params: Sequence[object], proxy: str | None = None, timeout: float = 7) -> Result[Any]:
+    payload = {"jsonrpc": "2.0", "id": 1, "method": method, "params": list(params)}
+    res = await http_pool.request_json(node, method="POST", json_data=payload, proxy=proxy, timeout=timeout)
+    if res.is_err():
+        return res
+    return _parse_response(res.unwrap())
+
+
+def _parse_response(item: object) -> Result[Any]:
+    if not isinstance(item, dict):
+        return Result.err("invalid_response")
+    if "error" in item:
+        return Result.err("rpc_error", context={"error": item["error"]})
+    if "result" not in item:
+        return Result.err("invalid_response")
+    return Result.ok(item["result"])
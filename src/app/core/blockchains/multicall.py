@@ -0,0 +1,106 @@
+from eth_abi import decode, encode
+from eth_utils import function_signature_to_4byte_selector
+from mm_result import Result
+
+from app.core.blockchains import jsonrpc
+
+MULTICALL3_ADDRESS = "0xca11bde05977b3631167028862be2a173976ca11"  # the same address on most EVM networks
+
+AGGREGATE3_SELECTOR = function_signature_to_4byte_selector("aggregate3((address,bool,bytes)[])")
+GET_ETH_BALANCE_SELECTOR = function_signature_to_4byte_selector("getEthBalance(address)")
+BALANCE_OF_SELECTOR = function_signature_to_4byte_selector("balanceOf(address)")
+
+# Rough estimations used for chunking, they don't need to be exact
+CALL_CALLDATA_SIZE = 7 * 32  # one (address,bool,bytes) item of aggregate3 with 36 bytes of calldata
+NATIVE_CALL_GAS = 10_000
+TOKEN_CALL_GAS = 35_000
+
+DEFAULT_MAX_CALLDATA_SIZE = 64 * 1024
+DEFAULT_MAX_GAS = 20_000_000
+
+
+def encode_aggregate3(calls: list[tuple[str, bytes]]) -> str:
+    """Encode an aggregate3 call. calls: (target, calldata). Every call is allowed to fail."""
+    data = encode(["(address,bool,bytes)[]"], [[(target.lower(), True, calldata) for target, calldata in calls]])
+    return "0x" + (AGGREGATE3_SELECTOR + data).hex()
+
+
+def decode_aggregate3(value: str) -> list[tuple[bool, bytes]]:
+    (results,) = decode(["(bool,bytes)[]"], bytes.fromhex(value.removeprefix("0x")))
+    return list(results)
+
+
+def balance_call(account: str, token: str | None, multicall_address: str = MULTICALL3_ADDRESS) -> tuple[str, bytes]:
+    """Return (target, calldata) for reading a balance. token=None means a native coin, read via Multicall3.getEthBalance."""
+    account_arg = encode(["address"], [account.lower()])
+    if token:
+        return token, BALANCE_OF_SELECTOR + account_arg
+    return multicall_address, GET_ETH_BALANCE_SELECTOR + account_arg
+
+
+def split_chunks(
+    items: list[tuple[str, str | None]], max_calldata_size: int = DEFAULT_MAX_CALLDATA_SIZE, max_gas: int = DEFAULT_MAX_GAS
+) -> list[list[int]]:
+    """Split (account, token) items into chunks of item indexes, so every chunk fits into one eth_call."""
+    chunks: list[list[int]] = []
+    chunk: list[int] = []
+    calldata_size = gas = 0
+    for i, (_, token) in enumerate(items):
+        call_gas = TOKEN_CALL_GAS if token else NATIVE_CALL_GAS
+        if chunk and (calldata_size + CALL_CALLDATA_SIZE > max_calldata_size or gas + call_gas > max_gas):
+            chunks.append(chunk)
+            chunk, calldata_size, gas = [], 0, 0
+        chunk.append(i)
+        calldata_size += CALL_CALLDATA_SIZE
+        gas += call_gas
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+async def get_balances(
+    node: str,
+    items: list[tuple[str, str | None]],
+    proxy: str | None = None,
+    timeout: float = 7,
+    multicall_address: str = MULTICALL3_ADDRESS,
+    max_calldata_size: int = DEFAULT_MAX_CALLDATA_SIZE,
+    max_gas: int = DEFAULT_MAX_GAS,
+) -> list[Result[int]]:
+    """Get balances for (account, token) pairs via Multicall3.aggregate3. token=None means a native coin.
+
+    Items are chunked by calldata size and gas, all chunks are sent in one JSON-RPC batch request.
+    """
+    chunks = split_chunks(items, max_calldata_size=max_calldata_size, max_gas=max_gas)
+    calls: list[jsonrpc.RpcCall] = []
+    for chunk in chunks:
+        data = encode_aggregate3([balance_call(*items[i], multicall_address=multicall_address) for i in chunk])
+        calls.append(("eth_call", [{"to": multicall_address, "data": data}, "latest"]))
+
+    if len(calls) == 1:
+        responses = [await jsonrpc.request(node, *calls[0], proxy=proxy, timeout=timeout)]
+    else:
+        responses = await jsonrpc.batch_request(node, calls, proxy=proxy, timeout=timeout)
+
+    results: list[Result[int]] = [Result.err("not started yet") for _ in items]
+    for chunk, response in zip(chunks, responses, strict=True):
+        if response.is_err():
+            for i in chunk:
+                results[i] = response
+            continue
+        try:
+            decoded = decode_aggregate3(response.unwrap())
+        except Exception as e:
+            for i in chunk:
+                results[i] = Result.err(("invalid_multicall_response", e))
+            continue
+        if len(decoded) != len(chunk):
+            for i in chunk:
+                results[i] = Result.err("invalid_multicall_response")
+            continue
+        for i, (success, return_data) in zip(chunk, decoded, strict=True):
+            if success and len(return_data) == 32:
+                results[i] = Result.ok(int.from_bytes(return_data, "big"))
+            else:
+                results[i] = Result.err("multicall_item_failed", context={"return_data": "0x" + return_data.hex()})
+    return results
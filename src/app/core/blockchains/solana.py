@@ -1,8 +1,150 @@
+import base64
+import functools
+import struct
+from typing import Any
+
 from mm_result import Result
-from mm_sol import rpc, spl_token
+from solders.pubkey import Pubkey
+
+from app.core.blockchains import jsonrpc
+
+MAX_MULTIPLE_ACCOUNTS = 100  # getMultipleAccounts limit
+SPL_PROGRAM = "TokenkegQfeZyiNwAJbNbGKPFXCWuBvf9Ss623VQ5DA"
+SPL_2022_PROGRAM = "TokenzQdBNbLqP5VEhdkAS6EPFLC1PHnBqCXEpPxuEb"
+SPL_PROGRAMS = {SPL_PROGRAM, SPL_2022_PROGRAM}
+ASSOCIATED_PROGRAM = Pubkey.from_string("ATokenGPvbdGVxr1b2hvZbsiqW5xWRoeDdw8hHMqS")
+TOKEN_ACCOUNT_MIN_SIZE = 165
+
+_mint_programs: dict[str, str] = {}  # mint -> token program
 
 
 async def get_balance(rpc_url: str, account: str, token: str | None = None, proxy: str | None = None) -> Result[int]:
     if token:
-        return await spl_token.get_balance(rpc_url, owner=account, token=token, proxy=proxy, timeout=5)
-    return await rpc.get_balance(rpc_url, account, proxy=proxy, timeout=5)
+        params = [account, {"mint": token}, {"encoding": "jsonParsed"}]
+        return parse_token_accounts(await jsonrpc.request(rpc_url, "getTokenAccountsByOwner", params, proxy=proxy, timeout=5))
+
+    res = await jsonrpc.request(rpc_url, "getBalance", [account], proxy=proxy, timeout=5)
+    if res.is_err():
+        return res
+    value = res.unwrap().get("value") if isinstance(res.unwrap(), dict) else None
+    if not isinstance(value, int):
+        return Result.err("invalid_balance", context={"result": res.unwrap()})
+    return Result.ok(value)
+
+
+async def get_balances(
+    rpc_url: str, items: list[tuple[str, str | None]], proxy: str | None = None, timeout: float = 10
+) -> list[Result[int]]:
+    """Get balances for (account, token) pairs with getMultipleAccounts. token=None means SOL.
+
+    SPL token balances are read from associated token accounts, derived locally and decoded from the raw account data.
+    If the associated token account doesn't exist or the mint program is unknown, the owner may hold the token
+    in other token accounts, so its token accounts are scanned with getTokenAccountsByOwner, as in get_balance.
+    """
+    results: list[Result[int]] = [Result.err("not started yet") for _ in items]
+    mint_programs = await _get_mint_programs(rpc_url, [token for _, token in items if token], proxy, timeout)
+
+    addresses: dict[int, str] = {}  # item index -> address to read
+    scan: list[int] = []  # item indexes to read with getTokenAccountsByOwner
+    for i, (account, token) in enumerate(items):
+        if token is None:
+            addresses[i] = account
+            continue
+        program = mint_programs.get(token)
+        if program is None:
+            scan.append(i)
+            continue
+        try:
+            addresses[i] = associated_token_address(account, token, program)
+        except ValueError as e:
+            results[i] = Result.err(("invalid_address", e))
+
+    indexes = list(addresses)
+    for start in range(0, len(indexes), MAX_MULTIPLE_ACCOUNTS):
+        chunk = indexes[start : start + MAX_MULTIPLE_ACCOUNTS]
+        res = await _get_multiple_accounts(rpc_url, [addresses[i] for i in chunk], {"encoding": "base64"}, proxy, timeout)
+        if res.is_err():
+            for i in chunk:
+                results[i] = res
+            continue
+        for i, account_info in zip(chunk, res.unwrap(), strict=True):
+            token = items[i][1]
+            if token is None:
+                results[i] = parse_lamports(account_info)
+            elif account_info is None:
+                scan.append(i)
+            else:
+                results[i] = parse_token_account(account_info, token)
+
+    calls = [("getTokenAccountsByOwner", [items[i][0], {"mint": items[i][1]}, {"encoding": "jsonParsed"}]) for i in scan]
+    for i, res in zip(scan, await jsonrpc.batch_request(rpc_url, calls, proxy=proxy, timeout=timeout), strict=True):
+        results[i] = parse_token_accounts(res)
+    return results
+
+
+@functools.lru_cache(maxsize=100_000)
+def associated_token_address(owner: str, mint: str, token_program: str) -> str:
+    seeds = [bytes(Pubkey.from_string(owner)), bytes(Pubkey.from_string(token_program)), bytes(Pubkey.from_string(mint))]
+    return str(Pubkey.find_program_address(seeds, ASSOCIATED_PROGRAM)[0])
+
+
+def parse_lamports(account_info: object) -> Result[int]:
+    if account_info is None:
+        return Result.ok(0)
+    lamports = account_info.get("lamports") if isinstance(account_info, dict) else None
+    if not isinstance(lamports, int):
+        return Result.err("invalid_account", context={"account": account_info})
+    return Result.ok(lamports)
+
+
+def parse_token_account(account_info: object, mint: str) -> Result[int]:
+    """Read the amount of an SPL token account (mint: 0..32, owner: 32..64, amount: u64 LE 64..72)."""
+    encoded = account_info.get("data") if isinstance(account_info, dict) else None  # [data, "base64"]
+    if not isinstance(encoded, list) or not encoded or not isinstance(encoded[0], str):
+        return Result.err("invalid_token_account", context={"account": account_info})
+    try:
+        data = memoryview(base64.b64decode(encoded[0], validate=True))
+    except ValueError as e:
+        return Result.err(("invalid_token_account", e), context={"account": account_info})
+    if len(data) < TOKEN_ACCOUNT_MIN_SIZE:
+        return Result.err("invalid_token_account", context={"size": len(data)})
+    if data[:32] != bytes(Pubkey.from_string(mint)):
+        return Result.err("invalid_token_account_mint")
+    return Result.ok(struct.unpack_from("<Q", data, 64)[0])
+
+
+def parse_token_accounts(res: Result[Any]) -> Result[int]:
+    """Sum of the amounts of the token accounts in a getTokenAccountsByOwner result."""
+    if res.is_err():
+        return res
+    try:
+        token_accounts = res.unwrap()["value"]
+        return Result.ok(sum(int(a["account"]["data"]["parsed"]["info"]["tokenAmount"]["amount"]) for a in token_accounts))
+    except (KeyError, TypeError, ValueError) as e:
+        return Result.err(("invalid_token_accounts", e), context={"result": res.unwrap()})
+
+
+async def _get_mint_programs(rpc_url: str, mints: list[str], proxy: str | None, timeout: float) -> dict[str, str]:
+    """Mint -> token program (Token or Token-2022). Mint owners never change, so they are cached."""
+    unknown = list({m for m in mints if m not in _mint_programs})
+    for start in range(0, len(unknown), MAX_MULTIPLE_ACCOUNTS):
+        chunk = unknown[start : start + MAX_MULTIPLE_ACCOUNTS]
+        config = {"encoding": "base64", "dataSlice": {"offset": 0, "length": 0}}
+        res = await _get_multiple_accounts(rpc_url, chunk, config, proxy, timeout)
+        if res.is_ok():
+            for mint, account_info in zip(chunk, res.unwrap(), strict=True):
+                if isinstance(account_info, dict) and account_info.get("owner") in SPL_PROGRAMS:
+                    _mint_programs[mint] = account_info["owner"]
+    return {m: _mint_programs[m] for m in mints if m in _mint_programs}
+
+
+async def _get_multiple_accounts(
+    rpc_url: str, addresses: list[str], config: dict[str, object], proxy: str | None, timeout: float
+) -> Result[list[dict[str, Any] | None]]:
+    res = await jsonrpc.request(rpc_url, "getMultipleAccounts", [addresses, config], proxy=proxy, timeout=timeout)
+    if res.is_err():
+        return res
+    value = res.unwrap().get("value") if isinstance(res.unwrap(), dict) else None
+    if not isinstance(value, list) or len(value) != len(addresses):
+        return Result.err("invalid_multiple_accounts", context={"result": res.unwrap()})
+    return Result.ok(value)
@@ -1,11 +1,55 @@
+from eth_utils import keccak
 from mm_result import Result
-from mm_strk import balance, domain
-from mm_web3 import Proxies, retry_with_proxy
+from mm_strk import domain
+
+from app.core.blockchains import jsonrpc
+
+
+def starknet_selector(name: str) -> str:
+    return hex(int.from_bytes(keccak(text=name), "big") & (2**250 - 1))
+
+
+BALANCE_OF_SELECTOR = starknet_selector("balanceOf")
 
 
 async def get_balance(rpc_url: str, account: str, token: str, proxy: str | None = None) -> Result[int]:
-    return await balance.get_balance(rpc_url, address=account, token=token, proxy=proxy, timeout=7.0)
+    request = {"contract_address": token, "entry_point_selector": BALANCE_OF_SELECTOR, "calldata": [account]}
+    res = await jsonrpc.request(rpc_url, "starknet_call", [request, "latest"], proxy=proxy, timeout=7.0)
+    if res.is_err():
+        return res
+    return parse_u256(res.unwrap())
+
+
+async def get_balances(
+    rpc_url: str, items: list[tuple[str, str | None]], proxy: str | None = None, timeout: float = 10
+) -> list[Result[int]]:
+    """Get balances for (account, token) pairs, all balanceOf calls are sent in one JSON-RPC batch request.
+
+    There is no multicall contract deployed at a well-known address on every Starknet network, so a JSON-RPC batch is used.
+    """
+    results: list[Result[int]] = [Result.err("token address is required on StarkNet") for _ in items]
+    indexes = [i for i, (_, token) in enumerate(items) if token is not None]
+    calls: list[jsonrpc.RpcCall] = []
+    for i in indexes:
+        account, token = items[i]
+        request = {"contract_address": token, "entry_point_selector": BALANCE_OF_SELECTOR, "calldata": [account]}
+        calls.append(("starknet_call", [request, "latest"]))
+    for i, res in zip(indexes, await jsonrpc.batch_request(rpc_url, calls, proxy=proxy, timeout=timeout), strict=True):
+        results[i] = parse_u256(res.unwrap()) if res.is_ok() else res
+    return results
+
+
+def parse_u256(value: object) -> Result[int]:
+    """balanceOf returns u256 as [low, high] felts, old contracts return a single felt."""
+    if not isinstance(value, list) or not 1 <= len(value) <= 2:
+        return Result.err("invalid_u256", context={"value": value})
+    try:
+        low = int(value[0], 16)
+        high = int(value[1], 16) if len(value) == 2 else 0
+    except TypeError, ValueError:
+        return Result.err("invalid_u256", context={"value": value})
+    return Result.ok(low + (high << 128))
 
 
-async def get_starknet_id(account: str, proxies: Proxies = None) -> Result[str | None]:
-    return await retry_with_proxy(5, proxies, lambda proxy: domain.address_to_domain(account, proxy=proxy, timeout=5.0))
+async def get_starknet_id(account: str, proxy: str | None = None) -> Result[str | None]:
+    return await domain.address_to_domain(account, proxy=proxy, timeout=5.0)
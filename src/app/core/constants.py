@@ -41,3 +41,19 @@ class Naming(StrEnum):
                 return network_type == NetworkType.STARKNET
             case _:
                 return False
+
+
+@unique
+class BalanceEngine(StrEnum):
+    RPC = "rpc"  # one request per account and coin
+    BATCH = "batch"  # many balances in one request, see BalanceService._fetch_balances
+    MULTICALL = "multicall"  # Multicall3.aggregate3, EVM only
+
+    def is_consistent(self, network_type: NetworkType) -> bool:
+        match self:
+            case BalanceEngine.RPC | BalanceEngine.BATCH:
+                return True
+            case BalanceEngine.MULTICALL:
+                return network_type == NetworkType.EVM
+            case _:
+                return False
@@ -1,5 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
+from typing import Any
 
 import pydash
 from bson import ObjectId
@@ -7,10 +8,10 @@ from mm_base6 import BaseDb
 from mm_mongo import AsyncMongoCollection, MongoModel
 from mm_std import utc_now
 from mm_web3 import Network, NetworkType
-from pydantic import Field, field_validator
+from pydantic import BaseModel, Field, field_validator
 from pymongo import IndexModel
 
-from app.core.constants import Naming
+from app.core.constants import BalanceEngine, Naming
 
 
 class RpcUrl(MongoModel[str]):  # id = network
@@ -19,6 +20,14 @@ class RpcUrl(MongoModel[str]):  # id = network
     __collection__ = "rpc_url"
 
 
+class NetworkConfig(MongoModel[str]):  # id = network
+    balance_engine: BalanceEngine = BalanceEngine.RPC
+    transfer_scan: bool = False  # detect changed EVM token balances from Transfer logs
+    transfer_scan_block: int | None = None  # last block scanned for Transfer logs
+
+    __collection__ = "network_config"
+
+
 class Coin(MongoModel[str]):  # id = {network}__{symbol}, lowercased
     network: Network
     symbol: str  # symbol is not lowercase
@@ -63,9 +72,25 @@ class AccountBalance(MongoModel[ObjectId]):
     balance: Decimal | None = None
     balance_raw: str | None = None  # mongo can't store very large integers
     checked_at: datetime | None = None
+    changed_at: datetime | None = None  # when a check found a different balance last time
+    unchanged_checks: int = 0  # checks in a row without a balance change, the check interval backs off with it
+    lease_owner: str | None = None  # worker process which claimed it for a check
+    lease_id: ObjectId | None = None  # claim batch
+    lease_until: datetime | None = None  # claimed until
+    due_at: datetime | None = None  # when it's due next time, None - now
 
     __collection__ = "account_balance"
-    __indexes__ = ["!group:account:coin", "group", "account", "coin", "network", "checked_at"]
+    __indexes__ = [
+        "!group:account:coin",
+        "group",
+        "group:coin:balance",
+        "account",
+        "coin",
+        "network",
+        "checked_at",
+        "network:due_at",
+        "network:checked_at",
+    ]
 
 
 class AccountName(MongoModel[ObjectId]):
@@ -75,9 +100,22 @@ class AccountName(MongoModel[ObjectId]):
     naming: Naming
     name: str | None = None  # domains, ids, etc..
     checked_at: datetime | None = None
+    lease_owner: str | None = None  # worker process which claimed it for a check
+    lease_id: ObjectId | None = None  # claim batch
+    lease_until: datetime | None = None  # claimed until
+    due_at: datetime | None = None  # when it's due next time, None - now
 
     __collection__ = "account_name"
-    __indexes__ = ["group", "account", "network", "naming", "checked_at"]
+    __indexes__ = [
+        "group",
+        "account",
+        "network",
+        "naming",
+        "checked_at",
+        "naming:due_at",
+        "naming:checked_at",
+        "group:naming:name",
+    ]
 
 
 class GroupBalance(MongoModel[ObjectId]):
@@ -90,6 +128,22 @@ class GroupBalance(MongoModel[ObjectId]):
     __indexes__ = ["!group:coin", "group"]
 
 
+class GroupCoinSummary(BaseModel):
+    total: Decimal = Decimal(0)  # sum of the account balances
+    non_zero: int = 0  # how many accounts have a non-zero balance
+    checked: int = 0  # how many accounts have been checked
+    checked_at: datetime | None = None  # the last check of any account
+    changed_at: datetime | None = None  # the last balance change of any account
+
+
+class GroupSummary(MongoModel[ObjectId]):  # id = group, maintained by deltas of the balance writes
+    coins: dict[str, GroupCoinSummary] = Field(default_factory=dict)  # coin -> summary
+    version: int = 0  # incremented by every delta write, a rebuild replaces only the version it calculated from
+    reconciled_at: datetime | None = None  # the last drift correction, compared and set by reconcile_summaries
+
+    __collection__ = "group_summary"
+
+
 class GroupName(MongoModel[ObjectId]):
     group: ObjectId
     naming: Naming
@@ -100,15 +154,35 @@ class GroupName(MongoModel[ObjectId]):
     __indexes__ = ["!group:naming", "group"]
 
 
-class NamingProblem(MongoModel[ObjectId]):
+class NameResolution(MongoModel[str]):  # id = {naming}__{account}
+    naming: Naming
+    account: str
+    name: str  # empty string if the account has no name
+    resolved_at: datetime
+    expires_at: datetime
+
+    __collection__ = "name_resolution"
+    __indexes__ = ["naming", IndexModel([("expires_at", 1)], expireAfterSeconds=0)]
+
+
+class NamingProblem(MongoModel[str]):  # id = {naming}__{account}__{error}, failures aggregated by error class
     network: Network
     naming: Naming
     account: str
-    message: str
-    created_at: datetime = Field(default_factory=utc_now)
+    error: str
+    message: str  # the last failure with its context
+    count: int
+    first_seen: datetime
+    last_seen: datetime
 
     __collection__ = "naming_problem"
-    __indexes__ = ["network", "naming", "account", "created_at"]
+    __indexes__ = [
+        "network",
+        "naming",
+        "account",
+        "error",
+        IndexModel([("last_seen", -1)], expireAfterSeconds=30 * 24 * 60 * 60),
+    ]
 
 
 class RpcMonitoring(MongoModel[ObjectId]):
@@ -135,6 +209,34 @@ class RpcMonitoring(MongoModel[ObjectId]):
     ]
 
 
+class RpcMonitoringRollup(MongoModel[ObjectId]):
+    minute: datetime
+    network: Network
+    rpc_url: str
+    proxy: str | None = None
+    coin: str | None = None
+    count: int
+    success_count: int
+    errors: dict[str, int] = Field(default_factory=dict)  # error -> count
+    latency_p50: float
+    latency_p90: float
+    latency_p99: float
+    latency_max: float
+
+    __collection__ = "rpc_monitoring_rollup"
+    __indexes__ = [
+        "network",
+        "rpc_url",
+        "coin",
+        "proxy",
+        IndexModel([("minute", -1)], expireAfterSeconds=30 * 24 * 60 * 60),
+    ]
+
+    @property
+    def error_rate(self) -> float:
+        return 1 - self.success_count / self.count if self.count else 0.0
+
+
 class History(MongoModel[ObjectId]):
     group: Group
     notes: str = ""
@@ -147,14 +249,32 @@ class History(MongoModel[ObjectId]):
     __collection__ = "history"
 
 
+class ProcessSnapshot(MongoModel[str]):  # id = "web" or lease.OWNER_ID of a worker
+    """What a process of the split deployment publishes to the others: the web process the settings and the state
+    edited in the UI, a worker the state it updates (proxies, mm-node-checker) and the freshness of its checks."""
+
+    settings: dict[str, Any] = Field(default_factory=dict)
+    state: dict[str, Any] = Field(default_factory=dict)
+    freshness: dict[str, Any] = Field(default_factory=dict)  # dumped FreshnessStats of a worker
+    updated_at: datetime = Field(default_factory=utc_now)
+
+    __collection__ = "process_snapshot"
+    __indexes__ = ["updated_at"]
+
+
 class Db(BaseDb):
     rpc_url: AsyncMongoCollection[str, RpcUrl]
+    network_config: AsyncMongoCollection[str, NetworkConfig]
     coin: AsyncMongoCollection[str, Coin]
     group: AsyncMongoCollection[ObjectId, Group]
     account_balance: AsyncMongoCollection[ObjectId, AccountBalance]
     account_name: AsyncMongoCollection[ObjectId, AccountName]
     group_balance: AsyncMongoCollection[ObjectId, GroupBalance]
+    group_summary: AsyncMongoCollection[ObjectId, GroupSummary]
     group_name: AsyncMongoCollection[ObjectId, GroupName]
-    naming_problem: AsyncMongoCollection[ObjectId, NamingProblem]
+    name_resolution: AsyncMongoCollection[str, NameResolution]
+    naming_problem: AsyncMongoCollection[str, NamingProblem]
     rpc_monitoring: AsyncMongoCollection[ObjectId, RpcMonitoring]
+    rpc_monitoring_rollup: AsyncMongoCollection[ObjectId, RpcMonitoringRollup]
     history: AsyncMongoCollection[ObjectId, History]
+    process_snapshot: AsyncMongoCollection[str, ProcessSnapshot]
@@ -0,0 +1,60 @@
+import asyncio
+import contextlib
+import heapq
+import time
+from collections import defaultdict
+
+from bson import ObjectId
+
+
+class DueQueue:
+    """Due times of documents, a min-heap per key (network or naming).
+
+    An item is stored once in `due_at`, rescheduled or discarded items stay in the heap and are skipped lazily.
+    """
+
+    def __init__(self) -> None:
+        self.heaps: dict[str, list[tuple[float, ObjectId]]] = defaultdict(list)
+        self.due_at: dict[ObjectId, float] = {}  # id -> due time (unix timestamp)
+        self.events: dict[str, asyncio.Event] = defaultdict(asyncio.Event)
+
+    def push(self, key: str, id: ObjectId, due_at: float) -> None:
+        self.due_at[id] = due_at
+        heapq.heappush(self.heaps[key], (due_at, id))
+        self.events[key].set()
+
+    def discard(self, id: ObjectId) -> None:
+        self.due_at.pop(id, None)
+
+    def pop_due(self, key: str, limit: int) -> list[ObjectId]:
+        """Pop up to `limit` due items. Popped items are not in the queue until they are pushed again."""
+        heap = self.heaps[key]
+        now = time.time()
+        result: list[ObjectId] = []
+        while heap and len(result) < limit and heap[0][0] <= now:
+            due_at, id = heapq.heappop(heap)
+            if self.due_at.get(id) == due_at:
+                del self.due_at[id]
+                result.append(id)
+        return result
+
+    def next_due_at(self, key: str) -> float | None:
+        heap = self.heaps[key]
+        while heap and self.due_at.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+
+    def count(self, key: str) -> int:
+        return len(self.heaps[key])  # including stale entries, it's good enough for monitoring
+
+    async def wait(self, key: str, timeout: float) -> None:
+        """Sleep until the next item is due, a new item is pushed, or timeout."""
+        event = self.events[key]
+        event.clear()
+        next_due_at = self.next_due_at(key)
+        if next_due_at is not None:
+            timeout = min(timeout, next_due_at - time.time())
+        if timeout <= 0:
+            return
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(event.wait(), timeout)
@@ -0,0 +1,102 @@
+import time
+from collections import defaultdict, deque
+from datetime import UTC, datetime
+
+from bson import ObjectId
+from pydantic import BaseModel
+
+STALENESS_BUCKETS = [  # upper bound in seconds, label
+    (60, "1m"),
+    (5 * 60, "5m"),
+    (15 * 60, "15m"),
+    (60 * 60, "1h"),
+    (6 * 60 * 60, "6h"),
+    (24 * 60 * 60, "1d"),
+    (7 * 24 * 60 * 60, "7d"),
+]
+OLDER_BUCKET = "older"
+STALENESS_LABELS = [label for _, label in STALENESS_BUCKETS] + [OLDER_BUCKET]
+THROUGHPUT_WINDOW_SECONDS = 5 * 60  # checks per minute are averaged over this window
+
+
+class Freshness(BaseModel):
+    count: int  # tracked documents
+    never_checked: int
+    staleness: dict[str, int]  # bucket label -> how many documents were checked at most that long ago
+    oldest_checked_at: datetime | None
+    backlog: int  # documents which are due now
+    checks_per_minute: float
+    drain_seconds: float | None  # how long the backlog takes at the current throughput, None - no throughput
+
+
+class FreshnessTracker:
+    """Last check time of every document by key (network, coin or naming), kept in memory.
+    Loaded with the due queue and updated on every successful check, so reading it costs no database query."""
+
+    def __init__(self) -> None:
+        self.checked_at: dict[ObjectId, float | None] = {}  # id -> unix time, None - never checked
+        self.keys: dict[ObjectId, str] = {}  # id -> key
+        self.checks: dict[str, deque[float]] = defaultdict(deque)  # key -> times of the checks within the window
+
+    def track(self, key: str, id: ObjectId, checked_at: datetime | None) -> None:
+        self.keys[id] = key
+        self.checked_at[id] = checked_at.timestamp() if checked_at else None
+
+    def on_check(self, key: str, id: ObjectId, checked_at: datetime) -> None:
+        self.track(key, id, checked_at)
+        checks = self.checks[key]
+        checks.append(checked_at.timestamp())
+        self._trim(checks, time.time())
+
+    def forget(self, ids: list[ObjectId]) -> None:
+        for id in ids:
+            self.keys.pop(id, None)
+            self.checked_at.pop(id, None)
+
+    def get_stats(self, due_at: dict[ObjectId, float]) -> dict[str, Freshness]:
+        """due_at is the due queue, id -> due time, it gives the backlog."""
+        now = time.time()
+        staleness: dict[str, dict[str, int]] = defaultdict(lambda: dict.fromkeys(STALENESS_LABELS, 0))
+        count: dict[str, int] = defaultdict(int)
+        never_checked: dict[str, int] = defaultdict(int)
+        oldest: dict[str, float] = {}
+        backlog: dict[str, int] = defaultdict(int)
+
+        for id, key in self.keys.items():
+            count[key] += 1
+            if due_at.get(id, now + 1) <= now:
+                backlog[key] += 1
+            checked_at = self.checked_at.get(id)
+            if checked_at is None:
+                never_checked[key] += 1
+                continue
+            oldest[key] = min(oldest.get(key, checked_at), checked_at)
+            staleness[key][self._bucket(now - checked_at)] += 1
+
+        result: dict[str, Freshness] = {}
+        for key in sorted(count):
+            checks = self.checks[key]
+            self._trim(checks, now)
+            checks_per_minute = len(checks) * 60 / THROUGHPUT_WINDOW_SECONDS
+            result[key] = Freshness(
+                count=count[key],
+                never_checked=never_checked[key],
+                staleness=staleness[key],
+                oldest_checked_at=datetime.fromtimestamp(oldest[key], tz=UTC) if key in oldest else None,
+                backlog=backlog[key],
+                checks_per_minute=checks_per_minute,
+                drain_seconds=backlog[key] / checks_per_minute * 60 if checks_per_minute > 0 else None,
+            )
+        return result
+
+    @staticmethod
+    def _bucket(age: float) -> str:
+        for seconds, label in STALENESS_BUCKETS:
+            if age <= seconds:
+                return label
+        return OLDER_BUCKET
+
+    @staticmethod
+    def _trim(checks: deque[float], now: float) -> None:
+        while checks and checks[0] < now - THROUGHPUT_WINDOW_SECONDS:
+            checks.popleft()
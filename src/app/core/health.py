@@ -0,0 +1,129 @@
+import time
+from dataclasses import dataclass
+from enum import StrEnum, unique
+from typing import Any, ClassVar
+
+from mm_result import Result
+
+EWMA_ALPHA = 0.2
+MIN_LATENCY = 0.05  # seconds, so a very fast endpoint doesn't get all the traffic
+FAILURES_TO_OPEN = 5  # consecutive failures to open a circuit breaker
+
+NODE_ERRORS = {
+    "timeout",
+    "connection_error",
+    "invalid_json",
+    "invalid_response",
+    "invalid_batch_response",
+    "batch_not_supported",
+}
+OVERLOAD_ERRORS = {"timeout", "http_429", "http_502", "http_503", "http_504"}
+OVERLOAD_RPC_CODES = {-32005, -32029, -32090, 429}  # rate limit / limit exceeded codes used by popular providers
+PROXY_ERRORS = {"proxy_error", "timeout"}
+# the node or the proxy provider refuses this proxy, quarantine at once. Not http_429: rate limits are the
+# node overload signal of AIMD, they go away with less concurrency, not with another proxy
+BAN_ERRORS = {"http_403", "http_407"}
+
+
+def ewma(average: float | None, value: float, alpha: float = EWMA_ALPHA) -> float:
+    return value if average is None else alpha * value + (1 - alpha) * average
+
+
+def get_rpc_error(res: Result[object]) -> dict[str, Any] | None:
+    """The JSON-RPC error object of an rpc_error result."""
+    if res.is_ok() or res.unwrap_err() != "rpc_error":
+        return None
+    rpc_error = (res.to_dict(safe_exception=True)["context"] or {}).get("error")
+    return rpc_error if isinstance(rpc_error, dict) else None
+
+
+def is_node_error(res: Result[object]) -> bool:
+    """Errors caused by the node itself. Proxy errors and errors of a call (e.g. a reverted eth_call) are not."""
+    if res.is_ok():
+        return False
+    error = res.unwrap_err()
+    if error in NODE_ERRORS or error.startswith("http_"):
+        return True
+    if error == "rpc_error":
+        rpc_error = get_rpc_error(res)
+        return rpc_error is None or "revert" not in str(rpc_error.get("message", "")).lower()
+    return False
+
+
+def is_overload_error(res: Result[object]) -> bool:
+    """Timeouts and rate limit errors mean the node is overloaded, other errors don't say anything about concurrency."""
+    if res.is_ok():
+        return False
+    if res.unwrap_err() in OVERLOAD_ERRORS:
+        return True
+    rpc_error = get_rpc_error(res)
+    if rpc_error is None:
+        return False
+    message = str(rpc_error.get("message", "")).lower()
+    return rpc_error.get("code") in OVERLOAD_RPC_CODES or "rate limit" in message or "too many" in message
+
+
+def is_proxy_error(res: Result[object]) -> bool:
+    return res.is_err() and (res.unwrap_err() in PROXY_ERRORS or res.unwrap_err() in BAN_ERRORS)
+
+
+@unique
+class BreakerState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"  # one probe request is allowed
+
+
+@dataclass
+class Health:
+    """Health of an endpoint, an rpc url or a proxy. Its score is the success rate per second of latency.
+    A circuit breaker opens after consecutive failures. After a cooldown one probe is let through,
+    a failed probe opens the breaker for twice the cooldown, a successful one closes it."""
+
+    COOLDOWN_SECONDS: ClassVar[float] = 60
+    MAX_COOLDOWN_SECONDS: ClassVar[float] = 30 * 60
+
+    latency: float | None = None  # ewma, seconds
+    success_rate: float = 1.0  # ewma
+    consecutive_failures: int = 0
+    state: BreakerState = BreakerState.CLOSED
+    opened_at: float = 0.0
+    cooldown: float = 0.0  # seconds, COOLDOWN_SECONDS after the breaker closes
+    requests: int = 0
+    failures: int = 0
+
+    def __post_init__(self) -> None:
+        self.cooldown = self.cooldown or self.COOLDOWN_SECONDS
+
+    @property
+    def score(self) -> float:
+        return self.success_rate / max(self.latency or MIN_LATENCY, MIN_LATENCY)
+
+    def cooldown_left(self) -> float:
+        return max(0.0, self.opened_at + self.cooldown - time.time())
+
+    def try_probe(self) -> bool:
+        """Let a probe through a breaker whose cooldown is over. A lost probe is retried after one more cooldown."""
+        if self.state == BreakerState.CLOSED or self.cooldown_left() > 0:
+            return False
+        self.state, self.opened_at = BreakerState.HALF_OPEN, time.time()
+        return True
+
+    def on_success(self, response_time: float) -> None:
+        self.requests += 1
+        self.success_rate = ewma(self.success_rate, 1.0)
+        self.latency = ewma(self.latency, response_time)
+        self.consecutive_failures = 0
+        if self.state != BreakerState.CLOSED:
+            self.state, self.cooldown = BreakerState.CLOSED, self.COOLDOWN_SECONDS
+
+    def on_failure(self, *, open_at_once: bool = False) -> None:
+        self.requests += 1
+        self.success_rate = ewma(self.success_rate, 0.0)
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == BreakerState.HALF_OPEN:
+            self.cooldown = min(self.cooldown * 2, self.MAX_COOLDOWN_SECONDS)
+            self.state, self.opened_at = BreakerState.OPEN, time.time()
+        elif open_at_once or self.consecutive_failures >= FAILURES_TO_OPEN:
+            self.state, self.opened_at = BreakerState.OPEN, time.time()
@@ -0,0 +1,60 @@
+from collections import deque
+
+from app.core.utils import percentile
+
+LATENCY_SAMPLES = 500  # recent successful response times kept per network
+MIN_SAMPLES = 20  # don't hedge until the percentile means something
+MAX_TOKENS = 10.0  # how many hedges can be sent in a burst
+
+
+class NetworkHedging:
+    def __init__(self) -> None:
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.tokens = MAX_TOKENS
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+
+class HedgeController:
+    """Decides when a slow request gets a duplicate. The delay is a latency percentile of the network.
+    Every request earns max_percent / 100 of a token and every hedge spends one, so hedges add at most max_percent of requests."""
+
+    def __init__(self) -> None:
+        self.networks: dict[str, NetworkHedging] = {}
+        self.percentile = 0  # 0 - disabled
+        self.max_percent = 10
+
+    def configure(self, percentile: int, max_percent: int) -> None:
+        self.percentile = percentile
+        self.max_percent = max_percent
+
+    def get(self, network: str) -> NetworkHedging:
+        if network not in self.networks:
+            self.networks[network] = NetworkHedging()
+        return self.networks[network]
+
+    def get_delay(self, network: str) -> float | None:
+        """Seconds to wait for the first request before hedging it, None - don't hedge."""
+        if self.percentile <= 0:
+            return None
+        hedging = self.get(network)
+        if len(hedging.latencies) < MIN_SAMPLES:
+            return None
+        return percentile(sorted(hedging.latencies), self.percentile)
+
+    def on_request(self, network: str) -> None:
+        hedging = self.get(network)
+        hedging.requests += 1
+        hedging.tokens = min(MAX_TOKENS, hedging.tokens + self.max_percent / 100)
+
+    def on_latency(self, network: str, response_time: float) -> None:
+        self.get(network).latencies.append(response_time)
+
+    def try_hedge(self, network: str) -> bool:
+        hedging = self.get(network)
+        if hedging.tokens < 1:
+            return False
+        hedging.tokens -= 1
+        hedging.hedges += 1
+        return True
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp_socks import ProxyConnector
+from mm_result import Result
+
+
+@dataclass
+class HttpClientStats:
+    requests: int = 0
+    errors: int = 0
+    connections_created: int = 0
+    connections_reused: int = 0
+    created_at: float = field(default_factory=time.time)
+    last_used_at: float = field(default_factory=time.time)
+
+    @property
+    def reuse_ratio(self) -> float:
+        total = self.connections_created + self.connections_reused
+        return self.connections_reused / total if total else 0.0
+
+
+@dataclass
+class HttpClient:
+    session: aiohttp.ClientSession
+    stats: HttpClientStats
+    loop: asyncio.AbstractEventLoop  # a session works only in the event loop which created it
+
+
+class HttpClientPool:
+    """Keep-alive aiohttp sessions keyed by (node origin, proxy), so TLS and proxy handshakes are reused between requests.
+    A session belongs to the running event loop, a session of another loop (e.g. a finished asyncio.run) is replaced."""
+
+    def __init__(self, limit_per_key: int = 20, idle_seconds: float = 300) -> None:
+        self.limit_per_key = limit_per_key
+        self.idle_seconds = idle_seconds
+        self.clients: dict[tuple[str, str | None], HttpClient] = {}
+        self.evicted = HttpClientStats()  # totals of evicted clients
+
+    def configure(self, limit_per_key: int, idle_seconds: float) -> None:
+        self.limit_per_key = limit_per_key
+        self.idle_seconds = idle_seconds
+
+    def get_client(self, url: str, proxy: str | None) -> HttpClient:
+        parts = urlsplit(url)
+        key = (f"{parts.scheme}://{parts.netloc}", proxy)
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(key)
+        if client is not None and client.loop is not loop:
+            # its loop is gone or busy elsewhere, the session can't be used or closed from this one
+            self._add_evicted(client)
+            client = None
+        if client is None or client.session.closed:
+            client = self._create_client(proxy, loop)
+            self.clients[key] = client
+        return client
+
+    def _create_client(self, proxy: str | None, loop: asyncio.AbstractEventLoop) -> HttpClient:
+        stats = HttpClientStats()
+
+        async def on_connection_create_end(_session: object, _ctx: SimpleNamespace, _params: object) -> None:
+            stats.connections_created += 1
+
+        async def on_connection_reuseconn(_session: object, _ctx: SimpleNamespace, _params: object) -> None:
+            stats.connections_reused += 1
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+
+        connector: aiohttp.BaseConnector
+        if proxy:
+            connector = ProxyConnector.from_url(proxy, limit=self.limit_per_key, keepalive_timeout=self.idle_seconds)
+        else:
+            connector = aiohttp.TCPConnector(limit=self.limit_per_key, keepalive_timeout=self.idle_seconds)
+        session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+        return HttpClient(session=session, stats=stats, loop=loop)
+
+    async def request_json(
+        self, url: str, *, method: str = "GET", json_data: object = None, proxy: str | None = None, timeout: float = 10
+    ) -> Result[Any]:
+        client = self.get_client(url, proxy)
+        client.stats.requests += 1
+        client.stats.last_used_at = time.time()
+        try:
+            async with client.session.request(
+                method, url, json=json_data, timeout=aiohttp.ClientTimeout(total=timeout)
+            ) as response:
+                body = await response.text()
+                status = response.status
+        except TimeoutError:
+            client.stats.errors += 1
+            return Result.err("timeout")
+        except aiohttp.ClientError as e:
+            client.stats.errors += 1
+            return Result.err(("connection_error", e))
+        except Exception as e:  # proxy errors from python-socks don't inherit aiohttp.ClientError
+            client.stats.errors += 1
+            return Result.err(("proxy_error", e))
+
+        if status >= 400:
+            client.stats.errors += 1
+            return Result.err(f"http_{status}", context={"body": body[:1000]})
+        try:
+            return Result.ok(json.loads(body))
+        except ValueError:
+            client.stats.errors += 1
+            return Result.err("invalid_json", context={"body": body[:1000]})
+
+    async def evict_idle(self) -> int:
+        deadline = time.time() - self.idle_seconds
+        idle_keys = [key for key, client in self.clients.items() if client.stats.last_used_at < deadline]
+        for key in idle_keys:
+            client = self.clients.pop(key)
+            self._add_evicted(client)
+            if client.loop is asyncio.get_running_loop():
+                await client.session.close()
+        return len(idle_keys)
+
+    def _add_evicted(self, client: HttpClient) -> None:
+        self.evicted.requests += client.stats.requests
+        self.evicted.errors += client.stats.errors
+        self.evicted.connections_created += client.stats.connections_created
+        self.evicted.connections_reused += client.stats.connections_reused
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        clients = list(self.clients.values())
+        self.clients = {}
+        await asyncio.gather(*(c.session.close() for c in clients if c.loop is loop), return_exceptions=True)
+
+    def get_stats(self) -> dict[str, HttpClientStats]:  # "origin | proxy" -> stats
+        return {f"{origin} | {proxy or '-'}": client.stats for (origin, proxy), client in self.clients.items()}
+
+
+http_pool = HttpClientPool()
@@ -0,0 +1,50 @@
+import os
+import socket
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from bson import ObjectId
+from mm_std import utc
+from pymongo.asynchronous.collection import AsyncCollection
+
+OWNER_ID = f"{socket.gethostname()}-{os.getpid()}"  # this worker process
+LEASE_SECONDS = 300  # how long a claimed document stays with its worker if the worker doesn't release it
+
+
+def release_fields(due_at: float) -> dict[str, Any]:
+    """$set fields which release a claimed document and keep the time it is due next for other workers."""
+    return {"lease_owner": None, "lease_id": None, "lease_until": None, "due_at": datetime.fromtimestamp(due_at, tz=UTC)}
+
+
+def not_leased(now: datetime) -> dict[str, Any]:
+    """Filter of documents which nobody holds: never claimed, released, or the lease expired."""
+    return {"$or": [{"lease_owner": None}, {"lease_until": {"$lte": now}}]}
+
+
+async def claim(
+    collection: AsyncCollection[Any], ids: list[ObjectId], *, only_due: bool = True
+) -> tuple[set[ObjectId], dict[ObjectId, datetime | None]]:
+    """Atomically claim the documents which are not leased by another worker, with only_due only the due ones.
+    Documents which are not due yet are claimed with only_due=False, e.g. for a manual check or to be checked
+    together with a due one. Returns the claimed ids and, for the others, when their lease expires or they are due."""
+    if not ids:
+        return set(), {}
+    now = utc()
+    lease_id = ObjectId()
+    conditions = [not_leased(now)]
+    if only_due:
+        conditions.append({"$or": [{"due_at": None}, {"due_at": {"$lte": now}}]})
+    await collection.update_many(
+        {"_id": {"$in": ids}, "$and": conditions},
+        {"$set": {"lease_owner": OWNER_ID, "lease_id": lease_id, "lease_until": now + timedelta(seconds=LEASE_SECONDS)}},
+    )
+    claimed: set[ObjectId] = set()
+    others: dict[ObjectId, datetime | None] = {}
+    projection = {"lease_id": True, "lease_owner": True, "lease_until": True, "due_at": True}
+    async for doc in collection.find({"_id": {"$in": ids}}, projection):
+        if doc.get("lease_id") == lease_id:
+            claimed.add(doc["_id"])
+            continue
+        lease_until = doc.get("lease_until") if doc.get("lease_owner") is not None else None
+        others[doc["_id"]] = max((t for t in (lease_until, doc.get("due_at")) if t is not None), default=None)
+    return claimed, others
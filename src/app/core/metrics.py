@@ -0,0 +1,159 @@
+import abc
+import bisect
+import math
+from collections.abc import Awaitable
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]  # seconds
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values, strict=True)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    @abc.abstractmethod
+    def _samples(self) -> list[str]: ...
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in sorted(self.values.items())]
+
+
+class Gauge(Metric):
+    """Set by the code which owns the value, or replaced at scrape time with set_all."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self.values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self.values[label_values] = value
+
+    def inc(self, *label_values: str, amount: float = 1.0) -> None:
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def set_all(self, values: dict[tuple[str, ...], float]) -> None:
+        self.values = values
+
+    def _samples(self) -> list[str]:
+        return [f"{self.name}{_labels(self.labels, k)} {_number(v)}" for k, v in sorted(self.values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...] = (), buckets: list[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+        self.counts: dict[tuple[str, ...], list[int]] = {}  # per bucket, not cumulative, the last one is +Inf
+        self.sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        counts = self.counts.get(label_values)
+        if counts is None:
+            counts = self.counts[label_values] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[label_values] = self.sums.get(label_values, 0.0) + value
+
+    def _samples(self) -> list[str]:
+        lines: list[str] = []
+        for key, counts in sorted(self.counts.items()):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], counts, strict=True):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(self.sums[key])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """Metrics of the check pipeline in the Prometheus text format. Counters and histograms are updated
+    where things happen, gauges of in-memory state are set by BotService.render_metrics at scrape time."""
+
+    def __init__(self) -> None:
+        self.balance_checks = Counter("app_balance_checks_total", "Account balance checks", ("network", "coin", "result"))
+        self.name_checks = Counter("app_name_checks_total", "Account name checks", ("naming", "result"))
+        self.retries = Counter("app_retries_total", "Repeated requests after a failed attempt", ("check", "key"))
+        self.rpc_latency = Histogram("app_rpc_request_seconds", "RPC request latency", ("rpc_url", "result"))
+        self.mongo_latency = Histogram("app_mongo_command_seconds", "MongoDB command latency", ("command", "result"))
+        self.in_flight = Gauge("app_task_runner_in_flight", "Tasks running in AsyncTaskRunner", ("runner", "key"))
+        self.queue_depth = Gauge("app_due_queue_depth", "Due queue entries, including stale ones", ("queue", "key"))
+        self.rpc_concurrency_limit = Gauge("app_rpc_concurrency_limit", "Adaptive concurrency limit", ("rpc_url",))
+        self.rpc_in_flight = Gauge("app_rpc_in_flight", "RPC requests in flight", ("rpc_url",))
+        self.rpc_urls = Gauge("app_rpc_urls", "RPC urls of a network", ("network",))
+        self.hedges = Counter("app_hedged_requests_total", "Hedged balance requests", ("network", "result"))
+        self.proxies = Gauge("app_proxies", "Proxies in the pool", ("state",))
+        self.proxies_in_flight = Gauge("app_proxies_in_flight", "Requests in flight through proxies")
+        self.proxies_age = Gauge("app_proxies_age_seconds", "Seconds since the proxy list was updated")
+        self.node_checker_age = Gauge("app_mm_node_checker_age_seconds", "Seconds since the mm-node-checker update")
+
+    def all(self) -> list[Metric]:
+        return [m for m in vars(self).values() if isinstance(m, Metric)]
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.all() for line in metric.render()) + "\n"
+
+    async def track_in_flight[T](self, runner: str, key: str, coro: Awaitable[T]) -> T:
+        self.in_flight.inc(runner, key)
+        try:
+            return await coro
+        finally:
+            self.in_flight.inc(runner, key, amount=-1)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        metrics.mongo_latency.observe(event.duration_micros / 1_000_000, event.command_name, "ok")
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        metrics.mongo_latency.observe(event.duration_micros / 1_000_000, event.command_name, "error")
+
+
+def register_mongo_listener() -> None:
+    """Must be called before the mongo client is created, i.e. before Core.init."""
+    monitoring.register(MongoCommandListener())
+
+
+metrics = Metrics()
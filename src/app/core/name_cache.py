@@ -0,0 +1,47 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.core.constants import Naming
+
+
+@dataclass
+class CachedName:
+    name: str  # empty string if the account has no name
+    expires_at: float  # unix time
+
+
+class NameCache:
+    """Resolved names by (naming, account). Least recently used entries are evicted above max_size."""
+
+    def __init__(self, max_size: int = 100_000) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[tuple[Naming, str], CachedName] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._evict()
+
+    def get(self, naming: Naming, account: str) -> CachedName | None:
+        key = (naming, account)
+        entry = self.entries.get(key)
+        if entry is None or entry.expires_at <= time.time():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, naming: Naming, account: str, name: str, expires_at: float) -> CachedName:
+        key = (naming, account)
+        entry = self.entries[key] = CachedName(name=name, expires_at=expires_at)
+        self.entries.move_to_end(key)
+        self._evict()
+        return entry
+
+    def _evict(self) -> None:
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,37 @@
+import random
+
+from mm_result import Result
+
+from app.core.health import BreakerState, Health, is_node_error
+
+
+class NodeSelector:
+    """Picks rpc urls weighted by their health score. Urls which keep failing are cut off by a circuit breaker."""
+
+    def __init__(self) -> None:
+        self.nodes: dict[str, Health] = {}  # rpc_url -> health
+
+    def get(self, rpc_url: str) -> Health:
+        if rpc_url not in self.nodes:
+            self.nodes[rpc_url] = Health()
+        return self.nodes[rpc_url]
+
+    def choose(self, rpc_urls: list[str]) -> str:
+        candidates: list[str] = []
+        for url in rpc_urls:
+            node = self.get(url)
+            if node.try_probe():
+                return url
+            if node.state == BreakerState.CLOSED:
+                candidates.append(url)
+        if not candidates:
+            # every node is broken or being probed, take the one which is closest to the next probe
+            return min(rpc_urls, key=lambda u: self.get(u).cooldown_left())
+        return random.choices(candidates, weights=[self.get(u).score for u in candidates])[0]
+
+    def on_result(self, rpc_url: str, response_time: float, res: Result[object]) -> None:
+        node = self.get(rpc_url)
+        if is_node_error(res):
+            node.on_failure()
+        else:
+            node.on_success(response_time)
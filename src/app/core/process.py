@@ -0,0 +1,72 @@
+import os
+from dataclasses import dataclass, field
+from enum import StrEnum, unique
+
+from mm_web3 import Network
+
+from app.core.constants import Naming
+
+
+@unique
+class ProcessRole(StrEnum):
+    ALL = "all"  # the web server and the checks in one process
+    WEB = "web"  # the web server only, workers do the scheduled checks
+    WORKER = "worker"  # the scheduled checks only, no web server
+
+
+@dataclass
+class Process:
+    """What this process does. The entry point configures it before Core.init, services read it.
+    Processes share nothing but the database, account balances and names are claimed with leases."""
+
+    role: ProcessRole = ProcessRole.ALL
+    networks: set[Network] = field(default_factory=set)  # the shard of a worker, empty - all networks
+    namings: set[Naming] = field(default_factory=set)  # the shard of a worker, empty - all namings
+
+    def configure(self, role: ProcessRole, networks: set[Network], namings: set[Naming]) -> None:
+        self.role = role
+        self.networks = networks
+        self.namings = namings
+
+    def configure_from_env(self) -> None:
+        """APP_ROLE: all, web or worker. APP_NETWORKS, APP_NAMINGS: comma separated shards of a worker."""
+        self.configure(
+            ProcessRole(os.getenv("APP_ROLE") or ProcessRole.ALL),
+            {Network(n) for n in parse_list(os.getenv("APP_NETWORKS", ""))},
+            {Naming(n) for n in parse_list(os.getenv("APP_NAMINGS", ""))},
+        )
+
+    @property
+    def is_web(self) -> bool:
+        return self.role != ProcessRole.WORKER
+
+    @property
+    def is_worker(self) -> bool:
+        return self.role != ProcessRole.WEB
+
+    @property
+    def is_sharded(self) -> bool:
+        return bool(self.networks or self.namings)
+
+    def checks_network(self, network: Network) -> bool:
+        """Balances of the network are checked by this process on schedule."""
+        if not self.is_worker:
+            return False
+        if not self.is_sharded:
+            return True
+        return network in self.networks
+
+    def checks_naming(self, naming: Naming) -> bool:
+        """Names of the naming are checked by this process on schedule."""
+        if not self.is_worker:
+            return False
+        if not self.is_sharded:
+            return True
+        return naming in self.namings
+
+
+def parse_list(value: str) -> list[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+process = Process()
@@ -0,0 +1,113 @@
+import contextlib
+import random
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from typing import ClassVar
+
+from mm_result import Result
+
+from app.core.health import BAN_ERRORS, BreakerState, Health, is_proxy_error
+
+
+@dataclass
+class ProxyHealth(Health):
+    """A proxy is quarantined by the breaker: after consecutive failures or at once when it is banned."""
+
+    COOLDOWN_SECONDS: ClassVar[float] = 5 * 60
+    MAX_COOLDOWN_SECONDS: ClassVar[float] = 60 * 60
+
+    in_flight: int = 0
+    tokens: float = 0.0  # rate limit bucket
+    tokens_at: float = 0.0
+    bans: int = 0
+
+
+class ProxyPool:
+    """Picks proxies weighted by their health score. Proxies which keep failing or get banned are quarantined.
+    Proxies at their concurrency or rate limit are skipped while others have capacity. With affinity,
+    an rpc url sticks to one proxy while it is healthy, so its keep-alive connections are reused."""
+
+    def __init__(self) -> None:
+        self.proxies: dict[str, ProxyHealth] = {}
+        self.affinity: dict[str, str] = {}  # rpc_url -> proxy
+        self.max_concurrency = 20
+        self.rate_limit = 0.0  # requests per second, 0 - unlimited
+        self.affinity_enabled = False
+
+    def configure(self, max_concurrency: int, rate_limit: float, affinity_enabled: bool) -> None:
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit
+        self.affinity_enabled = affinity_enabled
+
+    def update(self, proxies: list[str]) -> None:
+        """Set the proxy list, stats of the proxies which stay in the list are kept."""
+        self.proxies = {p: self.proxies.get(p) or ProxyHealth() for p in proxies}
+        self.affinity = {url: p for url, p in self.affinity.items() if p in self.proxies}
+
+    def get_active(self) -> list[str]:
+        """Proxies which are not quarantined, for libraries which retry over a proxy list themselves."""
+        active = [p for p, h in self.proxies.items() if h.state == BreakerState.CLOSED]
+        return active or list(self.proxies)
+
+    def choose(self, rpc_url: str | None = None, exclude: str | None = None) -> str | None:
+        if not self.proxies:
+            return None
+        if self.affinity_enabled and rpc_url is not None:
+            proxy = self.affinity.get(rpc_url)
+            if proxy is not None and proxy != exclude and self._available(proxy):
+                return proxy
+
+        candidates: list[str] = []
+        for proxy, health in self.proxies.items():
+            if proxy == exclude:
+                continue
+            if health.try_probe():
+                return proxy
+            if self._available(proxy):
+                candidates.append(proxy)
+
+        if candidates:
+            proxy = random.choices(candidates, weights=[self.proxies[p].score for p in candidates])[0]
+        else:
+            # every proxy is quarantined or at its limits, don't stop the work, take the least loaded one
+            proxy = min(self.proxies, key=lambda p: (p == exclude, self.proxies[p].in_flight))
+        if self.affinity_enabled and rpc_url is not None:
+            self.affinity[rpc_url] = proxy
+        return proxy
+
+    def _available(self, proxy: str) -> bool:
+        health = self.proxies[proxy]
+        if health.state != BreakerState.CLOSED or health.in_flight >= self.max_concurrency:
+            return False
+        if self.rate_limit > 0:
+            now = time.time()
+            health.tokens = min(self.rate_limit, health.tokens + (now - health.tokens_at) * self.rate_limit)
+            health.tokens_at = now
+            return health.tokens >= 1
+        return True
+
+    @contextlib.contextmanager
+    def use(self, proxy: str | None) -> Iterator[None]:
+        health = self.proxies.get(proxy) if proxy else None
+        if health is None:
+            yield
+            return
+        health.in_flight += 1
+        if self.rate_limit > 0:
+            health.tokens -= 1
+        try:
+            yield
+        finally:
+            health.in_flight -= 1
+
+    def on_result(self, proxy: str | None, response_time: float, res: Result[object]) -> None:
+        health = self.proxies.get(proxy) if proxy else None
+        if health is None:
+            return
+        if not is_proxy_error(res):
+            health.on_success(response_time)
+            return
+        banned = res.unwrap_err() in BAN_ERRORS
+        health.bans += int(banned)
+        health.on_failure(open_at_once=banned)
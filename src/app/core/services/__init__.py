@@ -1,4 +1,5 @@
 from app.core.services.balance import BalanceService
+from app.core.services.balance_writer import BalanceWriterService
 from app.core.services.bot import BotService
 from app.core.services.coin import CoinService
 from app.core.services.group import GroupService
@@ -6,10 +7,13 @@ from app.core.services.history import HistoryService
 from app.core.services.name import NameService
 from app.core.services.network import NetworkService
 from app.core.services.proxy import ProxyService
+from app.core.services.rpc_monitoring import RpcMonitoringService
+from app.core.services.transfer_scan import TransferScanService
 
 
 class ServiceRegistry:
     balance: BalanceService
+    balance_writer: BalanceWriterService
     bot: BotService
     coin: CoinService
     group: GroupService
@@ -17,3 +21,5 @@ class ServiceRegistry:
     name: NameService
     network: NetworkService
     proxy: ProxyService
+    rpc_monitoring: RpcMonitoringService
+    transfer_scan: TransferScanService
@@ -1,5 +1,8 @@
+import asyncio
+import itertools
 import logging
 import time
+from datetime import datetime
 from decimal import Decimal
 from typing import override
 
@@ -8,117 +11,496 @@ from mm_base6 import Service
 from mm_concurrency import AsyncTaskRunner, async_mutex_by
 from mm_result import Result
 from mm_std import utc
-from mm_web3 import Network, NetworkType, random_node, random_proxy
+from mm_web3 import Network, NetworkType
 
-from app.core.blockchains import aptos, evm, solana, starknet
-from app.core.db import Coin, RpcMonitoring
+from app.core import lease
+from app.core.aimd import AimdController
+from app.core.blockchains import aptos, evm, multicall, solana, starknet
+from app.core.constants import BalanceEngine
+from app.core.db import AccountBalance, Coin, RpcMonitoring
+from app.core.due_queue import DueQueue
+from app.core.freshness import FreshnessTracker
+from app.core.hedge import HedgeController
+from app.core.metrics import metrics
+from app.core.node_health import NodeSelector
+from app.core.process import process
 from app.core.types import AppCore
 
 logger = logging.getLogger(__name__)
 
 
+RETRY_FAILED_SECONDS = 60  # when to check again an account balance which failed
+MAX_IDLE_SECONDS = 10  # how long a network queue sleeps if nothing is due
+MAX_BACKOFF_STEPS = 16  # the check interval doubles at most this many times, max_check_balance_interval caps it anyway
+DISCOVER_INTERVAL_SECONDS = 10  # how often a worker looks for account balances made due by other processes
+NO_BATCH_SECONDS = 30 * 60  # how long a node which rejected a batch gets single requests only
+BATCH_REJECTED_ERRORS = {"batch_not_supported", "invalid_batch_response"}
+
+
 class BalanceService(Service[AppCore]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.due_queue = DueQueue()  # network -> account_balance ids by due time
+        self.concurrency = AimdController()  # rpc_url -> adaptive concurrency limit
+        self.nodes = NodeSelector()  # rpc_url -> health score and circuit breaker
+        self.hedging = HedgeController()  # network -> latency percentile and hedge budget
+        self.no_batch: dict[str, float] = {}  # rpc_url -> monotonic time until it gets single requests only
+        self.checking: set[ObjectId] = set()  # account balances this worker claimed and hasn't rescheduled yet
+        self.freshness_by_network = FreshnessTracker()  # account_balance id -> last check, by network
+        self.freshness_by_coin = FreshnessTracker()  # account_balance id -> last check, by coin
+
     @override
     def configure_scheduler(self) -> None:
-        for network in Network:
+        networks = self.get_checked_networks()
+        for network in networks:
             task_id = "balances_on_" + network.value
-            self.core.scheduler.add(task_id, 2, self.check_next_network, args=(network,))
+            self.core.scheduler.add(task_id, 1, self.wait_and_check_network, args=(network,))
+        if networks:
+            self.core.scheduler.add("discover_due_balances", DISCOVER_INTERVAL_SECONDS, self.discover_due)
+
+    @override
+    async def on_start(self) -> None:
+        self.configure_concurrency()
+        if self.get_checked_networks():
+            await self.load_due_queue()
+
+    def forget(self, ids: list[ObjectId]) -> None:
+        self.freshness_by_network.forget(ids)
+        self.freshness_by_coin.forget(ids)
+
+    @staticmethod
+    def get_checked_networks() -> list[Network]:
+        """Networks this process checks on schedule, none in a web-only process."""
+        return [network for network in Network if process.checks_network(network)]
+
+    def configure_concurrency(self) -> None:
+        settings = self.core.settings
+        self.concurrency.configure(
+            settings.limit_network_workers, settings.max_rpc_concurrency, settings.rpc_latency_target_ms / 1000
+        )
+        self.hedging.configure(settings.hedge_percentile, settings.hedge_max_percent)
+
+    async def load_due_queue(self) -> int:
+        count = 0
+        projection = {
+            "network": True,
+            "coin": True,
+            "checked_at": True,
+            "balance_raw": True,
+            "unchanged_checks": True,
+            "due_at": True,
+        }
+        query = {"network": {"$in": [n.value for n in self.get_checked_networks()]}}
+        async for doc in self.core.db.account_balance.collection.find(query, projection):
+            count += 1
+            self.track(doc["network"], doc["coin"], doc["_id"], doc["checked_at"])
+            if doc.get("due_at") is not None:
+                self.push_due(doc["network"], doc["_id"], doc["due_at"].timestamp())
+                continue
+            interval = self.get_check_interval(doc["network"], doc["coin"], doc.get("unchanged_checks", 0), doc["balance_raw"])
+            self.schedule(doc["network"], doc["_id"], doc["checked_at"], interval)
+        return count
+
+    def schedule(self, network: str, id: ObjectId, checked_at: datetime | None, interval: int) -> float:
+        due_at = 0.0 if checked_at is None else checked_at.timestamp() + interval * 60
+        self.push_due(network, id, due_at)
+        return due_at
+
+    def get_check_interval(self, network: str, coin: str, unchanged_checks: int, balance_raw: str | None) -> int:  # minutes
+        """Accounts which changed recently are checked every check_balance_interval. Every check without a change
+        doubles the interval up to max_check_balance_interval, a zero balance starts one step further.
+        Token balances of networks with transfer scan are marked as due by the scan, polling is only a slow sweep."""
+        settings = self.core.settings
+        coin_ = self.core.services.coin.get_coins_map().get(coin)
+        if coin_ is not None and coin_.token and self.core.services.network.is_transfer_scan(Network(network)):
+            return settings.transfer_scan_sweep_interval
+        backoff = min(unchanged_checks + (1 if balance_raw == "0" else 0), MAX_BACKOFF_STEPS)
+        max_interval = max(settings.max_check_balance_interval, settings.check_balance_interval)
+        return min(settings.check_balance_interval * 2**backoff, max_interval)
+
+    def push_due(self, network: str, id: ObjectId, due_at: float) -> None:
+        """Push it to the local queue if this process checks the network, e.g. the web server checks no networks."""
+        if process.checks_network(Network(network)):
+            self.due_queue.push(network, id, due_at)
+
+    def track(self, network: str, coin: str, id: ObjectId, checked_at: datetime | None) -> None:
+        """Track the freshness of the account balance if this process checks the network."""
+        if process.checks_network(Network(network)):
+            self.freshness_by_network.track(network, id, checked_at)
+            self.freshness_by_coin.track(coin, id, checked_at)
+
+    def enqueue(self, account_balances: list[AccountBalance]) -> None:
+        """Make the account balances due right now, e.g. new or reset ones.
+        Networks checked by other processes pick them up with discover_due."""
+        for ab in account_balances:
+            self.track(ab.network.value, ab.coin, ab.id, None)
+            self.push_due(ab.network.value, ab.id, 0.0)
+
+    async def discover_due(self) -> int:
+        """Push account balances which are new or were reset by other processes, e.g. by the web server.
+        They are the ones never checked, never released with a due time and not leased."""
+        networks = [n.value for n in self.get_checked_networks()]
+        query = {"network": {"$in": networks}, "checked_at": None, "due_at": None, "lease_owner": None}
+        count = 0
+        async for doc in self.core.db.account_balance.collection.find(query, {"network": True, "coin": True}):
+            if doc["_id"] not in self.due_queue.due_at:
+                self.track(doc["network"], doc["coin"], doc["_id"], None)
+                self.push_due(doc["network"], doc["_id"], 0.0)
+                count += 1
+        return count
+
+    async def _reschedule(self, account_balance: AccountBalance, res: Result[int]) -> None:
+        """Push it to the local queue and release its lease, due_at keeps the due time for other workers."""
+        ab = account_balance
+        self.checking.discard(ab.id)
+        if res.is_ok():
+            interval = self.get_check_interval(ab.network.value, ab.coin, ab.unchanged_checks, ab.balance_raw)
+            due_at = self.schedule(ab.network.value, ab.id, ab.checked_at, interval)
+        else:
+            due_at = time.time() + RETRY_FAILED_SECONDS
+            self.push_due(ab.network.value, ab.id, due_at)
+        await self.core.services.balance_writer.release(ab.id, due_at)
+
+    async def wait_and_check_network(self, network: Network) -> int:
+        await self.due_queue.wait(network.value, MAX_IDLE_SECONDS)
+        self.configure_concurrency()  # settings can be changed at any time
+        return await self.check_next_network(network)
 
     @async_mutex_by(param="network")
     async def check_next_network(self, network: Network) -> int:
         # logger.debug("Checking next network", extra={"network": network})
         if not self.core.state.check_balances:
             return -1
-        # first check accounts that were never checked
-        need_to_check = await self.core.db.account_balance.find(
-            {"network": network, "checked_at": None}, limit=self.core.settings.limit_network_workers
-        )
-        # next check accounts that were checked more than 5 minutes ago
-        if len(need_to_check) < self.core.settings.limit_network_workers:
-            need_to_check += await self.core.db.account_balance.find(
-                {
-                    "network": network,
-                    "checked_at": {"$lt": utc(minutes=-1 * self.core.settings.check_balance_interval)},
-                },
-                "checked_at",
-                limit=self.core.settings.limit_network_workers - len(need_to_check),
-            )
-        if not need_to_check:
+        batch_size = self.get_batch_size(network)
+        workers = self.get_network_workers(network)
+        ids = self.due_queue.pop_due(network.value, workers * batch_size)
+        if not ids:
             return 0
+        popped = set(ids)  # not in the queue until they are rescheduled
+        need_to_check: list[AccountBalance] = []
+        try:
+            # deleted account balances are not in the db anymore, so they just drop out of the queue
+            due = await self.core.db.account_balance.find({"_id": {"$in": ids}})
+            deleted = popped - {ab.id for ab in due}
+            popped -= deleted
+            self.forget(list(deleted))
+            claimed = await self.claim(network, due)
+            # the same (coin, account) of other groups is requested once with the due one, even if it is due later
+            claimed_ids = {ab.id for ab in claimed}
+            same_key = [ab for ab in await self.find_same_key(network, claimed) if ab.id not in claimed_ids]
+            need_to_check = claimed + await self.claim(network, same_key, only_due=False)
+            shared = self.group_by_key(need_to_check)
+
+            runner = AsyncTaskRunner(workers, name="check_balances")
+            for chunk in itertools.batched(shared, batch_size, strict=False):
+                account_balances = [ab for group in chunk for ab in group]
+                task = self.check_account_balances(network, account_balances)
+                runner.add(str(account_balances[0].id), metrics.track_in_flight("check_balances", network.value, task))
+            await runner.run()
+            return len(need_to_check)
+        finally:
+            await self._return_unchecked(network, popped | {ab.id for ab in need_to_check})
+
+    async def _return_unchecked(self, network: Network, ids: set[ObjectId]) -> None:
+        """After a failure (a db error, a bug in a chain module) some of the ids of a pass were neither rescheduled
+        nor pushed back by claim. They go back to the queue, and the ones this worker claimed are released,
+        otherwise they would wait for a restart or an expired lease."""
+        due_at = time.time() + RETRY_FAILED_SECONDS
+        for id in ids:
+            if id in self.checking:
+                self.checking.discard(id)
+                self.push_due(network.value, id, due_at)
+                await self.core.services.balance_writer.release(id, due_at)
+            elif id not in self.due_queue.due_at:
+                self.push_due(network.value, id, due_at)
 
-        runner = AsyncTaskRunner(self.core.settings.limit_network_workers, name="check_balances")
-        for ab in need_to_check:
-            runner.add(str(ab.id), self.check_account_balance(ab.id))
-        await runner.run()
-        return len(need_to_check)
+    async def claim(
+        self, network: Network, account_balances: list[AccountBalance], *, only_due: bool = True
+    ) -> list[AccountBalance]:
+        """Keep only the account balances this worker claimed. Other workers may share the database,
+        the rest is due later or is being checked by them."""
+        ids = [ab.id for ab in account_balances]
+        claimed, others = await lease.claim(self.core.db.account_balance.collection, ids, only_due=only_due)
+        for id, lease_until in others.items():
+            self.push_due(network.value, id, lease_until.timestamp() if lease_until else time.time() + RETRY_FAILED_SECONDS)
+        if not claimed:
+            return []
+        self.checking.update(claimed)
+        # read them again, another worker could have written a balance since they were found,
+        # and the group summary gets the delta from the current balance
+        return await self.core.db.account_balance.find({"_id": {"$in": list(claimed)}})
+
+    async def find_same_key(self, network: Network, account_balances: list[AccountBalance]) -> list[AccountBalance]:
+        """Account balances of all groups with the same (coin, account) as the given ones. A coin is (network, token)."""
+        if not account_balances:
+            return []
+        keys = {(ab.coin, ab.account) for ab in account_balances}
+        query = {
+            "network": network.value,
+            "coin": {"$in": list({coin for coin, _ in keys})},
+            "account": {"$in": list({account for _, account in keys})},
+        }
+        return [ab for ab in await self.core.db.account_balance.find(query) if (ab.coin, ab.account) in keys]
+
+    @staticmethod
+    def group_by_key(account_balances: list[AccountBalance]) -> list[list[AccountBalance]]:
+        result: dict[tuple[str, str], list[AccountBalance]] = {}
+        for ab in account_balances:
+            result.setdefault((ab.coin, ab.account), []).append(ab)
+        return list(result.values())
+
+    def get_network_workers(self, network: Network) -> int:
+        """Sum of the adaptive limits of the network rpc urls."""
+        urls = self.core.services.network.get_rpc_urls(network)
+        if not urls:
+            return self.core.settings.limit_network_workers
+        return self.concurrency.total_limit(urls)
+
+    def get_batch_size(self, network: Network) -> int:
+        match self.core.services.network.get_balance_engine(network):
+            case BalanceEngine.BATCH:
+                batch_sizes = {
+                    NetworkType.EVM: self.core.settings.evm_batch_size,
+                    NetworkType.SOLANA: self.core.settings.solana_batch_size,
+                    NetworkType.STARKNET: self.core.settings.starknet_batch_size,
+                    NetworkType.APTOS: self.core.settings.aptos_batch_size,
+                }
+                return max(batch_sizes.get(network.network_type, 1), 1)
+            case BalanceEngine.MULTICALL:
+                return max(self.core.settings.multicall_batch_size, 1)
+        return 1
 
     async def _request_balance(self, network: Network, coin: Coin, account: str) -> Result[int]:
         res: Result[int] = Result.err("not started yet")
 
-        for _ in range(5):
-            start_at = time.perf_counter()
+        for attempt in range(5):
+            if attempt > 0:
+                metrics.retries.inc("balance", network.value)
             urls = self.core.services.network.get_rpc_urls(network)
             if not urls:
                 return Result.err(f"rpc url not found for {network}")
 
-            # print("rpc_urls", rpc_urls)
-            rpc_url = random_node(urls)
-            proxy = random_proxy(self.core.state.proxies)
-
-            match network.network_type:
-                case NetworkType.EVM:
-                    res = await evm.get_balance(rpc_url, account, coin.token, proxy)
-                case NetworkType.SOLANA:
-                    res = await solana.get_balance(rpc_url, account, coin.token, proxy)
-                case NetworkType.APTOS:
-                    res = await aptos.get_balance(rpc_url, account, coin.token, proxy)
-                case NetworkType.STARKNET:
-                    if coin.token is None:
-                        raise ValueError("can't get balance for coin on StarkNet without token address")
-                    res = await starknet.get_balance(rpc_url, account, coin.token, proxy)
-                case _:
-                    return Result.err("check_balance: unknown network")
-
-            rpc_monitoring = RpcMonitoring(
-                id=ObjectId(),
-                network=network,
-                coin=coin.id,
-                account=account,
-                rpc_url=rpc_url,
-                proxy=proxy,
-                success=res.is_ok(),
-                response_time=round(time.perf_counter() - start_at, ndigits=2),
-                error=res.unwrap_err() if res.is_err() else None,
-                data=res.to_dict(safe_exception=True)["context"],
-            )
-            await self.core.db.rpc_monitoring.insert_one(rpc_monitoring)
-
+            res = await self._request_balance_hedged(network, coin, account, urls)
             if res.is_ok():
                 return res
 
         return res
 
-    async def check_account_balance(self, id: ObjectId) -> Result[int]:
-        account_balance = await self.core.db.account_balance.get(id)
-        coin = self.core.services.coin.get_coin(account_balance.coin)
-
-        # self.logger.debug("check_account_balance: %s / %s / %s", network.id, coin.symbol, account_balance.account)
+    async def _request_balance_hedged(self, network: Network, coin: Coin, account: str, urls: list[str]) -> Result[int]:
+        """If the request is slower than the network latency percentile, send a duplicate to another node and proxy.
+        The first success wins, the other request is cancelled."""
+        self.hedging.on_request(network.value)
+        rpc_url = self.nodes.choose(urls)
+        proxy = self.core.services.proxy.pool.choose(rpc_url)
+        primary = asyncio.create_task(self._request_balance_once(network, coin, account, rpc_url, proxy))
+        delay = self.hedging.get_delay(network.value)
+        if delay is None:
+            return await primary
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self.hedging.try_hedge(network.value):
+            return await primary
+        metrics.hedges.inc(network.value, "sent")
 
-        res = await self._request_balance(coin.network, coin, account_balance.account)
-        if res.is_err():
-            # logger.debug("check_account_balance: %s", res.err)
+        hedge_url = self.nodes.choose([u for u in urls if u != rpc_url] or urls)
+        hedge_proxy = self.core.services.proxy.pool.choose(hedge_url, exclude=proxy)
+        hedge = asyncio.create_task(self._request_balance_once(network, coin, account, hedge_url, hedge_proxy))
+        pending: set[asyncio.Task[Result[int]]] = {primary, hedge}
+        res: Result[int] = Result.err("not started yet")
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    res = task.result()
+                    if res.is_ok():
+                        if task is hedge:
+                            self.hedging.get(network.value).hedge_wins += 1
+                            metrics.hedges.inc(network.value, "won")
+                        return res
             return res
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _request_balance_once(
+        self, network: Network, coin: Coin, account: str, rpc_url: str, proxy: str | None
+    ) -> Result[int]:
+        async with self.concurrency.get(rpc_url).slot():
+            with self.core.services.proxy.pool.use(proxy):
+                start_at = time.perf_counter()
+                res = await self._fetch_balance(network, coin, account, rpc_url, proxy)
+                response_time = time.perf_counter() - start_at
+        self._on_rpc_result(rpc_url, proxy, start_at, response_time, res)
+        if res.is_ok():
+            self.hedging.on_latency(network.value, response_time)
+
+        rpc_monitoring = RpcMonitoring(
+            id=ObjectId(),
+            network=network,
+            coin=coin.id,
+            account=account,
+            rpc_url=rpc_url,
+            proxy=proxy,
+            success=res.is_ok(),
+            response_time=round(response_time, ndigits=2),
+            error=res.unwrap_err() if res.is_err() else None,
+            data=res.to_dict(safe_exception=True)["context"],
+        )
+        await self.core.services.rpc_monitoring.record(rpc_monitoring)
+        return res
+
+    def _on_rpc_result(self, rpc_url: str, proxy: str | None, start_at: float, response_time: float, res: Result[int]) -> None:
+        self.concurrency.on_result(rpc_url, start_at, response_time, res)
+        metrics.rpc_latency.observe(response_time, rpc_url, "ok" if res.is_ok() else "error")
+        self.nodes.on_result(rpc_url, response_time, res)
+        self.core.services.proxy.pool.on_result(proxy, response_time, res)
+
+    async def _fetch_balance(self, network: Network, coin: Coin, account: str, rpc_url: str, proxy: str | None) -> Result[int]:
+        match network.network_type:
+            case NetworkType.EVM:
+                return await evm.get_balance(rpc_url, account, coin.token, proxy)
+            case NetworkType.SOLANA:
+                return await solana.get_balance(rpc_url, account, coin.token, proxy)
+            case NetworkType.APTOS:
+                return await aptos.get_balance(rpc_url, account, coin.token, proxy)
+            case NetworkType.STARKNET:
+                if coin.token is None:
+                    raise ValueError("can't get balance for coin on StarkNet without token address")
+                return await starknet.get_balance(rpc_url, account, coin.token, proxy)
+        return Result.err("check_balance: unknown network")
+
+    async def _fetch_balances(
+        self, network: Network, engine: BalanceEngine, rpc_url: str, items: list[tuple[str, str | None]], proxy: str | None
+    ) -> list[Result[int]]:
+        match network.network_type:
+            case NetworkType.EVM if engine == BalanceEngine.MULTICALL:
+                return await multicall.get_balances(rpc_url, items, proxy)
+            case NetworkType.EVM:
+                return await evm.get_balances(rpc_url, items, proxy)
+            case NetworkType.SOLANA:
+                return await solana.get_balances(rpc_url, items, proxy)
+            case NetworkType.STARKNET:
+                return await starknet.get_balances(rpc_url, items, proxy)
+        return [Result.err(f"batch is not supported for {network}") for _ in items]
+
+    async def _request_balances(self, network: Network, items: list[tuple[Coin, str]]) -> list[Result[int]]:
+        """Request balances for (coin, account) pairs in one batch.
+        Failed items are split in halves and requested again, a single item goes through _request_balance.
+        If the whole batch failed, the node or proxy rejected the batch itself, so every item goes through
+        _request_balance at once, splitting would only repeat the same error for every half. A node which answered
+        that it doesn't support batches gets no batches for NO_BATCH_SECONDS."""
+        if len(items) == 1:
+            coin, account = items[0]
+            return [await self._request_balance(network, coin, account)]
+
+        if network.network_type == NetworkType.APTOS:
+            # the Aptos node API has no batch requests, every view call takes its own AIMD slot and proxy use
+            return await self._request_each(network, items)
+
+        urls = self.core.services.network.get_rpc_urls(network)
+        if not urls:
+            return [Result.err(f"rpc url not found for {network}") for _ in items]
+        batch_urls = [url for url in urls if self.no_batch.get(url, 0) < time.monotonic()]
+        if not batch_urls:
+            return await self._request_each(network, items)
+
+        rpc_url = self.nodes.choose(batch_urls)
+        proxy = self.core.services.proxy.pool.choose(rpc_url)
+        balance_items = [(account, coin.token) for coin, account in items]
+        engine = self.core.services.network.get_balance_engine(network)
+        async with self.concurrency.get(rpc_url).slot():
+            with self.core.services.proxy.pool.use(proxy):
+                start_at = time.perf_counter()
+                results = await self._fetch_balances(network, engine, rpc_url, balance_items, proxy)
+                response_time = time.perf_counter() - start_at
+
+        failed = [i for i, res in enumerate(results) if res.is_err()]
+        # the whole batch shares one http request, so the node is judged by the first error
+        self._on_rpc_result(rpc_url, proxy, start_at, response_time, results[failed[0]] if failed else results[0])
+        rpc_monitoring = RpcMonitoring(
+            id=ObjectId(),
+            network=network,
+            account=f"batch of {len(items)}",
+            rpc_url=rpc_url,
+            proxy=proxy,
+            success=not failed,
+            response_time=round(response_time, ndigits=2),
+            error=results[failed[0]].unwrap_err() if failed else None,
+            data={"engine": engine.value, "batch_size": len(items), "failed": len(failed)},
+        )
+        await self.core.services.rpc_monitoring.record(rpc_monitoring)
+
+        if len(failed) == len(items):
+            if results[0].unwrap_err() in BATCH_REJECTED_ERRORS:
+                logger.info("Node rejected a batch, it gets single requests", extra={"rpc_url": rpc_url})
+                self.no_batch[rpc_url] = time.monotonic() + NO_BATCH_SECONDS
+            return await self._request_each(network, items)
+        if failed:
+            failed_items = [items[i] for i in failed]
+            half = (len(failed_items) + 1) // 2
+            retried = await self._request_balances(network, failed_items[:half])
+            retried += await self._request_balances(network, failed_items[half:])
+            for i, res in zip(failed, retried, strict=True):
+                results[i] = res
+
+        return results
+
+    async def _request_each(self, network: Network, items: list[tuple[Coin, str]]) -> list[Result[int]]:
+        """Request the balances one by one, concurrently. Each request waits for a slot of its node's AIMD limit,
+        and no more are started than the limits of the network nodes allow, so a large batch doesn't outlive
+        the leases of its account balances."""
+        limit = asyncio.Semaphore(max(self.concurrency.total_limit(self.core.services.network.get_rpc_urls(network)), 1))
+
+        async def request(coin: Coin, account: str) -> Result[int]:
+            async with limit:
+                return await self._request_balance(network, coin, account)
+
+        return list(await asyncio.gather(*(request(coin, account) for coin, account in items)))
+
+    async def check_account_balances(self, network: Network, account_balances: list[AccountBalance]) -> list[Result[int]]:
+        """Every (coin, account) is requested once, the result goes to all its account balances."""
+        coins = self.core.services.coin.get_coins_map()
+        keys = list(dict.fromkeys((ab.coin, ab.account) for ab in account_balances))
+        results = await self._request_balances(network, [(coins[coin], account) for coin, account in keys])
+        results_by_key = dict(zip(keys, results, strict=True))
+        for account_balance in account_balances:
+            res = results_by_key[(account_balance.coin, account_balance.account)]
+            metrics.balance_checks.inc(network.value, account_balance.coin, "ok" if res.is_ok() else "error")
+            if res.is_ok():
+                await self._save_balance(account_balance, coins[account_balance.coin], res.unwrap())
+            await self._reschedule(account_balance, res)
+        return [results_by_key[(ab.coin, ab.account)] for ab in account_balances]
+
+    async def check_account_balance(self, id: ObjectId) -> Result[int]:
+        await self.core.services.balance_writer.flush()  # the group summary delta needs the current balance
+        account_balance = await self.core.db.account_balance.get(id)
+        network = account_balance.network
+        account_balances = await self.claim(network, await self.find_same_key(network, [account_balance]), only_due=False)
+        if id not in {ab.id for ab in account_balances}:
+            return Result.err("being_checked")  # by another worker, it holds the lease
+        account_balances.sort(key=lambda ab: ab.id != id)
+        try:
+            return (await self.check_account_balances(network, account_balances))[0]
+        finally:
+            await self._return_unchecked(network, {ab.id for ab in account_balances})
 
-        balance_raw = res.unwrap()
+    async def _save_balance(self, account_balance: AccountBalance, coin: Coin, balance_raw: int) -> None:
         balance = (
             Decimal(0)
             if balance_raw == 0
             else round(Decimal(balance_raw) / 10**coin.decimals, ndigits=self.core.settings.round_ndigits)
         )
-        await self.core.db.group_balance.update_one(
-            {"group": account_balance.group, "coin": account_balance.coin},
-            {"$set": {f"balances.{account_balance.account}": balance, f"checked_at.{account_balance.account}": utc()}},
-        )
-        await self.core.db.account_balance.set(id, {"balance_raw": str(balance_raw), "balance": balance, "checked_at": utc()})
-
-        return res
+        now = utc()
+        if account_balance.checked_at is not None and account_balance.balance_raw != str(balance_raw):
+            account_balance.changed_at = now
+            account_balance.unchanged_checks = 0
+        elif account_balance.checked_at is not None:
+            account_balance.unchanged_checks += 1
+        previous = account_balance.balance if account_balance.checked_at is not None else None
+        account_balance.checked_at = now
+        account_balance.balance_raw = str(balance_raw)
+        account_balance.balance = balance
+        if process.checks_network(account_balance.network):
+            self.freshness_by_network.on_check(account_balance.network.value, account_balance.id, now)
+            self.freshness_by_coin.on_check(account_balance.coin, account_balance.id, now)
+        await self.core.services.balance_writer.add_balance(account_balance, balance, balance_raw, previous)
@@ -0,0 +1,115 @@
+import logging
+from decimal import Decimal
+from typing import override
+
+from bson import ObjectId
+from mm_base6 import Service
+from mm_concurrency import async_mutex
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core import lease
+from app.core.balance_buffer import BalanceBuffer, bulk_update, unwritten
+from app.core.db import AccountBalance, RpcMonitoring
+from app.core.types import AppCore
+
+logger = logging.getLogger(__name__)
+
+
+class BalanceWriterService(Service[AppCore]):
+    """Write-behind buffer for balance results. Flushed by size (bulk_write_size) or by time (every second).
+    What a flush fails to write goes back to the buffer and is retried by the next one."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.buffer = BalanceBuffer()
+        self.flush_failed = False  # don't flush by size until the scheduled flush succeeds
+
+    @override
+    def configure_scheduler(self) -> None:
+        self.core.scheduler.add("flush_balance_writes", 1, self.flush)
+
+    @override
+    async def on_stop(self) -> None:
+        await self.flush()
+
+    def pending_count(self) -> int:
+        return self.buffer.pending_count()
+
+    async def add_balance(
+        self, account_balance: AccountBalance, balance: Decimal, balance_raw: int, previous: Decimal | None
+    ) -> None:
+        """account_balance must already have the new checked_at, changed_at and unchanged_checks.
+        previous is the balance before this check, the group summary gets the delta."""
+        group_update = self.buffer.group_balances.setdefault((account_balance.group, account_balance.coin), {})
+        group_update[f"balances.{account_balance.account}"] = balance
+        group_update[f"checked_at.{account_balance.account}"] = account_balance.checked_at
+        self.buffer.account_balances.setdefault(account_balance.id, {}).update(
+            {
+                "balance_raw": str(balance_raw),
+                "balance": balance,
+                "checked_at": account_balance.checked_at,
+                "changed_at": account_balance.changed_at,
+                "unchanged_checks": account_balance.unchanged_checks,
+            }
+        )
+        if account_balance.checked_at is not None:
+            self.buffer.add_summary_delta(
+                account_balance.group, account_balance.coin, balance, previous, account_balance.checked_at
+            )
+        await self._flush_if_full()
+
+    async def release(self, id: ObjectId, due_at: float) -> None:
+        """Release the lease of a checked account balance, written with its balance if there is one."""
+        self.buffer.account_balances.setdefault(id, {}).update(lease.release_fields(due_at))
+        await self._flush_if_full()
+
+    async def add_rpc_monitoring(self, rpc_monitoring: RpcMonitoring) -> None:
+        self.buffer.rpc_monitoring.append(rpc_monitoring)
+        await self._flush_if_full()
+
+    async def _flush_if_full(self) -> None:
+        if not self.flush_failed and self.pending_count() >= self.core.settings.bulk_write_size:
+            await self.flush()
+
+    @async_mutex
+    async def flush(self) -> int:
+        pending = self.buffer.take()
+        count = pending.pending_count()
+        try:
+            await self._write(pending)
+        except Exception:
+            logger.exception("Failed to flush balance writes, the unwritten ones are retried")
+            self.buffer.restore(pending)
+            self.flush_failed = True
+            return 0
+        self.flush_failed = False
+        return count
+
+    async def _write(self, pending: BalanceBuffer) -> None:
+        """Written parts are removed from pending, after a failure it keeps only what is left to write."""
+        await bulk_update(
+            self.core.db.group_balance.collection,
+            pending.group_balances,
+            lambda key, update: UpdateOne({"group": key[0], "coin": key[1]}, {"$set": update}),
+        )
+        await bulk_update(
+            self.core.db.account_balance.collection,
+            pending.account_balances,
+            lambda id, update: UpdateOne({"_id": id}, {"$set": update}),
+        )
+        # a delta is applied exactly once if its bulk write reports the failed ones, a failure without a report
+        # (e.g. a lost connection) may count it twice, GroupService.reconcile_summaries fixes that
+        await bulk_update(
+            self.core.db.group_summary.collection,
+            pending.group_summaries,
+            lambda group, update: UpdateOne({"_id": group}, {op: f for op, f in update.items() if f}, upsert=True),
+        )
+        if pending.rpc_monitoring:
+            try:
+                await self.core.db.rpc_monitoring.insert_many(pending.rpc_monitoring)
+            except BulkWriteError as e:
+                failed = unwritten(e, len(pending.rpc_monitoring), ordered=True)
+                pending.rpc_monitoring = [m for i, m in enumerate(pending.rpc_monitoring) if i in failed]
+                raise
+            pending.rpc_monitoring = []
@@ -1,11 +1,138 @@
+import inspect
+from collections import Counter
+from datetime import timedelta
+from typing import Any, override
+
 from mm_base6 import Service
+from mm_std import utc
+from pydantic import BaseModel
 
+from app.core import lease
+from app.core.freshness import Freshness
+from app.core.metrics import metrics
+from app.core.process import ProcessRole, process
 from app.core.types import AppCore
 
+SYNC_SECONDS = 10  # how often the processes of the split deployment exchange settings and state
+STOPPED_WORKER_SECONDS = 300  # a worker which hasn't published its snapshot for this long is stopped
+WEB_STATE = ("check_balances", "check_namings")  # toggled in the web UI
+WORKER_STATE = ("proxies", "proxies_updated_at", "mm_node_checker", "mm_node_checker_updated_at")  # updated by workers
+
+
+class FreshnessStats(BaseModel):
+    networks: dict[str, Freshness]  # network -> freshness of its account balances
+    coins: dict[str, Freshness]  # coin_id -> freshness of its account balances
+    namings: dict[str, Freshness]  # naming -> freshness of its account names
+
 
 class BotService(Service[AppCore]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.worker_freshness: list[FreshnessStats] = []  # of the running workers, newest first, for a web-only process
+
+    @override
+    def configure_scheduler(self) -> None:
+        if process.role != ProcessRole.ALL:
+            self.core.scheduler.add("sync_process_snapshots", SYNC_SECONDS, self.sync_process_snapshots)
+
+    async def sync_process_snapshots(self) -> None:
+        """The split deployment shares settings and state through the database only. The web process publishes
+        the settings and the toggles edited in its UI, a worker publishes the state it updates,
+        and every process applies what the processes of the other role published."""
+        settings, state = self.core.settings, self.core.state
+        if process.is_web:
+            web_settings = {key: getattr(settings, key) for key in inspect.get_annotations(type(settings))}
+            await self._publish("web", web_settings, {key: getattr(state, key) for key in WEB_STATE})
+        else:
+            web = await self.core.db.process_snapshot.find_one({"_id": "web"})
+            if web is not None:
+                _apply(settings, web.settings)
+                _apply(state, web.state)
+
+        if process.is_worker:
+            worker_state = {key: getattr(state, key) for key in WORKER_STATE}
+            await self._publish(lease.OWNER_ID, {}, worker_state, self.get_freshness_stats().model_dump())
+        else:
+            running = {"_id": {"$ne": "web"}, "updated_at": {"$gt": utc() - timedelta(seconds=STOPPED_WORKER_SECONDS)}}
+            workers = sorted(await self.core.db.process_snapshot.find(running), key=lambda w: w.updated_at, reverse=True)
+            if workers:
+                _apply(state, workers[0].state)
+            self.worker_freshness = [FreshnessStats.model_validate(w.freshness) for w in workers if w.freshness]
+
+    async def _publish(
+        self, id: str, settings: dict[str, Any], state: dict[str, Any], freshness: dict[str, Any] | None = None
+    ) -> None:
+        snapshot = {"settings": settings, "state": state, "freshness": freshness or {}, "updated_at": utc()}
+        await self.core.db.process_snapshot.collection.update_one({"_id": id}, {"$set": snapshot}, upsert=True)
+
     def toggle_check_balances(self) -> None:
         self.core.state.check_balances = not self.core.state.check_balances
 
     def toggle_check_namings(self) -> None:
         self.core.state.check_namings = not self.core.state.check_namings
+
+    def get_freshness_stats(self) -> FreshnessStats:
+        """From memory, the networks and namings checked by this process.
+        A web-only process checks none, it shows what the running workers published."""
+        if not process.is_worker:
+            return _merge_freshness(self.worker_freshness)
+        balance = self.core.services.balance
+        name = self.core.services.name
+        return FreshnessStats(
+            networks=balance.freshness_by_network.get_stats(balance.due_queue.due_at),
+            coins=balance.freshness_by_coin.get_stats(balance.due_queue.due_at),
+            namings=name.freshness.get_stats(name.due_queue.due_at),
+        )
+
+    def render_metrics(self) -> str:
+        """Prometheus text format. Gauges are read from the in-memory state of the services right now."""
+        balance, name, network, proxy = (
+            self.core.services.balance,
+            self.core.services.name,
+            self.core.services.network,
+            self.core.services.proxy,
+        )
+        metrics.queue_depth.set_all(
+            {("balances", key): balance.due_queue.count(key) for key in balance.due_queue.heaps}
+            | {("names", key): name.due_queue.count(key) for key in name.due_queue.heaps}
+        )
+        metrics.rpc_concurrency_limit.set_all({(url,): int(lim.limit) for url, lim in balance.concurrency.limiters.items()})
+        metrics.rpc_in_flight.set_all({(url,): lim.in_flight for url, lim in balance.concurrency.limiters.items()})
+        metrics.rpc_urls.set_all({(n.value,): len(network.get_rpc_urls(n)) for n in network.rpc_urls})
+
+        states = Counter(health.state.value for health in proxy.pool.proxies.values())
+        metrics.proxies.set_all({(state,): count for state, count in states.items()})
+        metrics.proxies_in_flight.set(sum(health.in_flight for health in proxy.pool.proxies.values()))
+        now = utc()
+        if self.core.state.proxies_updated_at:
+            metrics.proxies_age.set((now - self.core.state.proxies_updated_at).total_seconds())
+        if self.core.state.mm_node_checker_updated_at:
+            metrics.node_checker_age.set((now - self.core.state.mm_node_checker_updated_at).total_seconds())
+        return metrics.render()
+
+
+def _apply(target: object, values: dict[str, Any]) -> None:
+    """Set the changed attributes only, setting the state writes it to the database."""
+    for key, value in values.items():
+        if hasattr(target, key) and getattr(target, key) != value:
+            setattr(target, key, value)
+
+
+def _merge_freshness(worker_freshness: list[FreshnessStats]) -> FreshnessStats:
+    """Workers publish the networks and namings of their shards. If the shards overlap, the newest snapshot is shown
+    with the throughput of all the workers checking it."""
+    merged = FreshnessStats(networks={}, coins={}, namings={})
+    for stats in worker_freshness:
+        for merged_stats, worker_stats in (
+            (merged.networks, stats.networks),
+            (merged.coins, stats.coins),
+            (merged.namings, stats.namings),
+        ):
+            for key, freshness in worker_stats.items():
+                if key not in merged_stats:
+                    merged_stats[key] = freshness.model_copy()
+                    continue
+                shown = merged_stats[key]
+                shown.checks_per_minute += freshness.checks_per_minute
+                shown.drain_seconds = shown.backlog / shown.checks_per_minute * 60 if shown.checks_per_minute > 0 else None
+    return merged
@@ -2,7 +2,6 @@ import logging
 from datetime import datetime
 from typing import override
 
-import pydash
 import tomlkit
 from mm_base6 import Service
 from mm_base6.core.utils import toml_dumps
@@ -12,8 +11,11 @@ from mm_std import compact_dict
 from mm_web3 import Network, NetworkType
 from pydantic import BaseModel
 
+from app.core.background_cache import REFRESH_SECONDS, BackgroundCache
 from app.core.db import Coin
+from app.core.process import process
 from app.core.types import AppCore
+from app.core.utils import check_stats_group
 
 logger = logging.getLogger(__name__)
 
@@ -48,6 +50,13 @@ class CoinService(Service[AppCore]):
     def __init__(self) -> None:
         super().__init__()
         self.coins: list[Coin] = []
+        self.coins_map: dict[str, Coin] = {}
+        self.check_stats = BackgroundCache(self.calc_coin_check_stats)
+
+    @override
+    def configure_scheduler(self) -> None:
+        if process.is_web:
+            self.core.scheduler.add("refresh_coin_check_stats", REFRESH_SECONDS, self.check_stats.refresh_if_read)
 
     @override
     async def on_start(self) -> None:
@@ -80,12 +89,13 @@ class CoinService(Service[AppCore]):
 
     async def load_coins_from_db(self) -> None:
         self.coins = await self.core.db.coin.find({}, "_id")
+        self.coins_map = {c.id: c for c in self.coins}
 
     def get_coins(self) -> list[Coin]:
         return self.coins
 
     def get_coins_map(self) -> dict[str, Coin]:
-        return {c.id: c for c in self.get_coins()}
+        return self.coins_map
 
     def explorer_token_map(self) -> dict[str, str]:  # coin_id -> explorer_token
         result: dict[str, str] = {}
@@ -108,7 +118,7 @@ class CoinService(Service[AppCore]):
         return coins_by_network_type
 
     def get_coin(self, id: str) -> Coin:
-        res = pydash.find(self.coins, lambda c: c.id == id)
+        res = self.coins_map.get(id)
         if res is None:
             raise ValueError(f"Coin with id {id} not found")
         return res
@@ -123,18 +133,14 @@ class CoinService(Service[AppCore]):
         return res
 
     async def calc_coin_check_stats(self) -> CoinCheckStats:
+        cursor = await self.core.db.account_balance.collection.aggregate([{"$group": check_stats_group("$coin")}])
+        stats = {d["_id"]: d async for d in cursor}
         result = CoinCheckStats(coins={})
         for coin in self.get_coins():
-            oldest_checked_time = None
-            never_checked_count = await self.core.db.account_balance.count({"coin": coin.id, "checked_at": None})
-            if never_checked_count == 0:
-                account_balance = await self.core.db.account_balance.find_one({"coin": coin.id}, "checked_at")
-                if account_balance:
-                    oldest_checked_time = account_balance.checked_at
+            d = stats.get(coin.id, {})
             result.coins[coin.id] = CoinCheckStats.Stats(
-                oldest_checked_time=oldest_checked_time,
-                never_checked_count=never_checked_count,
-                all_count=await self.core.db.account_balance.count({"coin": coin.id}),
+                oldest_checked_time=d.get("oldest_checked_time") if not d.get("never_checked_count") else None,
+                never_checked_count=d.get("never_checked_count", 0),
+                all_count=d.get("all_count", 0),
             )
-
         return result
@@ -1,9 +1,12 @@
 import asyncio
+import contextlib
 import logging
+import re
 from dataclasses import dataclass
 from decimal import Decimal
 from pathlib import Path
-from typing import Any, cast
+from typing import Any, cast, override
+from urllib.parse import urlencode
 from zipfile import ZipFile
 
 import aiofiles
@@ -14,17 +17,24 @@ from mm_base6 import Service, UserError
 from mm_base6.core.utils import toml_dumps
 from mm_concurrency import async_mutex
 from mm_mongo import MongoDeleteResult
-from mm_std import parse_lines
+from mm_std import parse_lines, utc
 from mm_web3 import Network, NetworkType
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
 
 from app.core import utils
+from app.core.balance_buffer import summary_correction
 from app.core.constants import Naming
-from app.core.db import AccountBalance, AccountName, Coin, Group, GroupBalance, GroupName
+from app.core.db import AccountBalance, AccountName, Coin, Group, GroupBalance, GroupCoinSummary, GroupName, GroupSummary
+from app.core.process import process
 from app.core.types import AppCore
 
 logger = logging.getLogger(__name__)
 
+MAX_GROUP_PAGE_LIMIT = 1000  # accounts on one page of the group view
+RECONCILE_SUMMARIES_SECONDS = 600
+REBUILD_SUMMARY_ATTEMPTS = 3  # a rebuild loses to concurrent delta writes, reconcile_summaries fixes it later
+
 
 @dataclass
 class ProcessAccountBalancesResult:
@@ -47,11 +57,34 @@ class ImportGroupItem(BaseModel):
     accounts: str
 
 
+class GroupAccountsQuery(BaseModel):
+    sort: str = ""  # "" - group order, "note", "balance:{coin}", "name:{naming}"
+    desc: bool = False
+    search: str = ""  # a part of the account or its note
+    page: int = Field(default=1, ge=1)
+    limit: int = Field(default=100, ge=1, le=MAX_GROUP_PAGE_LIMIT)
+
+    @property
+    def skip(self) -> int:
+        return (self.page - 1) * self.limit
+
+    def url(self, **changes: object) -> str:
+        return "?" + urlencode(self.model_dump() | changes)
+
+
 class GroupAccountsInfo(BaseModel):
     coins_map: dict[str, Coin]  # coin_id -> Coin
     coins_sum: dict[str, Decimal]  # coin -> sum(balance)
-    balances: dict[str, dict[str, Decimal]]  # coin -> account -> balance
-    names: dict[Naming, dict[str, str]]  # naming -> account -> name
+    summary: GroupSummary
+    query: GroupAccountsQuery
+    accounts: list[str]  # accounts of the page
+    total: int  # how many accounts match the search
+    balances: dict[str, dict[str, Decimal]]  # coin -> account -> balance, accounts of the page only
+    names: dict[Naming, dict[str, str]]  # naming -> account -> name, accounts of the page only
+
+    @property
+    def pages(self) -> int:
+        return max(1, -(-self.total // self.query.limit))
 
     def get_balance(self, coin: str, account: str) -> Decimal | None:
         return self.balances.get(coin, {}).get(account, None)
@@ -65,24 +98,166 @@ class GroupAccountsInfo(BaseModel):
 
 
 class GroupService(Service[AppCore]):
-    async def get_group_accounts_info(self, group: ObjectId) -> GroupAccountsInfo:
-        balances: dict[str, dict[str, Decimal]] = {}
-        for gb in await self.core.db.group_balance.find({"group": group}):
-            balances[gb.coin] = gb.balances
-
-        coins_sum: dict[str, Decimal] = {}
-        for coin, coin_balances in balances.items():
-            if coin_balances:
-                coins_sum[coin] = cast(Decimal, sum(coin_balances.values()))
-
-        namings: dict[Naming, dict[str, str]] = {}
-        for gn in await self.core.db.group_name.find({"group": group}):
-            namings[gn.naming] = gn.names
+    def __init__(self) -> None:
+        super().__init__()
+        self.summary_drift: dict[ObjectId, dict[str, dict[str, Any]]] = {}  # group -> correction seen by the last run
+
+    @override
+    def configure_scheduler(self) -> None:
+        if process.is_worker:
+            self.core.scheduler.add("reconcile_group_summaries", RECONCILE_SUMMARIES_SECONDS, self.reconcile_summaries)
+
+    @override
+    async def on_start(self) -> None:
+        # groups created before the summaries were maintained
+        for group in await self.core.db.group.find({}, "_id"):
+            if not await self.core.db.group_summary.exists({"_id": group.id}):
+                await self.rebuild_summary(group.id)
+
+    async def get_group_accounts_info(self, group: Group, query: GroupAccountsQuery) -> GroupAccountsInfo:
+        """One page of the group accounts. Balances and names are read for the accounts of the page only."""
+        accounts = group.accounts
+        if query.search:
+            search = query.search.lower()
+            accounts = [a for a in accounts if search in a.lower() or search in group.account_notes.get(a, "").lower()]
+        total = len(accounts)
+        accounts = await self._sort_and_slice_accounts(group, accounts, query)
 
+        balances: dict[str, dict[str, Decimal]] = {}
+        for ab in await self.core.db.account_balance.find({"group": group.id, "account": {"$in": accounts}}):
+            if ab.balance is not None:
+                balances.setdefault(ab.coin, {})[ab.account] = ab.balance
+        names: dict[Naming, dict[str, str]] = {}
+        for an in await self.core.db.account_name.find({"group": group.id, "account": {"$in": accounts}}):
+            if an.name is not None:
+                names.setdefault(an.naming, {})[an.account] = an.name
+
+        summary = await self.get_summary(group.id)
+        coins_sum = {coin: s.total for coin, s in summary.coins.items() if s.checked > 0}
         return GroupAccountsInfo(
-            coins_sum=coins_sum, balances=balances, names=namings, coins_map=self.core.services.coin.get_coins_map()
+            coins_map=self.core.services.coin.get_coins_map(),
+            coins_sum=coins_sum,
+            summary=summary,
+            query=query,
+            accounts=accounts,
+            total=total,
+            balances=balances,
+            names=names,
         )
 
+    async def _sort_and_slice_accounts(self, group: Group, accounts: list[str], query: GroupAccountsQuery) -> list[str]:
+        kind, _, key = query.sort.partition(":")
+        if kind == "note":
+            accounts = sorted(accounts, key=lambda a: group.account_notes.get(a, ""), reverse=query.desc)
+            return accounts[query.skip : query.skip + query.limit]
+        if kind in ("balance", "name") and key:
+            # sorted and sliced by the db, a page reads only its own documents
+            collection, field, key_field = (
+                (self.core.db.account_balance.collection, "balance", "coin")
+                if kind == "balance"
+                else (self.core.db.account_name.collection, "name", "naming")
+            )
+            db_query: dict[str, object] = {"group": group.id, key_field: key}
+            if query.search:
+                # a search can match the whole group, so the matched accounts are not listed in $in. Only the ones
+                # matched by their notes are, there are at most as many of them as notes.
+                search = query.search.lower()
+                noted = [a for a, note in group.account_notes.items() if search in note.lower() and search not in a.lower()]
+                db_query["$or"] = [
+                    {"account": {"$regex": re.escape(query.search), "$options": "i"}},
+                    {"account": {"$in": noted}},
+                ]
+            cursor = collection.find(db_query, {"account": True})
+            cursor = cursor.sort([(field, -1 if query.desc else 1), ("account", 1)]).skip(query.skip).limit(query.limit)
+            return [d["account"] async for d in cursor]
+        if query.desc:
+            accounts = accounts[::-1]
+        return accounts[query.skip : query.skip + query.limit]
+
+    async def get_summary(self, group: ObjectId) -> GroupSummary:
+        summary = await self.core.db.group_summary.find_one({"_id": group})
+        return summary or GroupSummary(id=group)
+
+    async def get_summaries(self, groups: list[ObjectId]) -> dict[ObjectId, GroupSummary]:
+        return {s.id: s for s in await self.core.db.group_summary.find({"_id": {"$in": groups}})}
+
+    async def calc_summaries(self, match: dict[str, Any]) -> dict[ObjectId, dict[str, GroupCoinSummary]]:
+        """Sum the account balances, group -> coin -> summary."""
+        cursor = await self.core.db.account_balance.collection.aggregate(
+            [
+                {"$match": match},
+                {
+                    "$group": {
+                        "_id": {"group": "$group", "coin": "$coin"},
+                        "total": {"$sum": "$balance"},
+                        "non_zero": {"$sum": {"$cond": [{"$gt": ["$balance", 0]}, 1, 0]}},
+                        "checked": {"$sum": {"$cond": [{"$gt": ["$checked_at", None]}, 1, 0]}},
+                        "checked_at": {"$max": "$checked_at"},
+                        "changed_at": {"$max": "$changed_at"},
+                    }
+                },
+            ]
+        )
+        result: dict[ObjectId, dict[str, GroupCoinSummary]] = {}
+        async for d in cursor:
+            key = d.pop("_id")
+            d["total"] = Decimal(str(d["total"]))  # $sum returns Decimal128 or 0
+            result.setdefault(key["group"], {})[key["coin"]] = GroupCoinSummary(**d)
+        return result
+
+    async def _replace_summary(self, summary: GroupSummary, coins: dict[str, GroupCoinSummary]) -> bool:
+        """Replace the summary if no delta was written since it was read. A summary without a version is missing
+        or older than the versions, version 0 matches it."""
+        doc = {"coins": {coin: s.model_dump() for coin, s in coins.items()}, "version": summary.version + 1}
+        try:
+            await self.core.db.group_summary.collection.replace_one(
+                {"_id": summary.id, "version": summary.version or None}, doc, upsert=True
+            )
+        except DuplicateKeyError:  # the filter didn't match the existing summary, so the upsert tried to insert it
+            return False
+        return True
+
+    async def rebuild_summary(self, group: ObjectId) -> GroupSummary:
+        """Sum the account balances of the group again. The balance writer keeps the summary up to date with deltas,
+        this is for changes which are not balance checks, e.g. removed accounts or coins."""
+        await self.core.services.balance_writer.flush()  # pending deltas would be counted twice
+        for _ in range(REBUILD_SUMMARY_ATTEMPTS):
+            summary = await self.get_summary(group)  # read before the balances, so a delta written since wins
+            coins = (await self.calc_summaries({"group": group})).get(group, {})
+            if await self._replace_summary(summary, coins):
+                return GroupSummary(id=group, coins=coins, version=summary.version + 1)
+        logger.warning("Group summary rebuild lost to balance writes, reconcile_summaries fixes it", extra={"group": group})
+        return await self.get_summary(group)
+
+    async def reconcile_summaries(self) -> None:
+        """Fix summaries which drifted from the account balances, e.g. a delta counted twice after a lost connection,
+        a rebuild which counted the balances of buffered deltas or a check in flight while the balances were reset.
+        A flush of another worker may be between its account balance and summary writes, so a drift is corrected
+        only if the next run sees the same one. The correction is an $inc, deltas written meanwhile are kept.
+        It's compared and set with reconciled_at, so the same drift isn't corrected by several workers."""
+        summaries = {s.id: s for s in await self.core.db.group_summary.find({})}
+        calculated = await self.calc_summaries({})
+        drift: dict[ObjectId, dict[str, dict[str, Any]]] = {}
+        for group in await self.core.db.group.find({}, "_id"):
+            summary = summaries.get(group.id) or GroupSummary(id=group.id)
+            coins = calculated.get(group.id, {})
+            correction = summary_correction(
+                {coin: s.model_dump() for coin, s in summary.coins.items()}, {coin: s.model_dump() for coin, s in coins.items()}
+            )
+            if not correction:
+                continue
+            if self.summary_drift.get(group.id) != correction:
+                drift[group.id] = correction
+                continue
+            logger.warning("Group summary drifted, corrected", extra={"group": group.id, "correction": correction})
+            correction.setdefault("$inc", {})["version"] = 1
+            correction.setdefault("$set", {})["reconciled_at"] = utc()
+            with contextlib.suppress(DuplicateKeyError):  # another worker has corrected it since the summary was read
+                await self.core.db.group_summary.collection.update_one(
+                    {"_id": group.id, "reconciled_at": summary.reconciled_at}, correction, upsert=True
+                )
+        self.summary_drift = drift
+
     async def create_group(
         self, name: str, network_type: NetworkType, notes: str, namings: list[Naming], coin_ids: list[str]
     ) -> Group:
@@ -179,6 +354,7 @@ class GroupService(Service[AppCore]):
         await self.core.db.account_name.delete_many({"group": id})
         await self.core.db.group_name.delete_many({"group": id})
         await self.core.db.group_balance.delete_many({"group": id})
+        await self.core.db.group_summary.delete_many({"_id": id})
         return await self.core.db.group.delete(id)
 
     async def update_accounts(self, id: ObjectId, accounts: list[str]) -> None:
@@ -252,12 +428,16 @@ class GroupService(Service[AppCore]):
                 for account in group.accounts
             ]
             await self.core.db.account_balance.insert_many(insert_many)
+            self.core.services.balance.enqueue(insert_many)
 
     @async_mutex
     async def remove_coin(self, group_id: ObjectId, coin_id: str) -> None:
         logger.debug("remove_coin", extra={"group_id": group_id, "coin_id": coin_id})
         await self.core.db.account_balance.delete_many({"group": group_id, "coin": coin_id})
         await self.core.db.group_balance.delete_one({"group": group_id, "coin": coin_id})
+        await self.core.db.group_summary.update_one(
+            {"_id": group_id}, {"$unset": {f"coins.{coin_id}": ""}, "$inc": {"version": 1}}
+        )
         await self.core.db.group.pull(group_id, {"coins": coin_id})
 
     async def remove_naming(self, group_id: ObjectId, naming: Naming) -> None:
@@ -283,6 +463,7 @@ class GroupService(Service[AppCore]):
                 for account in group.accounts
             ]
             await self.core.db.account_name.insert_many(insert_many)
+            self.core.services.name.enqueue(insert_many)
 
     @async_mutex
     async def process_account_balances(self, id: ObjectId) -> ProcessAccountBalancesResult:
@@ -307,10 +488,13 @@ class GroupService(Service[AppCore]):
                     for account in new_accounts
                 ]
                 await self.core.db.account_balance.insert_many(insert_many)
+                self.core.services.balance.enqueue(insert_many)
                 inserted += len(new_accounts)
         deleted = (
             await self.core.db.account_balance.delete_many({"group": id, "account": {"$nin": group.accounts}})
         ).deleted_count
+        if deleted > 0:
+            await self.rebuild_summary(id)
 
         return ProcessAccountBalancesResult(inserted=inserted, deleted=deleted)
 
@@ -335,6 +519,7 @@ class GroupService(Service[AppCore]):
                     for account in new_accounts
                 ]
                 await self.core.db.account_name.insert_many(insert_many)
+                self.core.services.name.enqueue(insert_many)
                 inserted += len(new_accounts)
 
         deleted = (await self.core.db.account_name.delete_many({"group": id, "account": {"$nin": group.accounts}})).deleted_count
@@ -342,6 +527,14 @@ class GroupService(Service[AppCore]):
 
     async def reset_group_balances(self, id: ObjectId) -> None:
         await self.core.db.group_balance.update_many({"group": id}, {"$set": {"balances": {}}})
-        await self.core.db.account_balance.update_many(
-            {"group": id}, {"$set": {"balance": None, "balance_raw": None, "checked_at": None}}
-        )
+        reset = {
+            "balance": None,
+            "balance_raw": None,
+            "checked_at": None,
+            "changed_at": None,
+            "unchanged_checks": 0,
+            "due_at": None,  # due now, a lease of a worker checking it is kept
+        }
+        await self.core.db.account_balance.update_many({"group": id}, {"$set": reset})
+        await self.rebuild_summary(id)
+        self.core.services.balance.enqueue(await self.core.db.account_balance.find({"group": id}))
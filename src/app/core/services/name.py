@@ -1,27 +1,162 @@
+import itertools
+import json
 import logging
-from datetime import datetime
-from typing import override
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import Any, override
 
 from bson import ObjectId
 from mm_base6 import Service
-from mm_concurrency import AsyncTaskRunner, async_mutex_by
+from mm_concurrency import AsyncTaskRunner, async_mutex, async_mutex_by
 from mm_result import Result
 from mm_std import utc
+from mm_web3 import Network
+from pydantic import BaseModel
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
+from app.core import lease
+from app.core.background_cache import REFRESH_SECONDS, BackgroundCache
 from app.core.blockchains import aptos, evm, starknet
 from app.core.constants import Naming
-from app.core.db import NamingProblem
+from app.core.db import AccountName, NamingProblem
+from app.core.due_queue import DueQueue
+from app.core.freshness import FreshnessTracker
+from app.core.metrics import metrics
+from app.core.name_cache import CachedName, NameCache
+from app.core.process import process
 from app.core.types import AppCore
+from app.core.utils import check_stats_group
 
 logger = logging.getLogger(__name__)
 
 
+RETRY_FAILED_SECONDS = 60  # when to check again an account name which failed
+MAX_IDLE_SECONDS = 10  # how long a naming queue sleeps if nothing is due
+DISCOVER_INTERVAL_SECONDS = 10  # how often a worker looks for account names made due by other processes
+
+
+class NamingProblemSummary(BaseModel):
+    class Account(BaseModel):
+        naming: Naming
+        account: str
+        count: int
+        errors: list[str]
+        last_seen: datetime
+
+    class Error(BaseModel):
+        naming: Naming
+        error: str
+        count: int
+        accounts: int  # how many accounts have this error
+        last_seen: datetime
+
+    accounts: list[Account]  # top failing accounts
+    errors: list[Error]  # top errors
+
+
 class NameService(Service[AppCore]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.due_queue = DueQueue()  # naming -> account_name ids by due time
+        self.name_cache = NameCache()  # (naming, account) -> resolved name
+        self.freshness = FreshnessTracker()  # account_name id -> last check, by naming
+        self.problems: dict[str, NamingProblem] = {}  # not flushed yet, id -> problem
+        self.checking: set[ObjectId] = set()  # account names this worker claimed and hasn't rescheduled yet
+        self.oldest_checked_time = BackgroundCache(self.calc_oldest_checked_time)
+
     @override
     def configure_scheduler(self) -> None:
-        for naming in list(Naming):
+        namings = self.get_checked_namings()
+        for naming in namings:
             task_id = "names_on_" + naming
-            self.core.scheduler.add(task_id, 2, self.check_next_naming, args=(naming,))
+            self.core.scheduler.add(task_id, 1, self.wait_and_check_naming, args=(naming,))
+        if namings:
+            self.core.scheduler.add("discover_due_names", DISCOVER_INTERVAL_SECONDS, self.discover_due)
+        self.core.scheduler.add("flush_naming_problems", 10, self.flush_problems)
+        if process.is_web:
+            self.core.scheduler.add("refresh_oldest_checked_time", REFRESH_SECONDS, self.oldest_checked_time.refresh_if_read)
+
+    @override
+    async def on_start(self) -> None:
+        # naming problems were stored one document per failure before they were aggregated
+        await self.core.db.naming_problem.delete_many({"created_at": {"$exists": True}})
+        await self.load_name_cache()
+        if self.get_checked_namings():
+            await self.load_due_queue()
+
+    @staticmethod
+    def get_checked_namings() -> list[Naming]:
+        """Namings this process checks on schedule, none in a web-only process."""
+        return [naming for naming in Naming if process.checks_naming(naming)]
+
+    @override
+    async def on_stop(self) -> None:
+        await self.flush_problems()
+
+    async def load_name_cache(self) -> int:
+        """Warm the cache with the latest unexpired resolutions, so a restart doesn't resolve every account again."""
+        self.name_cache.configure(self.core.settings.name_cache_size)
+        cursor = self.core.db.name_resolution.collection.find({"expires_at": {"$gt": utc()}})
+        docs = await cursor.sort("resolved_at", -1).limit(self.name_cache.max_size).to_list()
+        for doc in reversed(docs):  # the most recent ones end up as the most recently used
+            self.name_cache.put(Naming(doc["naming"]), doc["account"], doc["name"], doc["expires_at"].timestamp())
+        return len(docs)
+
+    async def load_due_queue(self) -> int:
+        count = 0
+        projection = {"naming": True, "name": True, "checked_at": True, "due_at": True}
+        query = {"naming": {"$in": [n.value for n in self.get_checked_namings()]}}
+        async for doc in self.core.db.account_name.collection.find(query, projection):
+            count += 1
+            self.track(doc["naming"], doc["_id"], doc["checked_at"])
+            if doc.get("due_at") is not None:
+                self.push_due(doc["naming"], doc["_id"], doc["due_at"].timestamp())
+                continue
+            self.schedule(doc["naming"], doc["_id"], doc["checked_at"], doc.get("name"))
+        return count
+
+    def schedule(self, naming: str, id: ObjectId, checked_at: datetime | None, name: str | None) -> None:
+        due_at = 0.0 if checked_at is None else checked_at.timestamp() + self.get_check_interval(name) * 60
+        self.push_due(naming, id, due_at)
+
+    def get_check_interval(self, name: str | None) -> int:  # minutes, also the ttl of cached names
+        return self.core.settings.check_name_interval if name else self.core.settings.check_empty_name_interval
+
+    def push_due(self, naming: str, id: ObjectId, due_at: float) -> None:
+        """Push it to the local queue if this process checks the naming, see BalanceService.push_due."""
+        if process.checks_naming(Naming(naming)):
+            self.due_queue.push(naming, id, due_at)
+
+    def track(self, naming: str, id: ObjectId, checked_at: datetime | None) -> None:
+        """Track the freshness of the account name if this process checks the naming."""
+        if process.checks_naming(Naming(naming)):
+            self.freshness.track(naming, id, checked_at)
+
+    def enqueue(self, account_names: list[AccountName]) -> None:
+        """Make the account names due right now, e.g. new ones.
+        Namings checked by other processes pick them up with discover_due."""
+        for an in account_names:
+            self.track(an.naming.value, an.id, None)
+            self.push_due(an.naming.value, an.id, 0.0)
+
+    async def discover_due(self) -> int:
+        """Push account names which were added by other processes, see BalanceService.discover_due."""
+        namings = [n.value for n in self.get_checked_namings()]
+        query = {"naming": {"$in": namings}, "checked_at": None, "due_at": None, "lease_owner": None}
+        count = 0
+        async for doc in self.core.db.account_name.collection.find(query, {"naming": True}):
+            if doc["_id"] not in self.due_queue.due_at:
+                self.track(doc["naming"], doc["_id"], None)
+                self.push_due(doc["naming"], doc["_id"], 0.0)
+                count += 1
+        return count
+
+    async def wait_and_check_naming(self, naming: Naming) -> None:
+        await self.due_queue.wait(naming.value, MAX_IDLE_SECONDS)
+        self.name_cache.configure(self.core.settings.name_cache_size)  # settings can be changed at any time
+        await self.check_next_naming(naming)
 
     @async_mutex_by(param="naming")
     async def check_next_naming(self, naming: Naming) -> None:
@@ -29,70 +164,341 @@ class NameService(Service[AppCore]):
             return
         # self.logger.debug("check_next_naming called: %s", naming)
 
-        # first check accounts that were never checked
-        need_to_check = await self.core.db.account_name.find(
-            {"naming": naming, "checked_at": None}, limit=self.core.settings.limit_naming_workers
-        )
-        if len(need_to_check) < self.core.settings.limit_naming_workers:
-            need_to_check += await self.core.db.account_name.find(
-                {"naming": naming, "checked_at": {"$lt": utc(minutes=-1 * self.core.settings.check_name_interval)}},
-                "checked_at",
-                limit=self.core.settings.limit_naming_workers - len(need_to_check),
-            )
-        if not need_to_check:
+        batch_size = self.get_batch_size(naming)
+        ids = self.due_queue.pop_due(naming.value, self.core.settings.limit_naming_workers * batch_size)
+        if not ids:
             return
+        popped = set(ids)  # not in the queue until they are rescheduled
+        by_account: dict[str, list[AccountName]] = {}
+        try:
+            # deleted account names are not in the db anymore, so they just drop out of the queue
+            due = await self.core.db.account_name.find({"_id": {"$in": ids}})
+            deleted = popped - {an.id for an in due}
+            popped -= deleted
+            self.freshness.forget(list(deleted))
+            claimed = await self.claim(naming, due)
+            # the same account of other groups is resolved once with the due one, even if it is due later
+            claimed_ids = {an.id for an in claimed}
+            same_account = [an for an in await self.find_same_account(naming, claimed) if an.id not in claimed_ids]
+            for an in claimed + await self.claim(naming, same_account, only_due=False):
+                by_account.setdefault(an.account, []).append(an)
+
+            runner = AsyncTaskRunner(self.core.settings.limit_naming_workers, name="check_names")
+            if batch_size > 1:
+                for chunk in itertools.batched(by_account.values(), batch_size, strict=False):
+                    task = self.check_ens_names(list(chunk))
+                    runner.add(str(chunk[0][0].id), metrics.track_in_flight("check_names", naming.value, task))
+            else:
+                for account_names in by_account.values():
+                    task = self.check_account_names(account_names)
+                    runner.add(str(account_names[0].id), metrics.track_in_flight("check_names", naming.value, task))
+            await runner.run()
+        finally:
+            await self._return_unchecked(naming, popped | {an.id for group in by_account.values() for an in group})
+
+    async def _return_unchecked(self, naming: Naming, ids: set[ObjectId]) -> None:
+        """Put the ids of a failed pass back to the queue and release the claimed ones, see BalanceService._return_unchecked."""
+        due_at = time.time() + RETRY_FAILED_SECONDS
+        for id in ids:
+            if id in self.checking:
+                self.checking.discard(id)
+                self.push_due(naming.value, id, due_at)
+                try:
+                    await self.core.db.account_name.set(id, lease.release_fields(due_at))
+                except Exception:  # the db may be what failed, the lease expires then
+                    logger.exception("Failed to release an account name", extra={"id": id})
+            elif id not in self.due_queue.due_at:
+                self.push_due(naming.value, id, due_at)
 
-        runner = AsyncTaskRunner(self.core.settings.limit_naming_workers, name="check_names")
-        for an in need_to_check:
-            runner.add(str(an.id), self.check_account_name(an.id))
-        await runner.run()
+    def get_batch_size(self, naming: Naming) -> int:
+        """ENS names are resolved in bulk if a ReverseRecords contract is configured."""
+        if naming == Naming.ENS and self.core.settings.ens_reverse_records:
+            return max(self.core.settings.ens_batch_size, 1)
+        return 1
+
+    async def claim(self, naming: Naming, account_names: list[AccountName], *, only_due: bool = True) -> list[AccountName]:
+        """Keep only the account names this worker claimed, see BalanceService.claim."""
+        ids = [an.id for an in account_names]
+        claimed, others = await lease.claim(self.core.db.account_name.collection, ids, only_due=only_due)
+        for id, lease_until in others.items():
+            self.push_due(naming.value, id, lease_until.timestamp() if lease_until else time.time() + RETRY_FAILED_SECONDS)
+        self.checking.update(claimed)
+        return [an for an in account_names if an.id in claimed]
+
+    async def find_same_account(self, naming: Naming, account_names: list[AccountName]) -> list[AccountName]:
+        if not account_names:
+            return []
+        accounts = list({an.account for an in account_names})
+        return await self.core.db.account_name.find({"naming": naming.value, "account": {"$in": accounts}})
 
     async def check_account_name(self, id: ObjectId) -> Result[str | None]:
         account_name = await self.core.db.account_name.get(id)
+        naming = account_name.naming
+        account_names = await self.claim(naming, await self.find_same_account(naming, [account_name]), only_due=False)
+        if id not in {an.id for an in account_names}:
+            return Result.err("being_checked")  # by another worker, it holds the lease
+        account_names.sort(key=lambda an: an.id != id)
+        try:
+            return await self.check_account_names(account_names)
+        finally:
+            await self._return_unchecked(naming, {an.id for an in account_names})
+
+    async def check_account_names(self, account_names: list[AccountName]) -> Result[str | None]:
+        """Account names of one naming and account. The name is resolved once, or taken from the cache, for all of them."""
+        account_name = account_names[0]
+        naming, account = account_name.naming, account_name.account
+        # self.logger.debug("check_account_names called: %s / %s", naming, account)
+
+        cached = self.name_cache.get(naming, account)
+        if cached is None:
+            res = await self._resolve_name(account_name)
+            if res.is_err():
+                for an in account_names:
+                    await self._retry_later(an)
+                return res
+            cached = await self._cache_name(naming, account, res.unwrap() or "")
 
-        # self.logger.debug("check_account_name called: %s / %s", account_naming.naming, account_naming.account)
+        await self._save_name(account_names, cached)
+        return Result.ok(cached.name or None)
+
+    async def check_ens_names(self, accounts: list[list[AccountName]]) -> Result[int]:
+        """ENS names of many accounts, each item is the account names of one account. Uncached accounts are
+        resolved with one eth_call to the ReverseRecords contract. Returns how many accounts were resolved."""
+        uncached: list[list[AccountName]] = []
+        for account_names in accounts:
+            cached = self.name_cache.get(Naming.ENS, account_names[0].account)
+            if cached is None:
+                uncached.append(account_names)
+            else:
+                await self._save_name(account_names, cached)
+        if not uncached:
+            return Result.ok(0)
+
+        res = await self._resolve_ens_names([account_names[0].account for account_names in uncached])
+        if res.is_err():
+            for account_names in uncached:
+                for an in account_names:
+                    await self._retry_later(an)
+                self.add_problem(Naming.ENS, Naming.ENS.network, account_names[0].account, res)
+            return res  # type:ignore[return-value]
 
+        for account_names, name in zip(uncached, res.unwrap(), strict=True):
+            await self._save_name(account_names, await self._cache_name(Naming.ENS, account_names[0].account, name))
+        return Result.ok(len(uncached))
+
+    async def _resolve_ens_names(self, accounts: list[str]) -> Result[list[str]]:
+        res: Result[list[str]] = Result.err("not started yet")
+        for _ in range(3):
+            urls = self.core.services.network.get_rpc_urls(Naming.ENS.network)
+            if not urls:
+                return Result.err("no_rpc_urls")
+            rpc_url = self.core.services.balance.nodes.choose(urls)
+            proxy = self.core.services.proxy.pool.choose(rpc_url)
+            start_at = time.perf_counter()
+            with self.core.services.proxy.pool.use(proxy):
+                res = await evm.get_ens_names(rpc_url, accounts, self.core.settings.ens_reverse_records, proxy)
+            response_time = time.perf_counter() - start_at
+            self.core.services.balance.nodes.on_result(rpc_url, response_time, res)
+            self.core.services.proxy.pool.on_result(proxy, response_time, res)
+            if res.is_ok():
+                return res
+        return res
+
+    async def _save_name(self, account_names: list[AccountName], cached: CachedName) -> None:
+        checked_at = utc()
+        for an in account_names:
+            await self.core.db.group_name.update_one(
+                {"group": an.group, "naming": an.naming},
+                {"$set": {f"names.{an.account}": cached.name, f"checked_at.{an.account}": checked_at}},
+            )
+            updated = {"name": cached.name, "checked_at": checked_at, **lease.release_fields(cached.expires_at)}
+            await self.core.db.account_name.set(an.id, updated)
+            self.checking.discard(an.id)
+            metrics.name_checks.inc(an.naming.value, "ok")
+            if process.checks_naming(an.naming):
+                self.freshness.on_check(an.naming.value, an.id, checked_at)
+            self.push_due(an.naming.value, an.id, cached.expires_at)
+
+    async def _resolve_name(self, account_name: AccountName) -> Result[str | None]:
+        account = account_name.account
         match account_name.naming:
             case Naming.ENS:
                 urls = self.core.services.network.get_rpc_urls(account_name.network)
                 if not urls:
                     return Result.err("no_rpc_urls")
-                res = await evm.get_ens_name(urls, account_name.account, proxies=self.core.state.proxies)
+                # mm_eth retries over the proxies itself, so it gets only the healthy ones
+                res = await evm.get_ens_name(urls, account, proxies=self.core.services.proxy.pool.get_active())
             case Naming.ANS:
-                res = await aptos.get_ans_name(account_name.account, proxies=self.core.state.proxies)
+                res = await self._retry_with_proxy_pool(Naming.ANS, lambda proxy: aptos.get_ans_name(account, proxy))
             case Naming.STARKNET_ID:
-                res = await starknet.get_starknet_id(account_name.account, proxies=self.core.state.proxies)
+                res = await self._retry_with_proxy_pool(
+                    Naming.STARKNET_ID, lambda proxy: starknet.get_starknet_id(account, proxy)
+                )
             case _:
                 return Result.err("not_implemented")
 
         if res.is_err():
             # logger.debug("check_account_name: %s", res.err)
-            await self.core.db.naming_problem.insert_one(
-                NamingProblem(
-                    id=ObjectId(),
-                    network=account_name.network,
-                    naming=account_name.naming,
-                    account=account_name.account,
-                    message=res.unwrap_err(),
-                )
-            )
-            return res
+            self.add_problem(account_name.naming, account_name.network, account_name.account, res)
+        return res
 
-        name = res.unwrap() or ""
-        await self.core.db.group_name.update_one(
-            {"group": account_name.group, "naming": account_name.naming},
-            {"$set": {f"names.{account_name.account}": name, f"checked_at.{account_name.account}": utc()}},
+    async def _cache_name(self, naming: Naming, account: str, name: str) -> CachedName:
+        """Empty names are cached for check_empty_name_interval, real names for check_name_interval."""
+        resolved_at = utc()
+        expires_at = resolved_at + timedelta(minutes=self.get_check_interval(name))
+        entry = self.name_cache.put(naming, account, name, expires_at.timestamp())
+        await self.core.db.name_resolution.collection.update_one(
+            {"_id": f"{naming.value}__{account}"},
+            {
+                "$set": {
+                    "naming": naming.value,
+                    "account": account,
+                    "name": name,
+                    "resolved_at": resolved_at,
+                    "expires_at": expires_at,
+                }
+            },
+            upsert=True,
         )
-        await self.core.db.account_name.set(id, {"name": name, "checked_at": utc()})
+        return entry
 
+    async def _retry_with_proxy_pool(
+        self, naming: Naming, request: Callable[[str | None], Awaitable[Result[str | None]]], attempts: int = 5
+    ) -> Result[str | None]:
+        """Every attempt goes through another proxy of the pool, the pool learns from the outcomes."""
+        pool = self.core.services.proxy.pool
+        res: Result[str | None] = Result.err("not started yet")
+        proxy: str | None = None
+        for attempt in range(attempts):
+            if attempt > 0:
+                metrics.retries.inc("name", naming.value)
+            proxy = pool.choose(exclude=proxy)
+            start_at = time.perf_counter()
+            with pool.use(proxy):
+                res = await request(proxy)
+            pool.on_result(proxy, time.perf_counter() - start_at, res)
+            if res.is_ok():
+                return res
         return res
 
+    def add_problem(self, naming: Naming, network: Network, account: str, res: Result[Any]) -> None:
+        """Failures are aggregated by (naming, account, error) in memory and written in bulk by flush_problems."""
+        error = res.unwrap_err()[:200]
+        now = utc()
+        id = f"{naming.value}__{account}__{error}"
+        problem = self.problems.get(id)
+        if problem is None:
+            problem = NamingProblem(
+                id=id,
+                network=network,
+                naming=naming,
+                account=account,
+                error=error,
+                message="",
+                count=0,
+                first_seen=now,
+                last_seen=now,
+            )
+            self.problems[id] = problem
+        problem.count += 1
+        problem.last_seen = now
+        problem.message = json.dumps(res.to_dict(safe_exception=True), default=str)[:1000]
+
+    @async_mutex
+    async def flush_problems(self) -> int:
+        problems, self.problems = self.problems, {}
+        if not problems:
+            return 0
+        requests = [
+            UpdateOne(
+                {"_id": p.id},
+                {
+                    "$inc": {"count": p.count},
+                    "$set": {"message": p.message, "last_seen": p.last_seen},
+                    "$setOnInsert": {
+                        "network": p.network.value,
+                        "naming": p.naming.value,
+                        "account": p.account,
+                        "error": p.error,
+                        "first_seen": p.first_seen,
+                    },
+                },
+                upsert=True,
+            )
+            for p in problems.values()
+        ]
+        try:
+            await self.core.db.naming_problem.collection.bulk_write(requests, ordered=False)
+        except Exception as e:
+            logger.exception("Failed to flush naming problems, the unwritten ones are retried")
+            # an upsert which lost a race to insert the same problem fails with a duplicate key, it isn't written
+            errors = e.details.get("writeErrors", []) if isinstance(e, BulkWriteError) else None
+            failed = {error["index"] for error in errors} if errors is not None else set(range(len(requests)))
+            self._restore_problems([p for i, p in enumerate(problems.values()) if i in failed])
+            return len(requests) - len(failed)
+        return len(requests)
+
+    def _restore_problems(self, problems: list[NamingProblem]) -> None:
+        """Merge back the problems a flush failed to write. The ones added while it was writing are newer."""
+        for problem in problems:
+            newer = self.problems.get(problem.id)
+            if newer is not None:
+                problem.count += newer.count
+                problem.last_seen, problem.message = newer.last_seen, newer.message
+            self.problems[problem.id] = problem
+
+    async def calc_problem_summary(self, limit: int = 50) -> NamingProblemSummary:
+        top_accounts = await self.core.db.naming_problem.collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {"naming": "$naming", "account": "$account"},
+                        "count": {"$sum": "$count"},
+                        "errors": {"$addToSet": "$error"},
+                        "last_seen": {"$max": "$last_seen"},
+                    }
+                },
+                {"$sort": {"count": -1}},
+                {"$limit": limit},
+            ]
+        )
+        top_errors = await self.core.db.naming_problem.collection.aggregate(
+            [
+                {
+                    "$group": {
+                        "_id": {"naming": "$naming", "error": "$error"},
+                        "count": {"$sum": "$count"},
+                        "accounts": {"$sum": 1},
+                        "last_seen": {"$max": "$last_seen"},
+                    }
+                },
+                {"$sort": {"count": -1}},
+                {"$limit": limit},
+            ]
+        )
+        return NamingProblemSummary(
+            accounts=[
+                NamingProblemSummary.Account(**d["_id"], count=d["count"], errors=d["errors"], last_seen=d["last_seen"])
+                async for d in top_accounts
+            ],
+            errors=[
+                NamingProblemSummary.Error(**d["_id"], count=d["count"], accounts=d["accounts"], last_seen=d["last_seen"])
+                async for d in top_errors
+            ],
+        )
+
+    async def _retry_later(self, account_name: AccountName) -> None:
+        metrics.name_checks.inc(account_name.naming.value, "error")
+        due_at = time.time() + RETRY_FAILED_SECONDS
+        self.push_due(account_name.naming.value, account_name.id, due_at)
+        await self.core.db.account_name.set(account_name.id, lease.release_fields(due_at))
+        self.checking.discard(account_name.id)
+
     async def calc_oldest_checked_time(self) -> dict[Naming, datetime | None]:
+        cursor = await self.core.db.account_name.collection.aggregate([{"$group": check_stats_group("$naming")}])
+        stats = {d["_id"]: d async for d in cursor}
         res: dict[Naming, datetime | None] = {}
         for naming in list(Naming):
-            res[naming] = None
-            if not await self.core.db.account_name.exists({"naming": naming, "checked_at": None}):
-                name = await self.core.db.account_name.find_one({"naming": naming}, "checked_at")
-                if name:
-                    res[naming] = name.checked_at
+            d = stats.get(naming.value, {})
+            res[naming] = d.get("oldest_checked_time") if not d.get("never_checked_count") else None
         return res
@@ -4,15 +4,21 @@ from datetime import datetime
 from typing import override
 
 import pydash
-from mm_base6 import Service
+from mm_base6 import Service, UserError
 from mm_concurrency import async_mutex
-from mm_http import http_request
 from mm_std import utc
-from mm_web3 import Network
+from mm_web3 import Network, NetworkType
 from pydantic import BaseModel
 
-from app.core.db import RpcUrl
+from app.core.background_cache import REFRESH_SECONDS, BackgroundCache
+from app.core.constants import BalanceEngine
+from app.core.db import NetworkConfig, RpcUrl
+from app.core.http_pool import http_pool
+from app.core.process import ProcessRole, process
 from app.core.types import AppCore
+from app.core.utils import check_stats_group
+
+RELOAD_CONFIGS_SECONDS = 30  # how often a worker picks up configs edited in the web process
 
 
 class NetworkCheckStats(BaseModel):
@@ -28,24 +34,48 @@ class NetworkService(Service[AppCore]):
     def __init__(self) -> None:
         super().__init__()
         self.rpc_urls: dict[Network, list[str]] = {}
+        self.configs: dict[Network, NetworkConfig] = {}
+        self.check_stats = BackgroundCache(self.calc_network_check_stats)
 
     @override
     def configure_scheduler(self) -> None:
-        self.core.scheduler.add("mm-node-checker", 30, self.update_mm_node_checker)
+        if process.is_worker:
+            self.core.scheduler.add("mm-node-checker", 30, self.update_mm_node_checker)
+        if process.role == ProcessRole.WORKER:
+            # rpc urls, network configs and coins are edited in the web process
+            self.core.scheduler.add("reload-configs", RELOAD_CONFIGS_SECONDS, self.reload_configs_from_db)
+        self.core.scheduler.add("http-pool-evict-idle", 60, self.evict_idle_http_clients)
+        if process.is_web:
+            self.core.scheduler.add("refresh_network_check_stats", REFRESH_SECONDS, self.check_stats.refresh_if_read)
 
     @override
     async def on_start(self) -> None:
         await self.load_rpc_urls_from_db()
+        await self.load_network_configs_from_db()
+        http_pool.configure(self.core.settings.http_pool_limit_per_key, self.core.settings.http_pool_idle_seconds)
+
+    @override
+    async def on_stop(self) -> None:
+        await http_pool.close()
+
+    async def reload_configs_from_db(self) -> None:
+        await self.load_rpc_urls_from_db()
+        await self.load_network_configs_from_db()
+        await self.core.services.coin.load_coins_from_db()
+
+    async def evict_idle_http_clients(self) -> int:
+        http_pool.configure(self.core.settings.http_pool_limit_per_key, self.core.settings.http_pool_idle_seconds)
+        return await http_pool.evict_idle()
 
     @async_mutex
     async def update_mm_node_checker(self) -> dict[str, list[str]] | None:
         if not self.core.settings.mm_node_checker:
             return None
 
-        res = await http_request(self.core.settings.mm_node_checker)
-        json_body = res.json_body().unwrap_or(None)
+        res = await http_pool.request_json(self.core.settings.mm_node_checker)
+        json_body = res.unwrap_or(None)
 
-        if res.status_code == 200 and not res.is_err() and json_body:
+        if isinstance(json_body, dict) and json_body:
             for key in json_body:
                 if not isinstance(json_body[key], list):
                     return None
@@ -54,18 +84,15 @@ class NetworkService(Service[AppCore]):
             return json_body  # type:ignore[no-any-return]
 
     async def calc_network_check_stats(self) -> NetworkCheckStats:
+        cursor = await self.core.db.account_balance.collection.aggregate([{"$group": check_stats_group("$network")}])
+        stats = {d["_id"]: d async for d in cursor}
         result = NetworkCheckStats(networks={})
         for network in Network:
-            oldest_checked_time = None
-            never_checked_count = await self.core.db.account_balance.count({"network": network, "checked_at": None})
-            if never_checked_count == 0:
-                account_balance = await self.core.db.account_balance.find_one({"network": network}, "checked_at")
-                if account_balance:
-                    oldest_checked_time = account_balance.checked_at
+            d = stats.get(network.value, {})
             result.networks[network] = NetworkCheckStats.Stats(
-                oldest_checked_time=oldest_checked_time,
-                never_checked_count=never_checked_count,
-                all_count=await self.core.db.account_balance.count({"network": network}),
+                oldest_checked_time=d.get("oldest_checked_time") if not d.get("never_checked_count") else None,
+                never_checked_count=d.get("never_checked_count", 0),
+                all_count=d.get("all_count", 0),
             )
         return result
 
@@ -98,3 +125,39 @@ class NetworkService(Service[AppCore]):
         for rpc_url in await self.core.db.rpc_url.find({}, "id,urls"):
             self.rpc_urls[Network(rpc_url.id)] = rpc_url.urls
         return self.rpc_urls
+
+    def get_balance_engine(self, network: Network) -> BalanceEngine:
+        config = self.configs.get(network)
+        if config is not None:
+            return config.balance_engine
+        if network.network_type == NetworkType.EVM and self.core.settings.evm_batch_size > 1:
+            return BalanceEngine.BATCH
+        return BalanceEngine.RPC
+
+    @async_mutex
+    async def set_balance_engine(self, network: Network, engine: BalanceEngine) -> None:
+        if not engine.is_consistent(network.network_type):
+            raise UserError(f"Balance engine {engine.value} is not supported for {network.value}")
+        await self.update_network_config(network, {"balance_engine": engine.value})
+
+    def is_transfer_scan(self, network: Network) -> bool:
+        config = self.configs.get(network)
+        return config is not None and config.transfer_scan
+
+    @async_mutex
+    async def set_transfer_scan(self, network: Network, value: bool) -> None:
+        if network.network_type != NetworkType.EVM:
+            raise UserError(f"Transfer scan is not supported for {network.value}")
+        # a None block makes the scan start from the current head without marking every balance as due,
+        # balances changed before were checked by the polling
+        await self.update_network_config(network, {"transfer_scan": value, "transfer_scan_block": None})
+
+    async def update_network_config(self, network: Network, updated: dict[str, object]) -> None:
+        if not await self.core.db.network_config.exists({"_id": network.value}):
+            await self.core.db.network_config.insert_one(NetworkConfig(id=network.value))
+        await self.core.db.network_config.set(network.value, updated)
+        await self.load_network_configs_from_db()
+
+    async def load_network_configs_from_db(self) -> dict[Network, NetworkConfig]:
+        self.configs = {Network(c.id): c for c in await self.core.db.network_config.find({})}
+        return self.configs
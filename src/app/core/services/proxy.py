@@ -5,16 +5,38 @@ from mm_concurrency import async_mutex
 from mm_http import http_request
 from mm_std import utc
 
+from app.core.process import process
+from app.core.proxy_pool import ProxyPool
 from app.core.types import AppCore
 
 
 class ProxyService(Service[AppCore]):
+    def __init__(self) -> None:
+        super().__init__()
+        self.pool = ProxyPool()  # proxy -> health, concurrency and rate limits
+
     @override
     def configure_scheduler(self) -> None:
-        self.core.scheduler.add("update_proxies", 60, self.update)
+        if process.is_worker:
+            self.core.scheduler.add("update_proxies", 60, self.update)
+        else:  # a web-only process uses the proxies the workers have published, see BotService.sync_process_snapshots
+            self.core.scheduler.add("load_proxies", 60, self.load)
+
+    @override
+    async def on_start(self) -> None:
+        self.load()
+
+    def load(self) -> None:
+        self.configure_pool()
+        self.pool.update(self.core.state.proxies)
+
+    def configure_pool(self) -> None:
+        settings = self.core.settings
+        self.pool.configure(settings.proxy_max_concurrency, settings.proxy_rate_limit, settings.proxy_affinity)
 
     @async_mutex
     async def update(self) -> int:
+        self.configure_pool()  # settings can be changed at any time
         res = await http_request(self.core.settings.proxies_url)
         if res.is_err():
             await self.core.event("update_proxies", {"response": res.model_dump()})
@@ -23,4 +45,5 @@ class ProxyService(Service[AppCore]):
         proxies = [p.strip() for p in proxies if p.strip()]
         self.core.state.proxies = proxies
         self.core.state.proxies_updated_at = utc()
+        self.pool.update(proxies)
         return len(proxies)
@@ -0,0 +1,126 @@
+import logging
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import override
+
+from bson import ObjectId
+from mm_base6 import Service
+from mm_concurrency import async_mutex
+from mm_std import utc
+from mm_web3 import Network
+from pymongo.errors import BulkWriteError
+
+from app.core.balance_buffer import unwritten
+from app.core.db import RpcMonitoring, RpcMonitoringRollup
+from app.core.types import AppCore
+from app.core.utils import percentile
+
+logger = logging.getLogger(__name__)
+
+RECENT_EVENTS = 5000  # raw events kept in memory
+RECENT_FAILURES = 1000  # failed events kept in memory
+STORED_FAILURES_PER_BUCKET = 3  # failed events per rollup bucket saved to rpc_monitoring
+
+RollupKey = tuple[datetime, Network, str, str | None, str | None]  # minute, network, rpc_url, proxy, coin
+
+
+@dataclass
+class RollupBucket:
+    count: int = 0
+    success_count: int = 0
+    errors: Counter[str] = field(default_factory=Counter)
+    latencies: list[float] = field(default_factory=list)
+    stored_failures: int = 0
+
+    def merge(self, other: RollupBucket) -> None:
+        self.count += other.count
+        self.success_count += other.success_count
+        self.errors.update(other.errors)
+        self.latencies.extend(other.latencies)
+        self.stored_failures += other.stored_failures
+
+
+class RpcMonitoringService(Service[AppCore]):
+    """Aggregates rpc requests into per-minute rollups. Only a sample of failures is stored as raw documents."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.recent: deque[RpcMonitoring] = deque(maxlen=RECENT_EVENTS)
+        self.failures: deque[RpcMonitoring] = deque(maxlen=RECENT_FAILURES)
+        self.buckets: dict[RollupKey, RollupBucket] = {}
+
+    @override
+    def configure_scheduler(self) -> None:
+        self.core.scheduler.add("flush_rpc_monitoring_rollups", 10, self.flush)
+
+    @override
+    async def on_stop(self) -> None:
+        await self.flush(include_current_minute=True)
+
+    async def record(self, rpc_monitoring: RpcMonitoring) -> None:
+        self.recent.append(rpc_monitoring)
+        minute = rpc_monitoring.created_at.replace(second=0, microsecond=0)
+        key = (minute, rpc_monitoring.network, rpc_monitoring.rpc_url, rpc_monitoring.proxy, rpc_monitoring.coin)
+        bucket = self.buckets.setdefault(key, RollupBucket())
+        bucket.count += 1
+        bucket.latencies.append(rpc_monitoring.response_time)
+        if rpc_monitoring.success:
+            bucket.success_count += 1
+            return
+
+        # mongo keys can't contain dots
+        bucket.errors[(rpc_monitoring.error or "unknown").replace(".", "_").removeprefix("$")] += 1
+        self.failures.append(rpc_monitoring)
+        if bucket.stored_failures < STORED_FAILURES_PER_BUCKET:
+            bucket.stored_failures += 1
+            await self.core.services.balance_writer.add_rpc_monitoring(rpc_monitoring)
+
+    def get_recent(self, network: str | None = None, success: bool | None = None, limit: int = 1000) -> list[RpcMonitoring]:
+        events = self.failures if success is False else self.recent
+        result: list[RpcMonitoring] = []
+        for event in reversed(events):
+            if (network is None or event.network == network) and (success is None or event.success == success):
+                result.append(event)
+                if len(result) >= limit:
+                    break
+        return result
+
+    @async_mutex
+    async def flush(self, include_current_minute: bool = False) -> int:
+        """Write the rollups of the finished minutes. The buckets a flush failed to write go back, the next one retries."""
+        current_minute = utc().replace(second=0, microsecond=0)
+        keys = [key for key in self.buckets if include_current_minute or key[0] < current_minute]
+        buckets = {key: self.buckets.pop(key) for key in keys}
+        rollups: list[RpcMonitoringRollup] = []
+        for key, bucket in buckets.items():
+            minute, network, rpc_url, proxy, coin = key
+            latencies = sorted(bucket.latencies)
+            rollups.append(
+                RpcMonitoringRollup(
+                    id=ObjectId(),
+                    minute=minute,
+                    network=network,
+                    rpc_url=rpc_url,
+                    proxy=proxy,
+                    coin=coin,
+                    count=bucket.count,
+                    success_count=bucket.success_count,
+                    errors=dict(bucket.errors),
+                    latency_p50=percentile(latencies, 50),
+                    latency_p90=percentile(latencies, 90),
+                    latency_p99=percentile(latencies, 99),
+                    latency_max=latencies[-1] if latencies else 0.0,
+                )
+            )
+        if not rollups:
+            return 0
+        try:
+            await self.core.db.rpc_monitoring_rollup.insert_many(rollups)
+        except Exception as e:
+            logger.exception("Failed to flush rpc monitoring rollups, the unwritten ones are retried")
+            failed = unwritten(e, len(keys), ordered=True) if isinstance(e, BulkWriteError) else set(range(len(keys)))
+            for i in sorted(failed):
+                self.buckets.setdefault(keys[i], RollupBucket()).merge(buckets[keys[i]])
+            return len(rollups) - len(failed)
+        return len(rollups)
@@ -0,0 +1,104 @@
+import logging
+import time
+from typing import override
+
+from mm_base6 import Service
+from mm_concurrency import async_mutex_by
+from mm_result import Result
+from mm_web3 import Network, NetworkType
+
+from app.core.blockchains import evm
+from app.core.process import process
+from app.core.types import AppCore
+
+logger = logging.getLogger(__name__)
+
+SCAN_INTERVAL_SECONDS = 10
+REORG_BLOCKS = 5  # already scanned blocks to scan again, a reorg could have replaced them
+MAX_LAG_BLOCKS = 100_000  # if the scan is further behind, check every token balance of the network instead
+
+
+class TransferScanService(Service[AppCore]):
+    """Marks EVM token balances as due when their accounts appear in Transfer logs.
+    Balances of networks with transfer scan enabled are polled only as a slow sweep (transfer_scan_sweep_interval)."""
+
+    @override
+    def configure_scheduler(self) -> None:
+        for network in Network:
+            if network.network_type == NetworkType.EVM and process.checks_network(network):
+                task_id = "transfer_scan_on_" + network.value
+                self.core.scheduler.add(task_id, SCAN_INTERVAL_SECONDS, self.scan_network, args=(network,))
+
+    @async_mutex_by(param="network")
+    async def scan_network(self, network: Network) -> Result[int]:
+        """Scan the next block range of the network. Returns how many account balances were marked as due."""
+        if not self.core.state.check_balances or not self.core.services.network.is_transfer_scan(network):
+            return Result.ok(0)
+        coins = {c.token.lower(): c.id for c in self.core.services.coin.get_coins() if c.network == network and c.token}
+        if not coins:
+            return Result.ok(0)
+        urls = self.core.services.network.get_rpc_urls(network)
+        if not urls:
+            return Result.err(f"rpc url not found for {network}")
+
+        nodes = self.core.services.balance.nodes
+        rpc_url = nodes.choose(urls)
+        proxies = self.core.services.proxy.pool
+        proxy = proxies.choose(rpc_url)
+        start_at = time.perf_counter()
+        with proxies.use(proxy):
+            res = await evm.get_block_number(rpc_url, proxy)
+        response_time = time.perf_counter() - start_at
+        nodes.on_result(rpc_url, response_time, res)
+        proxies.on_result(proxy, response_time, res)
+        if res.is_err():
+            return res
+        latest_block = res.unwrap()
+
+        last_block = self.core.services.network.configs[network].transfer_scan_block
+        if last_block is None:  # just enabled, start from the current head, see NetworkService.set_transfer_scan
+            await self.save_scanned_block(network, latest_block)
+            return Result.ok(0)
+        if latest_block - last_block > MAX_LAG_BLOCKS:
+            # the sweep would take too long to catch up, the skipped blocks may have changed any balance
+            marked = await self.mark_due(network, {"coin": {"$in": list(coins.values())}})
+            await self.save_scanned_block(network, latest_block)
+            return Result.ok(marked)
+
+        from_block = max(last_block - REORG_BLOCKS, 0) + 1
+        to_block = min(latest_block, last_block + self.core.settings.transfer_scan_max_blocks)
+        if to_block <= last_block:
+            return Result.ok(0)
+
+        start_at = time.perf_counter()
+        with proxies.use(proxy):
+            transfers_res = await evm.get_transfer_accounts(rpc_url, list(coins), from_block, to_block, proxy)
+        response_time = time.perf_counter() - start_at
+        nodes.on_result(rpc_url, response_time, transfers_res)
+        proxies.on_result(proxy, response_time, transfers_res)
+        if transfers_res.is_err():
+            logger.warning("transfer scan failed", extra={"network": network, "error": transfers_res.unwrap_err()})
+            return transfers_res  # type:ignore[return-value]
+
+        accounts_by_coin: dict[str, list[str]] = {}
+        for token, account in transfers_res.unwrap():
+            accounts_by_coin.setdefault(coins[token], []).append(account)
+        marked = 0
+        for coin_id, accounts in accounts_by_coin.items():
+            marked += await self.mark_due(network, {"coin": coin_id, "account": {"$in": accounts}})
+        await self.save_scanned_block(network, to_block)
+        return Result.ok(marked)
+
+    async def mark_due(self, network: Network, query: dict[str, object]) -> int:
+        ids = [doc["_id"] async for doc in self.core.db.account_balance.collection.find(query, {"_id": True})]
+        if not ids:
+            return 0
+        # due now for any worker, a lease of a worker checking them is kept
+        await self.core.db.account_balance.update_many({"_id": {"$in": ids}}, {"$set": {"due_at": None}})
+        for id in ids:
+            self.core.services.balance.push_due(network.value, id, 0.0)
+        return len(ids)
+
+    async def save_scanned_block(self, network: Network, block: int) -> None:
+        await self.core.db.network_config.set(network.value, {"transfer_scan_block": block})
+        self.core.services.network.configs[network].transfer_scan_block = block
@@ -1,3 +1,5 @@
+import math
+
 import pydash
 import tomlkit
 from eth_utils import address as ethereum_account
@@ -21,3 +23,19 @@ def find_invalid_address(network_type: NetworkType, addresses: list[str]) -> str
 
 def toml_loads(string: str | bytes) -> tomlkit.TOMLDocument:
     return tomlkit.loads(string)
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def check_stats_group(key: str) -> dict[str, object]:
+    """$group stage of the check stats: all_count, never_checked_count and oldest_checked_time by key."""
+    return {
+        "_id": key,
+        "all_count": {"$sum": 1},
+        "never_checked_count": {"$sum": {"$cond": [{"$gt": ["$checked_at", None]}, 0, 1]}},
+        "oldest_checked_time": {"$min": "$checked_at"},  # nulls are ignored
+    }
@@ -4,11 +4,18 @@ from mm_base6 import Core, run
 
 from app import config
 from app.core.db import Db
+from app.core.metrics import register_mongo_listener
+from app.core.process import ProcessRole, process
 from app.core.services import ServiceRegistry
 from app.server.jinja import JinjaConfig
 
 
 async def main() -> None:
+    process.configure_from_env()
+    if process.role == ProcessRole.WORKER:
+        raise SystemExit("APP_ROLE=worker runs with python -m app.worker")
+
+    register_mongo_listener()
     core = await Core.init(
         config=config.config,
         settings_cls=config.Settings,
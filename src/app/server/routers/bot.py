@@ -1,6 +1,7 @@
 from fastapi import APIRouter
 from mm_base6 import cbv
 
+from app.core.services.bot import FreshnessStats
 from app.core.types import AppView
 
 router = APIRouter(prefix="/api/bot", tags=["bot"])
@@ -15,3 +16,7 @@ class CBV(AppView):
     @router.post("/toggle-check-namings")
     async def toggle_check_namings(self) -> None:
         self.core.services.bot.toggle_check_namings()
+
+    @router.get("/freshness")
+    async def get_freshness(self) -> FreshnessStats:
+        return self.core.services.bot.get_freshness_stats()
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from mm_base6 import cbv
+from starlette.responses import PlainTextResponse
+
+from app.core.types import AppView
+
+router = APIRouter(tags=["metrics"])
+
+
+@cbv(router)
+class CBV(AppView):
+    @router.get("/metrics", response_class=PlainTextResponse)
+    async def get_metrics(self) -> str:
+        """Prometheus text format, the check pipeline of this process."""
+        return self.core.services.bot.render_metrics()
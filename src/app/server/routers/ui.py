@@ -1,4 +1,5 @@
 import logging
+import time
 from typing import Annotated
 
 from bson import ObjectId
@@ -9,7 +10,10 @@ from mm_web3 import Network, NetworkType
 from pydantic import BaseModel, Field
 from starlette.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 
-from app.core.constants import Naming
+from app.core.constants import BalanceEngine, Naming
+from app.core.freshness import STALENESS_LABELS
+from app.core.http_pool import http_pool
+from app.core.services.group import GroupAccountsQuery
 from app.core.types import AppView
 from app.server import utils
 
@@ -34,6 +38,11 @@ class CBV(AppView):
     async def index(self) -> HTMLResponse:
         return await self.render.html("index.j2")
 
+    @router.get("/bot/freshness")
+    async def freshness(self) -> HTMLResponse:
+        stats = self.core.services.bot.get_freshness_stats()
+        return await self.render.html("freshness.j2", stats=stats, labels=STALENESS_LABELS)
+
     @router.get("/bot")
     async def bot(self) -> HTMLResponse:
         return await self.render.html("bot.j2")
@@ -41,18 +50,35 @@ class CBV(AppView):
     @router.get("/networks")
     async def networks(self) -> HTMLResponse:
         mm_node_checker = self.core.state.mm_node_checker or {}
+        network = self.core.services.network
+        engines = {n: network.get_balance_engine(n) for n in Network}
         return await self.render.html(
-            "networks.j2", mm_node_checker=mm_node_checker, rpc_urls=self.core.services.network.rpc_urls
+            "networks.j2",
+            mm_node_checker=mm_node_checker,
+            rpc_urls=network.rpc_urls,
+            engines=engines,
+            balance_engines=list(BalanceEngine),
+            configs=network.configs,
+            transfer_scan={n: network.is_transfer_scan(n) for n in Network if n.network_type == NetworkType.EVM},
+            concurrency=self.core.services.balance.concurrency.limiters,
         )
 
+    @router.get("/networks/http-pool")
+    async def http_pool_page(self) -> HTMLResponse:
+        return await self.render.html("http_pool.j2", stats=http_pool.get_stats(), evicted=http_pool.evicted, now_ts=time.time())
+
+    @router.get("/networks/proxies")
+    async def proxies_page(self) -> HTMLResponse:
+        return await self.render.html("proxies.j2", proxies=self.core.services.proxy.pool.proxies)
+
     @router.get("/networks/check-stats")
     async def networks_check_stats(self) -> HTMLResponse:
-        stats = await self.core.services.network.calc_network_check_stats()
+        stats = await self.core.services.network.check_stats.get()
         return await self.render.html("networks_check_stats.j2", stats=stats)
 
     @router.get("/namings")
     async def namings(self) -> HTMLResponse:
-        oldest_checked_time = await self.core.services.name.calc_oldest_checked_time()
+        oldest_checked_time = await self.core.services.name.oldest_checked_time.get()
         return await self.render.html("namings.j2", namings=list(Naming), oldest_checked_time=oldest_checked_time)
 
     @router.get("/coins")
@@ -64,18 +90,21 @@ class CBV(AppView):
 
     @router.get("/coins/check-stats")
     async def coins_check_stats(self) -> HTMLResponse:
-        stats = await self.core.services.coin.calc_coin_check_stats()
+        stats = await self.core.services.coin.check_stats.get()
         return await self.render.html("coins_check_stats.j2", stats=stats)
 
     @router.get("/groups")
     async def groups(self, network_type: Annotated[NetworkType | None, Query()] = None) -> HTMLResponse:
         query = {"network_type": network_type} if network_type else {}
         groups = await self.core.db.group.find(query, "name")
+        summaries = await self.core.services.group.get_summaries([g.id for g in groups])
         coins = self.core.services.coin.get_coins()
         coins_by_network_type = self.core.services.coin.get_coins_by_network_type()
         return await self.render.html(
             "groups.j2",
             groups=groups,
+            summaries=summaries,
+            coins_map=self.core.services.coin.get_coins_map(),
             coins=coins,
             network_types=list(NetworkType),
             namings=list(Naming),
@@ -84,9 +113,9 @@ class CBV(AppView):
         )
 
     @router.get("/groups/{group_id}")
-    async def group(self, group_id: ObjectId) -> HTMLResponse:
+    async def group(self, group_id: ObjectId, query: Annotated[GroupAccountsQuery, Query()]) -> HTMLResponse:
         group = await self.core.db.group.get(group_id)
-        info = await self.core.services.group.get_group_accounts_info(group_id)
+        info = await self.core.services.group.get_group_accounts_info(group, query)
         coins_by_network_type = self.core.services.coin.get_coins_by_network_type()
         namings = list(Naming)
         return await self.render.html(
@@ -129,8 +158,9 @@ class CBV(AppView):
 
     @router.get("/naming-problems")
     async def naming_problems_page(self) -> HTMLResponse:
-        problems = await self.core.db.naming_problem.find({}, "-created_at", 1000)
-        return await self.render.html("naming_problems.j2", problems=problems)
+        problems = await self.core.db.naming_problem.find({}, "-last_seen", 1000)
+        summary = await self.core.services.name.calc_problem_summary()
+        return await self.render.html("naming_problems.j2", problems=problems, summary=summary)
 
     @router.get("/rpc-monitoring")
     async def rpc_monitoring_page(
@@ -143,10 +173,13 @@ class CBV(AppView):
         query: dict[str, object] = {}
         if network:
             query["network"] = network
-        if success is not None:
-            query["success"] = success
-        monitoring = await self.core.db.rpc_monitoring.find(query, "-created_at", limit)
-        return await self.render.html("rpc_monitoring.j2", monitoring=monitoring, form=form)
+        rollups = await self.core.db.rpc_monitoring_rollup.find(query, "-minute", limit)
+        monitoring = self.core.services.rpc_monitoring.get_recent(network, success, limit)
+        nodes = self.core.services.balance.nodes.nodes
+        hedging = self.core.services.balance.hedging
+        return await self.render.html(
+            "rpc_monitoring.j2", monitoring=monitoring, rollups=rollups, form=form, nodes=nodes, hedging=hedging
+        )
 
     @router.get("/history")
     async def history_page(self) -> HTMLResponse:
@@ -175,6 +208,18 @@ class ActionCBV(AppView):
         self.render.flash("rpc url added successfully")
         return redirect("/networks")
 
+    @router.post("/networks/{network}/balance-engine")
+    async def set_balance_engine(self, network: Network, value: Annotated[BalanceEngine, Form()]) -> RedirectResponse:
+        await self.core.services.network.set_balance_engine(network, value)
+        self.render.flash("balance engine updated successfully")
+        return redirect("/networks")
+
+    @router.post("/networks/{network}/transfer-scan")
+    async def set_transfer_scan(self, network: Network, value: Annotated[bool, Form()]) -> RedirectResponse:
+        await self.core.services.network.set_transfer_scan(network, value)
+        self.render.flash("transfer scan updated successfully")
+        return redirect("/networks")
+
     @router.get("/coins/export", response_class=PlainTextResponse)
     async def export_coins(self) -> str:
         return self.core.services.coin.export_as_toml()
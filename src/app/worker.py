@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import contextlib
+import os
+import signal
+
+from mm_base6 import Core
+from mm_web3 import Network
+
+from app import config
+from app.core.constants import Naming
+from app.core.db import Db
+from app.core.metrics import register_mongo_listener
+from app.core.process import ProcessRole, parse_list, process
+from app.core.services import ServiceRegistry
+from app.core.types import AppCore
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the scheduled checks without the web server.")
+    parser.add_argument("--networks", default="", help="comma separated networks to check balances of, default: all")
+    parser.add_argument("--namings", default="", help="comma separated namings to check names of, default: all")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=int(os.getenv("APP_METRICS_PORT") or 0),
+        help="serve Prometheus metrics on this port, default: off",
+    )
+    return parser.parse_args()
+
+
+async def serve_metrics(core: AppCore, port: int) -> asyncio.Server:
+    """The worker has no web server, every request to this port gets the metrics of the worker."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        with contextlib.suppress(ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            await reader.readuntil(b"\r\n\r\n")
+            body = core.services.bot.render_metrics().encode()
+            header = f"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\n"
+            writer.write(header.encode() + b"Connection: close\r\n\r\n" + body)
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "0.0.0.0", port)  # noqa: S104 # nosec
+
+
+async def main() -> None:
+    args = parse_args()
+    process.configure_from_env()
+    networks = {Network(n) for n in parse_list(args.networks)} or process.networks
+    namings = {Naming(n) for n in parse_list(args.namings)} or process.namings
+    process.configure(ProcessRole.WORKER, networks, namings)
+
+    register_mongo_listener()
+    core: AppCore = await Core.init(
+        config=config.config,
+        settings_cls=config.Settings,
+        state_cls=config.State,
+        db_cls=Db,
+        service_registry_cls=ServiceRegistry,
+    )
+    await core.startup()
+    metrics_server = await serve_metrics(core, args.metrics_port) if args.metrics_port else None
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+        await core.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from mm_result import Result
+
+from app.core.aimd import DECREASE_FACTOR, AimdController, AimdLimiter
+
+RPC_URL = "https://node.example"
+RATE_LIMITED = Result.err("rpc_error", context={"error": {"code": -32005, "message": "limit exceeded"}})
+
+
+def test_additive_increase():
+    limiter = AimdLimiter(limit=4, max_limit=5)
+    for _ in range(4):
+        limiter.on_result(time.perf_counter(), 0.1, success=True, overloaded=False, latency_target=1.0)
+    assert 4.9 < limiter.limit < 5  # about +1 per limit of successful requests
+
+    for _ in range(10):
+        limiter.on_result(time.perf_counter(), 0.1, success=True, overloaded=False, latency_target=1.0)
+    assert limiter.limit == 5  # max_limit
+
+
+def test_slow_responses_dont_increase():
+    limiter = AimdLimiter(limit=4, max_limit=10)
+    limiter.on_result(time.perf_counter(), 2.0, success=True, overloaded=False, latency_target=1.0)
+    assert limiter.limit == 4
+
+
+def test_multiplicative_decrease_once_per_window():
+    limiter = AimdLimiter(limit=10, max_limit=10)
+    started_at = time.perf_counter()
+    limiter.on_result(started_at, 0.1, success=False, overloaded=True, latency_target=1.0)
+    assert limiter.limit == 10 * DECREASE_FACTOR
+    # started before the decrease, it was sent with the old limit
+    limiter.on_result(started_at, 0.1, success=False, overloaded=True, latency_target=1.0)
+    assert limiter.limit == 10 * DECREASE_FACTOR
+
+
+def test_controller_classifies_overload():
+    controller = AimdController()
+    controller.configure(initial_limit=8, max_limit=8, latency_target=1.0)
+
+    controller.on_result(RPC_URL, time.perf_counter(), 0.1, Result.err("invalid_response"))
+    assert controller.get(RPC_URL).limit == 8
+    controller.on_result(RPC_URL, time.perf_counter(), 0.1, RATE_LIMITED)
+    assert controller.get(RPC_URL).limit == 4
+    assert controller.total_limit([RPC_URL, "https://other.example"]) == 4 + 8
+
+
+def test_slot_waits_for_limit():
+    limiter = AimdLimiter(limit=1, max_limit=1)
+    order: list[str] = []
+
+    async def request(name: str) -> None:
+        async with limiter.slot():
+            order.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} end")
+
+    async def run() -> None:
+        await asyncio.gather(request("a"), request("b"))
+
+    asyncio.run(run())
+    assert order == ["a start", "a end", "b start", "b end"]
+    assert limiter.in_flight == 0
@@ -0,0 +1,131 @@
+import asyncio
+from datetime import UTC, datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from app.core.balance_buffer import DUPLICATE_KEY_ERROR, BalanceBuffer, bulk_update, summary_correction, unwritten
+
+ID1, ID2, ID3 = ObjectId(), ObjectId(), ObjectId()
+COIN = "eth__eth"
+NOW = datetime.now(UTC)
+EARLIER = NOW - timedelta(minutes=1)
+
+
+class FailingCollection:
+    """bulk_write applies nothing for the failed indexes and raises BulkWriteError."""
+
+    def __init__(self, failed: list[int]) -> None:
+        self.failed = failed
+        self.requests: list[UpdateOne] = []
+        self.ordered: bool | None = None
+
+    async def bulk_write(self, requests: list[UpdateOne], ordered: bool) -> None:
+        self.requests = requests
+        self.ordered = ordered
+        if self.failed:
+            raise BulkWriteError({"writeErrors": [{"index": i, "code": 1} for i in self.failed]})
+
+
+def test_restore_keeps_newer_updates():
+    buffer = BalanceBuffer()
+    buffer.account_balances[ID1] = {"balance": 1, "checked_at": 1}
+    buffer.account_balances[ID2] = {"balance": 2}
+    taken = buffer.take()
+    assert buffer.pending_count() == 0
+
+    buffer.account_balances[ID1] = {"balance": 10}  # checked again while the flush was failing
+    buffer.restore(taken)
+
+    assert buffer.account_balances == {ID1: {"balance": 10, "checked_at": 1}, ID2: {"balance": 2}}
+
+
+def test_bulk_update_keeps_only_unwritten():
+    updates = {ID1: {"balance": 1}, ID2: {"balance": 2}, ID3: {"balance": 3}}
+    collection = FailingCollection(failed=[1])
+
+    with pytest.raises(BulkWriteError):
+        asyncio.run(bulk_update(collection, updates, lambda id, update: UpdateOne({"_id": id}, {"$set": update})))
+
+    assert len(collection.requests) == 3
+    assert collection.ordered is False
+    assert updates == {ID2: {"balance": 2}}
+
+
+def test_bulk_update_clears_written():
+    updates = {ID1: {"balance": 1}}
+    asyncio.run(bulk_update(FailingCollection(failed=[]), updates, lambda id, update: UpdateOne({"_id": id}, {"$set": update})))
+    assert updates == {}
+
+
+def test_unwritten():
+    error = BulkWriteError({"writeErrors": [{"index": 1, "code": DUPLICATE_KEY_ERROR}, {"index": 3, "code": 1}]})
+    assert unwritten(error, 5, ordered=False) == {3}
+    # an ordered write stops at the first error, a duplicate key was written before
+    assert unwritten(error, 5, ordered=True) == {2, 3, 4}
+
+
+def test_summary_delta_of_first_check():
+    buffer = BalanceBuffer()
+    buffer.add_summary_delta(ID1, COIN, Decimal(5), None, NOW)
+    buffer.add_summary_delta(ID1, COIN, Decimal(0), None, NOW)  # a zero balance is checked, but not non-zero
+
+    assert buffer.group_summaries[ID1] == {
+        "$inc": {"coins.eth__eth.total": 5, "coins.eth__eth.non_zero": 1, "coins.eth__eth.checked": 2, "version": 2},
+        "$max": {"coins.eth__eth.checked_at": NOW},
+    }
+
+
+def test_summary_delta_of_changed_balance():
+    buffer = BalanceBuffer()
+    buffer.add_summary_delta(ID1, COIN, Decimal(3), Decimal(0), NOW)  # became non-zero
+    buffer.add_summary_delta(ID2, COIN, Decimal(0), Decimal(2), NOW)  # became zero
+    buffer.add_summary_delta(ID3, COIN, Decimal(7), Decimal(4), NOW)  # stays non-zero
+
+    assert buffer.group_summaries[ID1]["$inc"] == {"coins.eth__eth.total": 3, "coins.eth__eth.non_zero": 1, "version": 1}
+    assert buffer.group_summaries[ID2]["$inc"] == {"coins.eth__eth.total": -2, "coins.eth__eth.non_zero": -1, "version": 1}
+    assert buffer.group_summaries[ID3]["$inc"] == {"coins.eth__eth.total": 3, "version": 1}
+    assert buffer.group_summaries[ID3]["$max"] == {"coins.eth__eth.checked_at": NOW, "coins.eth__eth.changed_at": NOW}
+
+
+def test_summary_delta_of_unchanged_balance():
+    buffer = BalanceBuffer()
+    buffer.add_summary_delta(ID1, COIN, Decimal(3), Decimal(3), NOW)
+
+    assert buffer.group_summaries[ID1] == {"$inc": {"version": 1}, "$max": {"coins.eth__eth.checked_at": NOW}}
+
+
+def test_restore_sums_summary_deltas():
+    buffer = BalanceBuffer()
+    buffer.add_summary_delta(ID1, COIN, Decimal(5), Decimal(2), NOW)
+    taken = buffer.take()
+    assert buffer.group_summaries == {}
+
+    buffer.add_summary_delta(ID1, COIN, Decimal(1), Decimal(0), EARLIER)  # written while the flush was failing
+    buffer.restore(taken)
+
+    assert buffer.group_summaries[ID1] == {
+        "$inc": {"coins.eth__eth.total": 4, "coins.eth__eth.non_zero": 1, "version": 2},
+        "$max": {"coins.eth__eth.checked_at": NOW, "coins.eth__eth.changed_at": NOW},
+    }
+
+
+def test_summary_correction():
+    summary = {
+        COIN: {"total": Decimal(7), "non_zero": 2, "checked": 3, "checked_at": NOW, "changed_at": EARLIER},
+        "removed": {"total": Decimal(1), "non_zero": 1, "checked": 1, "checked_at": NOW, "changed_at": NOW},
+    }
+    calculated = {
+        COIN: {"total": Decimal(5), "non_zero": 2, "checked": 3, "checked_at": NOW, "changed_at": NOW},
+        "added": {"total": Decimal(0), "non_zero": 0, "checked": 1, "checked_at": NOW, "changed_at": None},
+    }
+
+    assert summary_correction(summary, calculated) == {
+        "$inc": {"coins.eth__eth.total": Decimal(-2), "coins.added.checked": 1},
+        "$set": {"coins.eth__eth.changed_at": NOW, "coins.added.checked_at": NOW},
+        "$unset": {"coins.removed": ""},
+    }
+    assert summary_correction(calculated, calculated) == {}
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from bson import ObjectId
+
+from app.core.due_queue import DueQueue
+
+KEY = "eth"
+ID1, ID2, ID3 = ObjectId(), ObjectId(), ObjectId()
+
+
+def test_pop_due_in_due_order():
+    queue = DueQueue()
+    now = time.time()
+    queue.push(KEY, ID1, now - 1)
+    queue.push(KEY, ID2, now - 3)
+    queue.push(KEY, ID3, now + 60)
+    queue.push("sol", ObjectId(), now - 10)
+
+    assert queue.pop_due(KEY, 10) == [ID2, ID1]
+    assert queue.pop_due(KEY, 10) == []  # popped items are not in the queue anymore
+    assert queue.next_due_at(KEY) == now + 60
+
+
+def test_pop_due_limit():
+    queue = DueQueue()
+    now = time.time()
+    queue.push(KEY, ID1, now - 2)
+    queue.push(KEY, ID2, now - 1)
+
+    assert queue.pop_due(KEY, 1) == [ID1]
+    assert queue.pop_due(KEY, 1) == [ID2]
+
+
+def test_rescheduled_and_discarded_are_skipped():
+    queue = DueQueue()
+    now = time.time()
+    queue.push(KEY, ID1, now - 2)
+    queue.push(KEY, ID1, now + 60)  # rescheduled, the old entry stays in the heap
+    queue.push(KEY, ID2, now - 1)
+    queue.discard(ID2)
+
+    assert queue.count(KEY) == 3  # stale entries are counted
+    assert queue.pop_due(KEY, 10) == []
+    assert queue.next_due_at(KEY) == now + 60
+
+
+def test_wait_wakes_up_on_push():
+    queue = DueQueue()
+
+    async def run() -> float:
+        start = time.perf_counter()
+        waiting = asyncio.create_task(queue.wait(KEY, timeout=10))
+        await asyncio.sleep(0.01)
+        queue.push(KEY, ID1, time.time())
+        await waiting
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 1
+
+
+def test_wait_returns_if_due():
+    queue = DueQueue()
+    queue.push(KEY, ID1, time.time() - 1)
+
+    async def run() -> float:
+        start = time.perf_counter()
+        await queue.wait(KEY, timeout=10)
+        return time.perf_counter() - start
+
+    assert asyncio.run(run()) < 1
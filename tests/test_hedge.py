@@ -0,0 +1,39 @@
+from app.core.hedge import MAX_TOKENS, MIN_SAMPLES, HedgeController
+
+NETWORK = "eth"
+
+
+def test_no_delay_until_enabled_and_sampled():
+    controller = HedgeController()
+    for i in range(MIN_SAMPLES):
+        controller.on_latency(NETWORK, i / 100)
+    assert controller.get_delay(NETWORK) is None  # percentile=0 means disabled
+
+    controller.configure(percentile=90, max_percent=10)
+    assert controller.get_delay("sol") is None  # not enough samples
+    assert controller.get_delay(NETWORK) == 0.17
+
+
+def test_hedges_are_limited_by_budget():
+    controller = HedgeController()
+    controller.configure(percentile=90, max_percent=25)
+    hedging = controller.get(NETWORK)
+    hedging.tokens = 0
+
+    sent = 0
+    for _ in range(100):
+        controller.on_request(NETWORK)
+        sent += controller.try_hedge(NETWORK)
+
+    assert sent == 25  # a token per 4 requests
+    assert hedging.requests == 100
+    assert hedging.hedges == 25
+
+
+def test_burst_is_capped():
+    controller = HedgeController()
+    controller.configure(percentile=90, max_percent=50)
+    for _ in range(1000):
+        controller.on_request(NETWORK)
+
+    assert controller.get(NETWORK).tokens == MAX_TOKENS
@@ -0,0 +1,28 @@
+import asyncio
+
+from app.core.http_pool import HttpClientPool
+
+
+def test_request_json_in_new_event_loop(httpserver):
+    httpserver.expect_request("/").respond_with_json({"ok": True})
+    pool = HttpClientPool()
+
+    # every asyncio.run has its own loop, the session of the first one must not be reused by the second
+    assert asyncio.run(pool.request_json(httpserver.url_for("/"))).unwrap() == {"ok": True}
+    assert asyncio.run(pool.request_json(httpserver.url_for("/"))).unwrap() == {"ok": True}
+
+    assert len(pool.clients) == 1
+    assert pool.evicted.requests == 1
+
+
+def test_close():
+    pool = HttpClientPool()
+
+    async def run() -> None:
+        client = pool.get_client("http://localhost:1/path", None)
+        assert pool.get_client("http://localhost:1/other", None) is client
+        await pool.close()
+        assert client.session.closed
+
+    asyncio.run(run())
+    assert pool.clients == {}
@@ -0,0 +1,111 @@
+import asyncio
+import time
+from datetime import UTC, datetime, timedelta
+from typing import Any, Self
+
+from bson import ObjectId
+
+from app.core import lease
+
+NOW = datetime.now(UTC)
+PAST = NOW - timedelta(minutes=1)
+FUTURE = NOW + timedelta(hours=1)
+
+
+def _match(doc: dict[str, Any], query: dict[str, Any]) -> bool:
+    """The subset of the MongoDB query language lease uses."""
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(_match(doc, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(_match(doc, q) for q in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(key)
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$lte" and (value is None or value > operand):
+                    return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class Cursor:
+    def __init__(self, docs: list[dict[str, Any]]) -> None:
+        self.docs = docs
+
+    def __aiter__(self) -> Self:
+        return self
+
+    async def __anext__(self) -> dict[str, Any]:
+        if not self.docs:
+            raise StopAsyncIteration
+        return self.docs.pop(0)
+
+
+class Collection:
+    def __init__(self, docs: list[dict[str, Any]]) -> None:
+        self.docs = {doc["_id"]: doc for doc in docs}
+
+    async def update_many(self, query: dict[str, Any], update: dict[str, Any]) -> None:
+        for doc in self.docs.values():
+            if _match(doc, query):
+                doc.update(update["$set"])
+
+    def find(self, query: dict[str, Any], projection: dict[str, bool]) -> Cursor:
+        fields = {"_id", *projection}
+        docs = [{k: v for k, v in doc.items() if k in fields} for doc in self.docs.values() if _match(doc, query)]
+        return Cursor(docs)
+
+
+def test_claim_only_due():
+    due, later, leased, expired = ObjectId(), ObjectId(), ObjectId(), ObjectId()
+    collection = Collection(
+        [
+            {"_id": due, "due_at": PAST},
+            {"_id": later, "due_at": FUTURE},
+            {"_id": leased, "lease_owner": "other", "lease_until": FUTURE, "due_at": PAST},
+            {"_id": expired, "lease_owner": "crashed", "lease_until": PAST},
+        ]
+    )
+
+    claimed, others = asyncio.run(lease.claim(collection, [due, later, leased, expired]))
+
+    assert claimed == {due, expired}
+    assert others == {later: FUTURE, leased: FUTURE}
+    assert collection.docs[due]["lease_owner"] == lease.OWNER_ID
+    assert collection.docs[leased]["lease_owner"] == "other"
+
+
+def test_claim_not_due_siblings():
+    """Account balances of other groups with the same (coin, account) are claimed with a due one even if they are due later,
+    but not from another worker which is checking them."""
+    sibling, leased = ObjectId(), ObjectId()
+    collection = Collection(
+        [
+            {"_id": sibling, **lease.release_fields(FUTURE.timestamp())},
+            {"_id": leased, "lease_owner": "other", "lease_until": FUTURE},
+        ]
+    )
+
+    assert asyncio.run(lease.claim(collection, [sibling]))[0] == set()
+    claimed, others = asyncio.run(lease.claim(collection, [sibling, leased], only_due=False))
+
+    assert claimed == {sibling}
+    assert others == {leased: FUTURE}
+
+
+def test_release_keeps_due_time():
+    id = ObjectId()
+    collection = Collection([{"_id": id}])
+    assert asyncio.run(lease.claim(collection, [id]))[0] == {id}
+
+    due_at = float(int(time.time()) + 60)
+    collection.docs[id].update(lease.release_fields(due_at))
+
+    assert collection.docs[id]["lease_owner"] is None
+    assert collection.docs[id]["lease_until"] is None
+    assert collection.docs[id]["due_at"].timestamp() == due_at
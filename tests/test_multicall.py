@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from eth_abi import decode, encode
+from werkzeug import Request, Response
+
+from app.core.blockchains import multicall
+
+TOKEN = "0x" + "11" * 20
+ACCOUNTS = ["0x" + f"{i:02x}" * 20 for i in range(1, 6)]
+NATIVE_BALANCES = {a: 10**18 * i for i, a in enumerate(ACCOUNTS, start=1)}
+TOKEN_BALANCES = {a: 10**6 * i for i, a in enumerate(ACCOUNTS, start=1)}
+
+
+def _aggregate3(data: str) -> str:
+    assert data.startswith("0x" + multicall.AGGREGATE3_SELECTOR.hex())
+    (calls,) = decode(["(address,bool,bytes)[]"], bytes.fromhex(data[10:]))
+    results = []
+    for target, _, calldata in calls:
+        target = target.lower()  # noqa: PLW2901
+        account = decode(["address"], calldata[4:])[0].lower()
+        if calldata[:4] == multicall.GET_ETH_BALANCE_SELECTOR and target == multicall.MULTICALL3_ADDRESS:
+            results.append((True, encode(["uint256"], [NATIVE_BALANCES[account]])))
+        elif calldata[:4] == multicall.BALANCE_OF_SELECTOR and target == TOKEN:
+            results.append((True, encode(["uint256"], [TOKEN_BALANCES[account]])))
+        else:
+            results.append((False, b""))
+    return "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+
+
+def stub_node(request: Request) -> Response:
+    body = json.loads(request.data)
+    requests = body if isinstance(body, list) else [body]
+    responses = [{"jsonrpc": "2.0", "id": r["id"], "result": _aggregate3(r["params"][0]["data"])} for r in requests]
+    return Response(json.dumps(responses if isinstance(body, list) else responses[0]), content_type="application/json")
+
+
+def test_get_balances(httpserver):
+    httpserver.expect_request("/", method="POST").respond_with_handler(stub_node)
+    items = [(a, None) for a in ACCOUNTS] + [(a, TOKEN) for a in ACCOUNTS] + [(ACCOUNTS[0], "0x" + "22" * 20)]
+
+    results = asyncio.run(multicall.get_balances(httpserver.url_for("/"), items))
+
+    assert [r.unwrap() for r in results[:5]] == [NATIVE_BALANCES[a] for a in ACCOUNTS]
+    assert [r.unwrap() for r in results[5:10]] == [TOKEN_BALANCES[a] for a in ACCOUNTS]
+    assert results[10].is_err()
+
+
+def test_get_balances_chunked(httpserver):
+    httpserver.expect_request("/", method="POST").respond_with_handler(stub_node)
+    items = [(a, TOKEN) for a in ACCOUNTS]
+
+    results = asyncio.run(multicall.get_balances(httpserver.url_for("/"), items, max_gas=2 * multicall.TOKEN_CALL_GAS))
+
+    assert [r.unwrap() for r in results] == [TOKEN_BALANCES[a] for a in ACCOUNTS]
+
+
+def test_split_chunks():
+    items = [(a, TOKEN) for a in ACCOUNTS]
+    assert multicall.split_chunks(items, max_gas=2 * multicall.TOKEN_CALL_GAS) == [[0, 1], [2, 3], [4]]
+    assert multicall.split_chunks(items, max_calldata_size=3 * multicall.CALL_CALLDATA_SIZE) == [[0, 1, 2], [3, 4]]
+    assert multicall.split_chunks([]) == []
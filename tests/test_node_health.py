@@ -0,0 +1,62 @@
+import time
+
+from mm_result import Result
+
+from app.core.health import FAILURES_TO_OPEN, BreakerState, Health, is_node_error
+from app.core.node_health import NodeSelector
+
+NODE1 = "https://node1.example"
+NODE2 = "https://node2.example"
+
+
+def test_is_node_error():
+    assert is_node_error(Result.err("timeout"))
+    assert is_node_error(Result.err("http_502"))
+    assert is_node_error(Result.err("rpc_error", context={"error": {"code": -32000, "message": "header not found"}}))
+    assert not is_node_error(Result.err("rpc_error", context={"error": {"code": 3, "message": "execution reverted"}}))
+    assert not is_node_error(Result.err("proxy_error"))
+    assert not is_node_error(Result.ok(1))
+
+
+def test_breaker_opens_after_consecutive_failures():
+    health = Health()
+    for _ in range(FAILURES_TO_OPEN - 1):
+        health.on_failure()
+    assert health.state == BreakerState.CLOSED
+    health.on_success(0.1)
+    assert health.consecutive_failures == 0
+
+    for _ in range(FAILURES_TO_OPEN):
+        health.on_failure()
+    assert health.state == BreakerState.OPEN
+    assert not health.try_probe()  # the cooldown is not over
+
+
+def test_failed_probe_doubles_cooldown():
+    health = Health()
+    health.on_failure(open_at_once=True)
+    health.opened_at = time.time() - health.cooldown
+
+    assert health.try_probe()
+    assert health.state == BreakerState.HALF_OPEN
+    health.on_failure()
+    assert health.state == BreakerState.OPEN
+    assert health.cooldown == 2 * Health.COOLDOWN_SECONDS
+
+    health.opened_at = time.time() - health.cooldown
+    assert health.try_probe()
+    health.on_success(0.1)
+    assert health.state == BreakerState.CLOSED
+    assert health.cooldown == Health.COOLDOWN_SECONDS
+
+
+def test_selector_skips_open_nodes():
+    selector = NodeSelector()
+    for _ in range(FAILURES_TO_OPEN):
+        selector.on_result(NODE1, 0.1, Result.err("timeout"))
+
+    assert {selector.choose([NODE1, NODE2]) for _ in range(20)} == {NODE2}
+    # every node is broken, the one closest to its probe is taken
+    selector.get(NODE2).on_failure(open_at_once=True)
+    selector.get(NODE1).opened_at -= 10
+    assert selector.choose([NODE1, NODE2]) == NODE1
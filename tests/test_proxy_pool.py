@@ -0,0 +1,56 @@
+import time
+
+from mm_result import Result
+
+from app.core.health import FAILURES_TO_OPEN, BreakerState
+from app.core.proxy_pool import ProxyHealth, ProxyPool
+
+PROXY1 = "socks5://proxy1:1080"
+PROXY2 = "socks5://proxy2:1080"
+
+
+def test_banned_proxy_is_quarantined_at_once():
+    pool = ProxyPool()
+    pool.update([PROXY1, PROXY2])
+    pool.on_result(PROXY1, 0.1, Result.err("http_403"))
+
+    health = pool.proxies[PROXY1]
+    assert health.state == BreakerState.OPEN
+    assert health.bans == 1
+    assert health.cooldown == ProxyHealth.COOLDOWN_SECONDS
+    assert {pool.choose() for _ in range(20)} == {PROXY2}
+    assert pool.get_active() == [PROXY2]
+
+
+def test_rate_limit_is_not_a_proxy_failure():
+    pool = ProxyPool()
+    pool.update([PROXY1])
+    for _ in range(FAILURES_TO_OPEN):
+        pool.on_result(PROXY1, 0.1, Result.err("http_429"))
+
+    health = pool.proxies[PROXY1]
+    assert health.state == BreakerState.CLOSED
+    assert health.failures == 0
+
+
+def test_quarantined_proxy_is_probed():
+    pool = ProxyPool()
+    pool.update([PROXY1, PROXY2])
+    for _ in range(FAILURES_TO_OPEN):
+        pool.on_result(PROXY1, 0.1, Result.err("proxy_error"))
+    health = pool.proxies[PROXY1]
+    assert health.state == BreakerState.OPEN
+
+    health.opened_at = time.time() - health.cooldown
+    assert pool.choose() == PROXY1
+    assert health.state == BreakerState.HALF_OPEN
+    pool.on_result(PROXY1, 0.1, Result.ok(1))
+    assert health.state == BreakerState.CLOSED
+
+
+def test_update_keeps_stats():
+    pool = ProxyPool()
+    pool.update([PROXY1])
+    pool.on_result(PROXY1, 0.1, Result.ok(1))
+    pool.update([PROXY1, PROXY2])
+    assert pool.proxies[PROXY1].requests == 1
@@ -0,0 +1,98 @@
+import asyncio
+import base64
+import json
+import struct
+
+from solders.pubkey import Pubkey
+from werkzeug import Request, Response
+
+from app.core.blockchains import solana
+
+MINT = "EPjFWdd5AufqSNqeM2qA1xTbTozLzjN9ZEKgsh1UT2ps"
+ACC1, ACC2, ACC3 = (str(Pubkey.new_unique()) for _ in range(3))
+ACCOUNTS = [ACC1, ACC2, ACC3]
+LAMPORTS = {ACC1: 10**9, ACC2: 2 * 10**9}  # ACC3 doesn't exist
+ATA_AMOUNTS = {ACC1: 12, ACC2: 0}  # ACC3 has no associated token account
+TOKEN_ACCOUNTS = {ACC1: [12], ACC2: [0], ACC3: [1]}  # amounts of all token accounts of the owner
+ATAS = {solana.associated_token_address(owner, MINT, solana.SPL_PROGRAM): owner for owner in ATA_AMOUNTS}
+
+
+def _token_account_data(mint: str, owner: str, amount: int) -> str:
+    data = bytes(Pubkey.from_string(mint)) + bytes(Pubkey.from_string(owner)) + struct.pack("<Q", amount)
+    return base64.b64encode(data.ljust(solana.TOKEN_ACCOUNT_MIN_SIZE, b"\0")).decode()
+
+
+def _account_info(address: str) -> dict[str, object] | None:
+    if address == MINT:
+        return {"owner": solana.SPL_PROGRAM, "lamports": 1, "data": ["", "base64"]}
+    if address in ATAS:
+        owner = ATAS[address]
+        return {
+            "owner": solana.SPL_PROGRAM,
+            "lamports": 1,
+            "data": [_token_account_data(MINT, owner, ATA_AMOUNTS[owner]), "base64"],
+        }
+    if address in LAMPORTS:
+        return {"lamports": LAMPORTS[address]}
+    return None
+
+
+def _result(method: str, params: list) -> object:
+    match method:
+        case "getMultipleAccounts":
+            return {"context": {"slot": 1}, "value": [_account_info(a) for a in params[0]]}
+        case "getTokenAccountsByOwner":
+            amounts = TOKEN_ACCOUNTS[params[0]]
+            accounts = [{"account": {"data": {"parsed": {"info": {"tokenAmount": {"amount": str(a)}}}}}} for a in amounts]
+            return {"context": {"slot": 1}, "value": accounts}
+        case "getBalance":
+            return {"context": {"slot": 1}, "value": LAMPORTS.get(params[0], 0)}
+    raise ValueError(method)
+
+
+def stub_node(request: Request) -> Response:
+    body = json.loads(request.data)
+    requests = body if isinstance(body, list) else [body]
+    responses = [{"jsonrpc": "2.0", "id": r["id"], "result": _result(r["method"], r["params"])} for r in requests]
+    return Response(json.dumps(responses if isinstance(body, list) else responses[0]), content_type="application/json")
+
+
+def test_get_balances_agree_with_get_balance(httpserver):
+    httpserver.expect_request("/", method="POST").respond_with_handler(stub_node)
+    url = httpserver.url_for("/")
+    items = [(a, None) for a in ACCOUNTS] + [(a, MINT) for a in ACCOUNTS]
+
+    async def run() -> tuple[list[int], list[int]]:
+        batch = await solana.get_balances(url, items)
+        single = [await solana.get_balance(url, account, token) for account, token in items]
+        return [r.unwrap() for r in batch], [r.unwrap() for r in single]
+
+    batch, single = asyncio.run(run())
+
+    assert batch == single == [10**9, 2 * 10**9, 0, 12, 0, 1]  # ACC3 is found by the owner scan
+
+
+def test_get_balances_reads_associated_token_accounts(httpserver):
+    httpserver.expect_request("/", method="POST").respond_with_handler(stub_node)
+
+    asyncio.run(solana.get_balances(httpserver.url_for("/"), [(ACC1, MINT), (ACC2, MINT)]))
+
+    methods = [json.loads(request.data)["method"] for request, _ in httpserver.log]
+    assert "getTokenAccountsByOwner" not in methods  # both have an associated token account
+
+
+def test_parse_token_account():
+    account_info = {"data": [_token_account_data(MINT, ACC1, 42), "base64"]}
+
+    assert solana.parse_token_account(account_info, MINT).unwrap() == 42
+    assert solana.parse_token_account(account_info, str(Pubkey.new_unique())).unwrap_err() == "invalid_token_account_mint"
+    assert solana.parse_token_account({"data": ["AAAA", "base64"]}, MINT).unwrap_err() == "invalid_token_account"
+
+
+def test_get_balances_invalid_response(httpserver):
+    value = [{"owner": "x"}, {"lamports": "1"}]
+    httpserver.expect_request("/", method="POST").respond_with_json({"jsonrpc": "2.0", "id": 1, "result": {"value": value}})
+
+    results = asyncio.run(solana.get_balances(httpserver.url_for("/"), [(ACC1, None), (ACC2, None)]))
+
+    assert [r.unwrap_err() for r in results] == ["invalid_account", "invalid_account"]